@@ -1,12 +1,17 @@
 from collections import namedtuple
 from copy import copy
 from itertools import chain
+import os
+import runpy
+import threading
+import time
 
 from flask import session
-import fastcache
 
 import config
+import metrics
 import util
+from util import log
 
 MAX_PARENT_REFERENCE_RESOLUTION_ROUNDS = 10
 CHANNEL_PREFIXES = '#&'
@@ -125,6 +130,114 @@ class Node:
         )
 
 
+def node_rank(node, scope):
+    """How a node sorts against the others that apply; lowest wins. The
+    verdict comes last, so the rank alone decides the verdict.
+    """
+    return (
+        Node.SCOPE_SPECIFICITY.index(scope),  # Order by nearest scope,
+        node.value == ANY,  # specific target over wildcard,
+        node.user == ANY,  # specific user over wildcard,
+        Node.VERDICT_DISAMBIGUATION.index(node.verdict),  # Deny over allow
+    )
+
+
+# Sorts after every real rank.
+NO_RULE = (len(Node.SCOPE_SPECIFICITY),)
+ALLOW_RANK = Node.VERDICT_DISAMBIGUATION.index(util.Verdict.ALLOW)
+
+# Indices into the pattern pairs, by whether a channel has a channel prefix.
+PREFIXED = 0
+UNPREFIXED = 1
+NO_PATTERNS = (NO_RULE, NO_RULE)
+
+
+def is_allowed(rank):
+    assert rank != NO_RULE  # We need at least one...
+
+    return rank[-1] == ALLOW_RANK
+
+
+class DecisionTable:
+    """The best rank of every rule applying to one user, laid out so that a
+    decision is a handful of dict lookups.
+
+    ``None`` as a network key stands for any network. Patterns are rules that
+    match whole classes of channel (ANY, PRIVATE_MESSAGE) rather than names.
+    """
+
+    def __init__(self):
+        self.networks = {}
+        self.any_network = NO_RULE
+        self.channels = {}
+        self.patterns = {}
+
+    def add_networks(self, networks, rank):
+        if networks is None:
+            self.any_network = min(self.any_network, rank)
+            return
+
+        for network in networks:
+            self.networks[network] = min(self.networks.get(network, NO_RULE), rank)
+
+    def add_channels(self, networks, channels, rank):
+        for network in (None,) if networks is None else networks:
+            table = self.channels.setdefault(network, {})
+
+            for channel in channels:
+                table[channel] = min(table.get(channel, NO_RULE), rank)
+
+    def add_pattern(self, networks, pattern, rank):
+        for network in (None,) if networks is None else networks:
+            ranks = self.patterns.setdefault(network, [NO_RULE, NO_RULE])
+            ranks[pattern] = min(ranks[pattern], rank)
+
+    def lookup(self, network, channel):
+        if not channel:
+            return min(self.networks.get(network, NO_RULE), self.any_network)
+
+        pattern = PREFIXED if channel[0] in CHANNEL_PREFIXES else UNPREFIXED
+
+        return min(
+            self.channels.get(network, {}).get(channel, NO_RULE),
+            self.channels.get(None, {}).get(channel, NO_RULE),
+            self.patterns.get(network, NO_PATTERNS)[pattern],
+            self.patterns.get(None, NO_PATTERNS)[pattern],
+        )
+
+    def filter_networks(self, networks):
+        return [
+            network for network in networks
+            if is_allowed(min(self.networks.get(network, NO_RULE), self.any_network))
+        ]
+
+    def filter_channels(self, network, channels):
+        # Narrow everything down to this network once, up front.
+        named = self.channels.get(network, {})
+        any_named = self.channels.get(None, {})
+        patterns = [
+            min(ranks)
+            for ranks in zip(self.patterns.get(network, NO_PATTERNS), self.patterns.get(None, NO_PATTERNS))
+        ]
+
+        allowed = []
+
+        for channel in channels:
+            if not channel:
+                rank = self.lookup(network, channel)
+            else:
+                rank = min(
+                    named.get(channel, NO_RULE),
+                    any_named.get(channel, NO_RULE),
+                    patterns[PREFIXED if channel[0] in CHANNEL_PREFIXES else UNPREFIXED],
+                )
+
+            if is_allowed(rank):
+                allowed.append(channel)
+
+        return allowed
+
+
 class AccessControl:
     # TODO: Enforce scope parent types
 
@@ -160,6 +273,94 @@ class AccessControl:
             if resolution_rounds > MAX_PARENT_REFERENCE_RESOLUTION_ROUNDS:
                 raise RuntimeError("Spent too much time resolving parent references, probably a node has a non-existent or misspelled parent", unresolved_nodes)
 
+        # Users named anywhere get a table each; everyone else shares one.
+        self.tables = {user: self._compile(user) for user in self._named_users()}
+        self.default_table = self._compile(None)
+
+    def _named_users(self):
+        users = set()
+        nodes = [self.rules] + list(self.wildcard_nodes)
+
+        while nodes:
+            node = nodes.pop()
+            if node.user != ANY:
+                users.update(value_multi(node.user))
+            nodes.extend(node.children)
+
+        return users
+
+    def _compile(self, user):
+        """Flatten everything that applies to ``user`` (None for anyone not
+        named in the rules) into a DecisionTable, mirroring _walk.
+        """
+        def applies(node):
+            if node.user == ANY:
+                return True
+            return user is not None and user in value_multi(node.user)
+
+        table = DecisionTable()
+
+        # (node, networks its ancestors restrict it to, reachable without a channel)
+        stack = [(child, None, True) for child in self.rules.children]
+
+        while stack:
+            node, networks, from_root = stack.pop()
+
+            if not applies(node):
+                continue
+
+            if node.scope == util.Scope.CHANNEL:
+                rank = node_rank(node, util.Scope.CHANNEL)
+                table.add_channels(networks, value_multi(node.value), rank)
+
+                if node.value == PRIVATE_MESSAGE:
+                    table.add_pattern(networks, UNPREFIXED, rank)
+            elif node.scope == util.Scope.NETWORK:
+                values = set(value_multi(node.value))
+
+                if from_root:
+                    table.add_networks(values, node_rank(node, util.Scope.NETWORK))
+
+                # Only channel decisions get past a network.
+                values = values if networks is None else networks & values
+                stack.extend((child, values, False) for child in node.children)
+            elif node.scope == util.Scope.ROOT:
+                stack.extend((child, networks, from_root) for child in node.children)
+
+        for node in self.wildcard_nodes:
+            if not applies(node):
+                continue
+
+            deny = node.verdict == util.Verdict.DENY
+
+            if node.scope in (util.Scope.CHANNEL, ANY):
+                if node.parent_scope == util.Scope.ROOT or node.parent_value == ANY:
+                    networks = None
+                else:
+                    networks = set(value_multi(node.parent_value))
+
+                rank = node_rank(node, util.Scope.CHANNEL)
+
+                # Wildcard ALLOWs don't apply if the target is actually a private message.
+                if node.value == ANY:
+                    table.add_pattern(networks, PREFIXED, rank)
+                    if deny:
+                        table.add_pattern(networks, UNPREFIXED, rank)
+                else:
+                    table.add_channels(networks, [
+                        channel for channel in value_multi(node.value)
+                        if channel and (channel[0] in CHANNEL_PREFIXES or deny)
+                    ], rank)
+
+                if node.value == PRIVATE_MESSAGE:
+                    table.add_pattern(networks, UNPREFIXED, rank)
+
+            if node.scope in (util.Scope.NETWORK, ANY):
+                rank = node_rank(node, util.Scope.NETWORK)
+                table.add_networks(None if node.value == ANY else value_multi(node.value), rank)
+
+        return table
+
     @property
     def user_email(self):
         user = session.get('user')
@@ -170,10 +371,32 @@ class AccessControl:
         return user.get('email')
 
     def evaluate(self, network, channel):
-        return self._evaluate(self.user_email, network, channel)
+        with metrics.stage('acl'):
+            return self._evaluate(self.user_email, network, channel)
+
+    def filter(self, network, channels):
+        """The ``channels`` of ``network`` the user may see, in order."""
+        with metrics.stage('acl'):
+            return self._filter(self.user_email, network, channels)
+
+    def filter_networks(self, networks):
+        """The ``networks`` the user may see, in order."""
+        with metrics.stage('acl'):
+            return self._table(self.user_email).filter_networks(networks)
+
+    def _table(self, user):
+        return self.tables.get(user, self.default_table)
 
-    @fastcache.clru_cache(maxsize=1024)
     def _evaluate(self, user, network, channel):
+        return is_allowed(self._table(user).lookup(network, channel))
+
+    def _filter(self, user, network, channels):
+        return self._table(user).filter_channels(network, channels)
+
+    def _walk(self, user, network, channel):
+        """Evaluate straight off the rule tree. The compiled tables are
+        built to agree with this, and the tests hold them to it.
+        """
         # From the tree.
         applicable = list(self.rules.find_rule(user, network, channel))
 
@@ -214,15 +437,109 @@ class AccessControl:
         # Prefer closest scope, matching user over wildcard
         applicable = sorted(
             applicable,
-            key=lambda node: (
-                Node.SCOPE_SPECIFICITY.index(node.scope),  # Order by nearest scope,
-                node.value == ANY,  # specific target over wildcard,
-                node.user == ANY,  # specific user over wildcard,
-                Node.VERDICT_DISAMBIGUATION.index(node.verdict),  # Deny over allow
-            ),
+            key=lambda node: node_rank(node, node.scope),
         )
 
         assert applicable  # We need at least one...
 
         rule = applicable[0]
         return rule.verdict == util.Verdict.ALLOW
+
+
+class PermissiveAccessControl:
+    """For offline tools, which get to see everything."""
+
+    def evaluate(self, network, channel):
+        return True
+
+    def filter(self, network, channels):
+        return list(channels)
+
+    def filter_networks(self, networks):
+        return list(networks)
+
+
+def load_rules(path):
+    """Read the rules out of an ACL file: Python, defining ACL just like the
+    config does.
+    """
+    return runpy.run_path(path)['ACL']
+
+
+class ReloadingAccessControl:
+    """An AccessControl read from its own file, which is watched and
+    recompiled in the background whenever the file changes.
+
+    Each AccessControl is left alone once built; a change swaps in a new one
+    along with the next generation number, so anything caching on the back of
+    ACL decisions can key on ``generation``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime_ns = os.stat(path).st_mtime_ns
+
+        # Read and replaced as a whole, so nobody sees half a swap.
+        self.state = (0, AccessControl(load_rules(path)))
+
+        self.watcher_pid = None
+        self.watcher_lock = threading.Lock()
+
+    @property
+    def generation(self):
+        return self.state[0]
+
+    @property
+    def current(self):
+        self._ensure_watcher()
+        return self.state[1]
+
+    def evaluate(self, network, channel):
+        return self.current.evaluate(network, channel)
+
+    def filter(self, network, channels):
+        return self.current.filter(network, channels)
+
+    def filter_networks(self, networks):
+        return self.current.filter_networks(networks)
+
+    def reload(self):
+        generation, _ = self.state
+        self.state = (generation + 1, AccessControl(load_rules(self.path)))
+
+    def _ensure_watcher(self):
+        # Threads don't survive uwsgi forking its workers, so each process
+        # starts its own on first use.
+        pid = os.getpid()
+
+        if self.watcher_pid == pid:
+            return
+
+        with self.watcher_lock:
+            if self.watcher_pid != pid:
+                threading.Thread(target=self._watch, daemon=True).start()
+                self.watcher_pid = pid
+
+    def _watch(self):
+        while True:
+            time.sleep(config.ACL_RELOAD_INTERVAL)
+
+            try:
+                mtime_ns = os.stat(self.path).st_mtime_ns
+            except OSError as e:
+                log("Can't stat ACL file {}, keeping the current rules: {}".format(self.path, e))
+                continue
+
+            if mtime_ns == self.mtime_ns:
+                continue
+
+            # Don't retry a broken file until it changes again.
+            self.mtime_ns = mtime_ns
+
+            try:
+                self.reload()
+            except Exception as e:
+                log("Can't load ACL file {}, keeping the current rules: {!r}".format(self.path, e))
+                continue
+
+            log("Reloaded ACL from {} (generation {})".format(self.path, self.generation))
@@ -0,0 +1,95 @@
+"""Admission control for searches.
+
+Slots are flock(2)ed files in SEARCH_LOCK_DIR, so the limits hold across
+every uwsgi worker, and a worker that dies takes its locks with it.
+"""
+from contextlib import contextmanager
+from hashlib import sha1
+from os.path import join
+import fcntl
+import os
+import time
+
+import config
+import exceptions
+import util
+
+GLOBAL_SLOT_PREFIX = 'global'
+CLIENT_SLOT_PREFIX = 'client'
+
+
+def _slot_paths(prefix, count):
+    return [
+        join(config.SEARCH_LOCK_DIR, '{}.{}.lock'.format(prefix, i))
+        for i in range(count)
+    ]
+
+
+def _client_slot_paths(client):
+    # Clients are emails or addresses; keep them out of the filesystem.
+    digest = sha1(client.encode('utf-8')).hexdigest()
+
+    return _slot_paths(
+        '{}.{}'.format(CLIENT_SLOT_PREFIX, digest),
+        config.SEARCH_CONCURRENT_PER_CLIENT,
+    )
+
+
+def _try_acquire(paths):
+    for path in paths:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+
+        return fd
+
+    return None
+
+
+def _acquire(paths, deadline):
+    """Take any free slot out of ``paths``, waiting in line until ``deadline``."""
+    while True:
+        fd = _try_acquire(paths)
+
+        if fd is not None:
+            return fd
+
+        if time.time() >= deadline:
+            raise exceptions.SearchBusyException()
+
+        time.sleep(config.SEARCH_QUEUE_POLL_INTERVAL)
+
+
+def _release(fd):
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+@contextmanager
+def admit(client):
+    """Hold one of the client's search slots and one of the global ones.
+
+    The per-client slot is taken first so that a single client queueing
+    up lots of searches can't sit on the global slots while waiting.
+    """
+    # Anyone who could make slots here could hold them all.
+    util.private_dir(config.SEARCH_LOCK_DIR)
+
+    deadline = time.time() + config.SEARCH_QUEUE_TIMEOUT
+
+    client_fd = _acquire(_client_slot_paths(client), deadline)
+    try:
+        global_fd = _acquire(
+            _slot_paths(GLOBAL_SLOT_PREFIX, config.SEARCH_CONCURRENT_TOTAL),
+            deadline,
+        )
+        try:
+            yield
+        finally:
+            _release(global_fd)
+    finally:
+        _release(client_fd)
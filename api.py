@@ -0,0 +1,188 @@
+"""JSON for the listings, logs and searches, for bots and scripts that would
+otherwise scrape the pages.
+
+Everything lives under PREFIX, so that a later version can change shape
+alongside this one. Answers that can run long come a page at a time, each
+with the cursor to fetch the next page with, or null on the last. Cursors
+are opaque to clients: only this module takes them apart.
+"""
+from base64 import urlsafe_b64decode
+from base64 import urlsafe_b64encode
+from datetime import date
+from datetime import timedelta
+from hashlib import sha1
+import binascii
+import json
+import re
+
+from flask import request
+from flask import Response
+
+import config
+import log_path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+VERSION = 1
+PREFIX = '/api/v{}'.format(VERSION)
+
+MIMETYPE = 'application/json'
+
+DATE_REGEX = re.compile(r'^\d{8}$')
+TIME_REGEX = re.compile(r'^(\d{2}):(\d{2})(?::(\d{2}))?$')
+
+RESOLUTIONS = ('day', 'hour')
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def respond(data, etag=None):
+    """A response of ``data``, tagged with ``etag`` or else a hash of the
+    body, and a 304 if the client has it already.
+    """
+    response = Response(dumps(data), mimetype=MIMETYPE)
+
+    if etag:
+        response.set_etag(etag)
+    else:
+        response.add_etag()
+
+    return response.make_conditional(request)
+
+
+def etag(key):
+    return sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def unchanged(etag):
+    """A 304 if the client already has ``etag``, so the body needn't be
+    built at all. Otherwise None.
+    """
+    if etag not in request.if_none_match:
+        return None
+
+    response = Response(status=304)
+    response.set_etag(etag)
+
+    return response
+
+
+def error(status, code, headers=None):
+    return Response(dumps({'error': code}), status, headers, mimetype=MIMETYPE)
+
+
+def encode_cursor(*parts):
+    return urlsafe_b64encode(':'.join(map(str, parts)).encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, count):
+    """The ``count`` integers in ``cursor``. Raises ValueError for anything
+    encode_cursor didn't make.
+    """
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+    except (binascii.Error, UnicodeError):
+        raise ValueError("Bad cursor", cursor)
+
+    parts = [int(part) for part in raw.split(':')]
+
+    if len(parts) != count:
+        raise ValueError("Bad cursor", cursor)
+
+    return parts
+
+
+def nonnegative(text):
+    value = int(text)
+
+    if value < 0:
+        raise ValueError("Negative", text)
+
+    return value
+
+
+def positive(text):
+    value = int(text)
+
+    if value < 1:
+        raise ValueError("Not positive", text)
+
+    return value
+
+
+def parse_date(text):
+    """A YYYYMMDD date."""
+    if not DATE_REGEX.match(text):
+        raise ValueError("Bad date", text)
+
+    return log_path.parse_date(text)
+
+
+def format_date(day):
+    return day.strftime('%Y%m%d')
+
+
+def activity_range(default_days):
+    """The ``since`` and ``until`` dates of an activity query, by default
+    the last ``default_days`` up to today, and whether it's by hour.
+    Raises ValueError for a bad one, or one over API_ACTIVITY_MAX_DAYS.
+    """
+    args = request.args
+
+    until = parse_date(args['until']) if 'until' in args else date.today()
+    since = parse_date(args['since']) if 'since' in args else until - timedelta(days=default_days - 1)
+    resolution = args.get('resolution', RESOLUTIONS[0])
+
+    if resolution not in RESOLUTIONS:
+        raise ValueError("Bad resolution", resolution)
+
+    if not 0 <= (until - since).days < config.API_ACTIVITY_MAX_DAYS:
+        raise ValueError("Bad range", since, until)
+
+    return since, until, resolution == 'hour'
+
+
+def parse_time(text, default_seconds='00'):
+    """HH:MM or HH:MM:SS as HH:MM:SS, comparable with the times on lines."""
+    m = TIME_REGEX.match(text)
+
+    if not m:
+        raise ValueError("Bad time", text)
+
+    hours, minutes, seconds = m.groups()
+
+    return '{}:{}:{}'.format(hours, minutes, seconds or default_seconds)
+
+
+def line_time(line):
+    """The HH:MM:SS a line was logged at, or None."""
+    if line[:1] == '[' and line[9:10] == ']':
+        return line[1:9]
+
+    return None
+
+
+def log_line(line_no, line):
+    return {'line_no': line_no, 'line': line.rstrip('\n')}
+
+
+def hit(hit):
+    """A grep Hit, with its Lines."""
+    return {
+        'channel': hit.channel,
+        'date': hit.date,
+        'begin': int(hit.begin),
+        'lines': [{
+            'line_no': int(line.line_no),
+            'line': line.line,
+            'hit': line.line_marker == ':',
+        } for line in hit.lines],
+    }
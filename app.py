@@ -1,30 +1,52 @@
+import startup  # noqa: starts the clock
 import monkey_patch  # noqa
 
+from bisect import bisect_right
+from datetime import date as date_
+from time import perf_counter
+import select
+import socket
+import time
+
 from babel import negotiate_locale
 from flask import Flask
 from flask import abort
 from flask import g
 from flask import redirect
 from flask import request
-from flask import render_template
+from flask import render_template as flask_render_template
 from flask import Response
+from flask import session
+from flask import stream_with_context
 from flask import url_for
 from flask_babel import Babel
+from flask_babel import get_locale as babel_locale
+from jinja2 import FileSystemBytecodeCache
 from werkzeug.contrib.fixers import ProxyFix
 from werkzeug.contrib.profiler import ProfilerMiddleware
 
+import admission
+import api
 import config
 import exceptions
 import grep
+import line_format
 import log_path
+import metrics
+import profiling
+import response_cache
+import revision
+import stats
+import tail
 import util
 
 # Must import to run decorator
 import template_context  # noqa
-import line_format  # noqa
 
 
 from acl import AccessControl
+from acl import PermissiveAccessControl
+from acl import ReloadingAccessControl
 from forms import AjaxSearchForm
 from forms import SearchForm
 
@@ -32,10 +54,82 @@ from forms import SearchForm
 if config.DEBUG_PYINSTRUMENT:
     from pyinstrument import Profiler
 
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
 
 app = Flask(__name__)
 babel = Babel(app)
 
+SEARCH_BUSY_RETRY_AFTER = 1
+
+# Template output is sent in batches of this many pieces.
+STREAM_BUFFER_SIZE = 128
+
+# Open for as long as someone's watching, which says nothing of how long
+# we take to answer.
+UNTIMED_ENDPOINTS = ('log_stream',)
+
+
+def render_template(template_name, **context):
+    with metrics.stage('render'):
+        return flask_render_template(template_name, **context)
+
+
+def stream_template(template_name, **context):
+    """Like render_template, but sends the page as it renders so that the
+    top of a long log shows up before the bottom is done.
+    """
+    app.update_template_context(context)
+
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+
+    return Response(stream_with_context(metrics.timed_iter('render', stream)))
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = perf_counter()
+    metrics.start_request()
+
+    if profiling.wanted(request.headers.get(profiling.HEADER)):
+        g.sampler = profiling.Sampler().start()
+
+
+@app.after_request
+def stop_request_timer(response):
+    started = g.request_started
+    endpoint = request.endpoint
+    sampler = g.get('sampler')
+
+    if config.SERVER_TIMING:
+        # Streamed pages are still to be rendered at this point.
+        response.headers['Server-Timing'] = metrics.server_timing(perf_counter() - started)
+
+    # On close, so that streamed responses count in full.
+    def close():
+        if endpoint not in UNTIMED_ENDPOINTS:
+            metrics.observe_request(endpoint, perf_counter() - started)
+
+        if sampler is not None:
+            sampler.stop()
+            sampler.save(endpoint)
+
+    response.call_on_close(close)
+
+    return response
+
+
+@app.route('/metrics')
+def metrics_():
+    if request.remote_addr not in config.METRICS_ALLOWED_ADDRESSES:
+        abort(404)
+
+    return Response(metrics.exposition(), mimetype='text/plain; version=0.0.4')
+
 
 @app.route('/')
 def index():
@@ -51,14 +145,14 @@ def network(network):
     except exceptions.NoResultsException:
         abort(404)
 
-    return render_template('network.html', network=network, channels=channels)
+    return render_template('network.html', network=network, channels=channels, activity=bool(config.STATS_DIR))
 
 
 @app.route('/<network>/<channel>/')
 def channel(network, channel):
     try:
         dates = paths.channel_dates(network, channel)
-        return render_template('channel.html', network=network, channel=channel, dates=dates)
+        return render_template('channel.html', network=network, channel=channel, dates=dates, day_stats=channel_stats(network, channel))
     except exceptions.NoResultsException as ex:
         abort(404)
     except exceptions.MultipleResultsException as ex:
@@ -73,14 +167,46 @@ def channel(network, channel):
 channel_ = channel
 
 
+def channel_stats(network, channel):
+    """The ChannelStats of a channel, brought up to date, or None."""
+    if not config.STATS_DIR:
+        return None
+
+    logs = paths.channel_logs(network, channel)
+
+    with metrics.stage('stats'):
+        try:
+            # Closed days take too long to count here; tallier.py does those.
+            return stats.update(logs, network, backfill=False)
+        except OSError as ex:
+            # A full disk or an unwritable store shouldn't take the page down.
+            util.log("Couldn't update the stats of {} on {}: {}".format(channel, network, ex))
+            return None
+
+
 @app.route('/<network>/<channel>/<date>')
 def log(network, channel, date):
     try:
         log = paths.log(network, channel, date)
 
         pagination_control = 1 + sum(bool(maybe) for maybe in (log.before, log.after))
+        live = config.TAIL_ENABLED and log.after is None and log_path.parse_date(date) == date_.today()
+        context = dict(network=network, channel=channel, date=date, pagination_control=pagination_control, log=log, live=live)
+
+        encoding = response_cache.negotiate()
+        if encoding and is_closed(date):
+            # The ACL has had its say by now; all that's left of the user
+            # on the page is the greeting, and of the request the login
+            # link back to it.
+            user = session.get('user') or {}
+            key = (
+                'log', network, channel, date, log.before, log.after, log.stamp,
+                g.get('canonical_url'), request.full_path, str(babel_locale()), user.get('given_name'), revision.current(),
+            )
+
+            return response_cache.respond(key, encoding, lambda: render_template('log.html', **context), 'text/html')
 
-        return render_template('log.html', network=network, channel=channel, date=date, pagination_control=pagination_control, log=log)
+        return stream_template('log.html', **context)
     except exceptions.NoResultsException as ex:
         abort(404)
     except exceptions.MultipleResultsException as ex:
@@ -101,10 +227,16 @@ def log(network, channel, date):
 def log_raw(network, channel, date):
     try:
         log = paths.log(network, channel, date)
-        # Don't look, kids!
-        _, (log_lines_only, _) = log.log.__reduce__()
-        log_text = ''.join(list(log_lines_only))
-        return Response(log_text, mimetype='text/plain')
+
+        def render():
+            return ''.join(line for _, line in log.log)
+
+        encoding = response_cache.negotiate()
+        if encoding and is_closed(date):
+            key = ('raw', network, channel, date, log.stamp)
+            return response_cache.respond(key, encoding, render, 'text/plain')
+
+        return Response(render(), mimetype='text/plain')
 
     except exceptions.NoResultsException as ex:
         abort(404)
@@ -121,9 +253,47 @@ def log_raw(network, channel, date):
         return redirect(url_for('log_raw', network=network, channel=channel, date=date))
 
 
+@app.route('/<network>/<channel>/today/stream')
+def log_stream(network, channel):
+    """Server-sent events of today's log as it's written."""
+    if not config.TAIL_ENABLED:
+        abort(404)
+
+    try:
+        logs = paths.channel_logs(network, channel)
+    except (exceptions.NoResultsException, exceptions.MultipleResultsException):
+        abort(404)
+    except exceptions.CanonicalNameException as ex:
+        _, canonical_channel = ex.args
+        return redirect(url_for('log_stream', network=network, channel=canonical_channel))
+
+    latest = len(logs) - 1
+
+    # Nothing's been said today, yet.
+    if logs.date_obj(latest) != date_.today():
+        abort(404)
+
+    events = tail.stream(
+        logs.path(latest),
+        logs.dates[latest],
+        request.headers.get('Last-Event-ID') or request.args.get('after'),
+    )
+
+    return Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Or nginx holds on to events until it has a bufferful.
+        'X-Accel-Buffering': 'no',
+    })
+
+
 log_ = log
 
 
+def is_closed(date):
+    """Whether nothing more gets logged on ``date``."""
+    return log_path.parse_date(date) < date_.today()
+
+
 @app.route('/search/')
 def search():
     # TODO: Expose multi-channel search
@@ -145,7 +315,10 @@ def search():
         except exceptions.MultipleResultsException:
             return render_template('error/multiple_results.html', network=network, channel=channel)
 
-        max_segment = grep.max_segment(dates[-1]['date_obj'])
+        if not dates:
+            abort(404)
+
+        max_segment = grep.max_segment(min(logs.date_obj(0) for logs in dates))
 
         return render_template('search_ajax.html', valid=valid, form=form, network=network, channel=channel, author=form.author.data, query=form.text.data, max_segment=max_segment)
 
@@ -154,14 +327,14 @@ def search():
         if not valid:
             results = []
         else:
-            results = grep.run(
+            results = run_search(
                 channels=[channel],
                 network=network,
                 author=form.author.data,
                 query=form.text.data,
             )
 
-        return render_template('search.html', valid=valid, form=form, network=network, channel=channel, results=results)
+        return stream_template('search.html', valid=valid, form=form, network=network, channel=channel, results=results)
 
 
 @app.route('/search/chunk')
@@ -175,7 +348,7 @@ def search_ajax_chunk():
     if not valid:
         results = []
     else:
-        results = grep.run(
+        results = run_search(
             channels=[form.channel.data],
             network=form.network.data,
             author=form.author.data,
@@ -186,11 +359,395 @@ def search_ajax_chunk():
     return render_template('search_result.html', network=form.network.data, channels=[form.channel.data], results=results)
 
 
+def run_search(**kwargs):
+    with admission.admit(search_client()), metrics.stage('grep'):
+        return grep.run(cancelled=client_disconnected, **kwargs)
+
+
+def search_client():
+    """Who a search counts against: the logged in user, or else their address."""
+    user = session.get('user')
+
+    if user and user.get('email'):
+        return user['email']
+
+    return request.remote_addr or ''
+
+
+def client_disconnected():
+    """Only uwsgi lets us at the client connection. Elsewhere, assume they're
+    still around.
+    """
+    if uwsgi is None:
+        return False
+
+    fd = uwsgi.connection_fd()
+
+    # The request has already been read, so the socket only becomes
+    # readable again once the client hangs up.
+    readable, _, _ = select.select([fd], [], [], 0)
+    if not readable:
+        return False
+
+    with socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM) as conn:
+        try:
+            return not conn.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+
+
+# Lookups that the API answers for itself, rather than with an error page.
+API_LOOKUP_ERRORS = (
+    exceptions.NoResultsException,
+    exceptions.MultipleResultsException,
+    exceptions.CanonicalNameException,
+)
+
+# Activity covers this many days up to today by default: a calendar year
+# of whole weeks for a channel, and a week for a network.
+API_CHANNEL_ACTIVITY_DAYS = 53 * 7
+API_NETWORK_ACTIVITY_DAYS = 7
+
+
+@app.route(api.PREFIX + '/networks')
+def api_networks():
+    return api.respond({'networks': paths.networks()})
+
+
+@app.route(api.PREFIX + '/networks/<network>/channels')
+def api_channels(network):
+    try:
+        channels = paths.channels(network)
+    except API_LOOKUP_ERRORS as ex:
+        return api_lookup_failed(ex)
+
+    return api.respond({'network': network, 'channels': channels})
+
+
+@app.route(api.PREFIX + '/networks/<network>/channels/<channel>/dates')
+def api_dates(network, channel):
+    """Newest first, with each day's size and line count."""
+    try:
+        logs = paths.channel_logs(network, channel)
+    except API_LOOKUP_ERRORS as ex:
+        return api_lookup_failed(ex)
+
+    cursor = request.args.get('cursor')
+
+    if cursor:
+        try:
+            ordinal, = api.decode_cursor(cursor, 1)
+        except ValueError:
+            return api.error(400, 'bad_request')
+
+        # The newest day up to the cursor, even if that day has gone since.
+        newest = bisect_right(logs.ordinals, ordinal) - 1
+    else:
+        newest = len(logs) - 1
+
+    oldest = max(0, newest - config.API_PAGE_SIZE + 1)
+    days = [logs.summary(i) for i in range(newest, oldest - 1, -1)]
+
+    return api.respond({
+        'network': network,
+        'channel': channel,
+        'dates': [day._asdict() for day in days],
+        'cursor': api.encode_cursor(logs.ordinals[oldest - 1]) if oldest > 0 else None,
+    })
+
+
+@app.route(api.PREFIX + '/networks/<network>/channels/<channel>/logs/<date>')
+def api_log(network, channel, date):
+    """Lines of a day. Either every line, or those from ``line``, or those
+    logged between the times ``from`` and ``until``, and in either case
+    ``before`` and ``after`` lines either side.
+    """
+    args = request.args
+
+    try:
+        # Not args.get(type=...), which takes a bad value for a missing one.
+        before = api.nonnegative(args['before']) if 'before' in args else 0
+        after = api.nonnegative(args['after']) if 'after' in args else 0
+        line = api.positive(args['line']) if 'line' in args else None
+        # Until a minute is until the end of it.
+        times = [
+            api.parse_time(args[arg], default_seconds) if arg in args else None
+            for arg, default_seconds in (('from', '00'), ('until', '59'))
+        ]
+
+        if args.get('cursor'):
+            start, stop = api.decode_cursor(args['cursor'], 2)
+            # To the end of the day.
+            if stop == -1:
+                stop = None
+            if start < 0 or stop is not None and stop < start:
+                raise ValueError("Bad cursor")
+        elif line is not None:
+            start, stop = max(0, line - 1 - before), line + after
+        else:
+            start, stop = 0, None
+    except ValueError:
+        return api.error(400, 'bad_request')
+
+    # Times can only be found by reading the whole day.
+    by_time = any(times) and not args.get('cursor')
+
+    # One more than a page, to know whether there's more.
+    if by_time:
+        lines = None
+    elif stop is None:
+        lines = (start, start + config.API_LINES_PAGE_SIZE + 1)
+    else:
+        lines = (start, min(stop, start + config.API_LINES_PAGE_SIZE + 1))
+
+    try:
+        log = paths.log(network, channel, date, lines)
+    except API_LOOKUP_ERRORS as ex:
+        return api_lookup_failed(ex)
+
+    etag = api.etag(('api-log', network, channel, date, request.query_string, log.stamp))
+    not_modified = api.unchanged(etag)
+    if not_modified:
+        return not_modified
+
+    log_lines = list(log.log)
+
+    if by_time:
+        begin, end = times
+        matching = [
+            i for i, time in enumerate(api.line_time(text) for _, text in log_lines)
+            if time and (not begin or time >= begin) and (not end or time <= end)
+        ]
+
+        if matching:
+            start, stop = max(0, matching[0] - before), matching[-1] + 1 + after
+        else:
+            start, stop = 0, 0
+
+        log_lines = log_lines[start:min(stop, start + config.API_LINES_PAGE_SIZE + 1)]
+
+    cursor = None
+    if len(log_lines) > config.API_LINES_PAGE_SIZE:
+        log_lines = log_lines[:config.API_LINES_PAGE_SIZE]
+        next_start = start + config.API_LINES_PAGE_SIZE
+
+        if stop is None or next_start < stop:
+            cursor = api.encode_cursor(next_start, stop if stop is not None else -1)
+
+    return api.respond({
+        'network': network,
+        'channel': channel,
+        'date': date,
+        'previous_date': log.before,
+        'next_date': log.after,
+        'lines': [api.log_line(line_no, text) for line_no, text in log_lines],
+        'cursor': cursor,
+    }, etag=etag)
+
+
+@app.route(api.PREFIX + '/networks/<network>/channels/<channel>/search')
+def api_search(network, channel):
+    """Hits for ``q``, optionally by ``author``, newest first, on days from
+    ``since`` until ``until`` inclusive.
+
+    Each page greps at most API_SEARCH_PAGE_DAYS days of logs, so a page can
+    come back short, or empty, with a cursor to carry on further back from.
+    """
+    args = request.args
+    query = args.get('q')
+
+    if not query:
+        return api.error(400, 'bad_request')
+
+    try:
+        since = api.parse_date(args['since']).toordinal() if 'since' in args else None
+        until = api.parse_date(args['until']).toordinal() if 'until' in args else None
+
+        below = None
+        if args.get('cursor'):
+            below = tuple(api.decode_cursor(args['cursor'], 2))
+    except ValueError:
+        return api.error(400, 'bad_request')
+
+    try:
+        logs = paths.channel_logs(network, channel)
+    except API_LOOKUP_ERRORS as ex:
+        return api_lookup_failed(ex)
+
+    # Days with anything left to find: hits start on line 1 or later.
+    days = [
+        ordinal for ordinal in logs.ordinals
+        if (since is None or ordinal >= since)
+        and (until is None or ordinal <= until)
+        and (below is None or (ordinal, 1) < below)
+    ]
+    window = days[-config.API_SEARCH_PAGE_DAYS:]
+
+    if not window:
+        results = None
+    else:
+        try:
+            results = run_search(
+                channels=[channel],
+                network=network,
+                author=args.get('author'),
+                query=query,
+                date_range=[date_.fromordinal(window[0] - 1), date_.fromordinal(window[-1])],
+            )
+        except exceptions.NoResultsException:
+            return api.error(404, 'not_found')
+        except exceptions.SearchBusyException:
+            return api.error(429, 'busy', {'Retry-After': SEARCH_BUSY_RETRY_AFTER})
+        except exceptions.SearchTimeoutException:
+            return api.error(504, 'timeout')
+
+    hits = [
+        (log_path.parse_date(hit.date).toordinal(), int(hit.begin), hit)
+        for day in results or []
+        for hit in day
+    ]
+
+    # Hits come newest first, so the next page picks up below the cursor.
+    if below:
+        hits = [entry for entry in hits if entry[:2] < below]
+
+    page = hits[:config.API_SEARCH_PAGE_SIZE]
+
+    if len(hits) > len(page):
+        cursor = api.encode_cursor(*page[-1][:2])
+    elif len(days) > len(window):
+        # Everything below the oldest day searched.
+        cursor = api.encode_cursor(window[0], 0)
+    else:
+        cursor = None
+
+    return api.respond({
+        'network': network,
+        'channel': channel,
+        'hits': [api.hit(hit) for _, _, hit in page],
+        'cursor': cursor,
+    })
+
+
+@app.route(api.PREFIX + '/networks/<network>/channels/<channel>/activity')
+def api_channel_activity(network, channel):
+    """Messages on each day from ``since`` until ``until`` inclusive, or
+    with ``resolution=hour`` in each hour of them, oldest first.
+    """
+    try:
+        since, until, hourly = api.activity_range(API_CHANNEL_ACTIVITY_DAYS)
+    except ValueError:
+        return api.error(400, 'bad_request')
+
+    if not config.STATS_DIR:
+        return api.error(404, 'not_found')
+
+    try:
+        day_stats = channel_stats(network, channel)
+    except API_LOOKUP_ERRORS as ex:
+        return api_lookup_failed(ex)
+
+    if day_stats is None:
+        return api.error(503, 'unavailable')
+
+    return api.respond({
+        'network': network,
+        'channel': channel,
+        'since': api.format_date(since),
+        'until': api.format_date(until),
+        'resolution': 'hour' if hourly else 'day',
+        'counts': day_stats.activity(since, until, hourly).tolist(),
+    })
+
+
+@app.route(api.PREFIX + '/networks/<network>/activity')
+def api_network_activity(network):
+    """As api_channel_activity, for each of a network's channels, from the
+    stats as they stand: this doesn't count anything itself, or it would be
+    counting every channel's open days on every request.
+    """
+    try:
+        since, until, hourly = api.activity_range(API_NETWORK_ACTIVITY_DAYS)
+    except ValueError:
+        return api.error(400, 'bad_request')
+
+    if not config.STATS_DIR:
+        return api.error(404, 'not_found')
+
+    try:
+        channels = paths.channels(network)
+    except API_LOOKUP_ERRORS as ex:
+        return api_lookup_failed(ex)
+
+    activity = []
+
+    with metrics.stage('stats'):
+        try:
+            for channel in channels:
+                day_stats = stats.load(network, channel)
+
+                # Never counted, or without any logs of its own.
+                if not day_stats.days:
+                    continue
+
+                activity.append({'channel': channel, 'counts': day_stats.activity(since, until, hourly).tolist()})
+        except OSError as ex:
+            util.log("Couldn't load the stats of {}: {}".format(network, ex))
+            return api.error(503, 'unavailable')
+
+    return api.respond({
+        'network': network,
+        'since': api.format_date(since),
+        'until': api.format_date(until),
+        'resolution': 'hour' if hourly else 'day',
+        'channels': activity,
+    })
+
+
+def api_lookup_failed(ex):
+    """The API's answer to a network, channel or date that didn't turn up
+    as asked for: canonical names redirect, as the pages do.
+    """
+    if isinstance(ex, exceptions.MultipleResultsException):
+        return api.error(409, 'ambiguous')
+
+    if isinstance(ex, exceptions.CanonicalNameException):
+        info_type, canonical_data = ex.args
+
+        view_args = dict(request.view_args)
+        if info_type == util.Scope.CHANNEL:
+            view_args['channel'] = canonical_data
+        elif info_type == util.Scope.DATE:
+            view_args['date'] = canonical_data
+
+        return redirect(url_for(request.endpoint, **dict(request.args.to_dict(), **view_args)))
+
+    return api.error(404, 'not_found')
+
+
 @app.errorhandler(404)
 def not_found(ex):
     return render_template('error/not_found.html'), 404
 
 
+@app.errorhandler(exceptions.SearchBusyException)
+def search_busy(ex):
+    return render_template('error/search_busy.html'), 429, {'Retry-After': SEARCH_BUSY_RETRY_AFTER}
+
+
+@app.errorhandler(exceptions.SearchTimeoutException)
+def search_timeout(ex):
+    return render_template('error/search_timeout.html'), 504
+
+
+@app.errorhandler(exceptions.SearchCancelledException)
+def search_cancelled(ex):
+    # Nobody is listening anymore.
+    return '', 499
+
+
 @babel.localeselector
 def get_locale():
     from_cookie = request.cookies.get('lang', None)
@@ -213,14 +770,67 @@ def output_profiler(response):
     return response
 
 
+def precompile_templates():
+    """Load every template now, so that no worker's first requests pay for
+    compiling them.
+    """
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+
+def warm_up():
+    """Fill the caches worth sharing before uwsgi forks the workers: every
+    network's channel index, and the formatting of each channel's latest day.
+    """
+    paths.warm_up()
+
+    # Formatting doesn't depend on who's looking.
+    reader = getattr(log_path, config.LOG_PATH_CLASS)(PermissiveAccessControl())
+
+    for network in reader.networks():
+        try:
+            channels = reader.channels(network)
+        except exceptions.NoResultsException:
+            continue
+
+        for channel in channels:
+            try:
+                latest = reader.channel_dates(network, channel)[0]
+                log = reader.log(network, channel, latest)
+            except (
+                exceptions.NoResultsException,
+                exceptions.MultipleResultsException,
+                exceptions.CanonicalNameException,
+            ):
+                continue
+
+            # The same calls, in the same form, as the filters in log.html.
+            for line_no, line in log.log:
+                line_format.line_style(
+                    line_format.irc_format(line_format.clinkify(line)),
+                    line_no,
+                    is_search=False,
+                )
+
+
 def create():
     global paths, grep
 
-    paths = getattr(log_path, config.LOG_PATH_CLASS)(AccessControl(config.ACL))
+    startup.record('imports', time.time() - startup.STARTED)
+
+    with startup.phase('acl'):
+        if config.ACL_FILE:
+            ac = ReloadingAccessControl(config.ACL_FILE)
+        else:
+            ac = AccessControl(config.ACL)
+
+    paths = getattr(log_path, config.LOG_PATH_CLASS)(ac)
     grep = getattr(grep, config.GREP_BUILDER_CLASS)(paths)
 
     util.register_context_processors(app)
-    util.register_template_filters(app)
+    util.register_template_filters(app, wrap=metrics.timed_filter if config.SERVER_TIMING else None)
+
+    revision.refresh()
 
     from auth import auth
     app.register_blueprint(auth, url_prefix='/auth')
@@ -229,8 +839,27 @@ def create():
     # Produces actual debug under internal server. Produces stderr under uwsgi
     app.debug = True
 
-    # Not app.jinja_options, because ???
-    # app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+    # Not app.jinja_options: that only counts before jinja_env is first
+    # touched, and Babel(app) has touched it already.
+    if config.TEMPLATE_CACHE:
+        # Jinja makes and checks its own directory the same way.
+        if config.TEMPLATE_CACHE_DIR:
+            bytecode_cache = FileSystemBytecodeCache(util.private_dir(config.TEMPLATE_CACHE_DIR))
+        else:
+            bytecode_cache = FileSystemBytecodeCache()
+
+        app.jinja_env.bytecode_cache = bytecode_cache
+
+    if config.TEMPLATE_PRECOMPILE:
+        with startup.phase('templates'):
+            precompile_templates()
+
+    if config.WARM_UP:
+        with startup.phase('warm-up'):
+            warm_up()
+
+    # After the last of the routes and cached functions are in.
+    metrics.init([endpoint for endpoint in app.view_functions if endpoint not in UNTIMED_ENDPOINTS])
 
     if config.FLASK_PROXY:
         app.wsgi_app = ProxyFix(app.wsgi_app)
@@ -243,6 +872,11 @@ def create():
         app.before_request(inject_profiler)
         app.after_request(output_profiler)
 
+    startup.report()
+
+    if uwsgi is not None:
+        uwsgi.post_fork_hook = startup.forked
+
     return app
 
 
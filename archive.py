@@ -0,0 +1,144 @@
+"""Compressed log archives for closed days.
+
+A compressed day is a gzip file made of independent members of
+BLOCK_LINES lines each, so zcat and zgrep still read it like any other
+gzip file. Next to it sits a block index of (compressed offset, first line)
+pairs so that a window of lines can be read without inflating the whole day.
+"""
+from array import array
+from bisect import bisect_right
+from io import BytesIO
+from io import TextIOWrapper
+from itertools import islice
+import gzip
+import os
+import zlib
+
+COMPRESSED_SUFFIX = '.gz'
+INDEX_SUFFIX = '.idx'
+TEMP_SUFFIX = '.tmp'
+
+BLOCK_LINES = 1024
+COMPRESS_LEVEL = 9
+
+# Only gzip members, please.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def is_compressed(path):
+    return path.endswith(COMPRESSED_SUFFIX)
+
+
+def read_index(path):
+    """Return (offsets, first_lines) for a compressed log, or None if it has
+    no index.
+    """
+    try:
+        with open(path + INDEX_SUFFIX, 'rb') as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return None
+
+    index = array('Q')
+
+    # Torn, somehow: better to read the whole day than trust it.
+    if len(raw) % (2 * index.itemsize):
+        return None
+
+    index.frombytes(raw)
+
+    return index[0::2], index[1::2]
+
+
+def read_lines(path, start=0, stop=None):
+    """Read lines [start, stop) of a log, counting from zero, decoded the same
+    way open() would.
+    """
+    if not is_compressed(path):
+        with open(path, errors='ignore') as f:
+            if start == 0 and stop is None:
+                return f.readlines()
+            return list(islice(f, start, stop))
+
+    index = read_index(path)
+
+    if index is None or (start == 0 and stop is None):
+        with gzip.open(path, 'rt', errors='ignore') as f:
+            return list(islice(f, start, stop))
+
+    offsets, first_lines = index
+
+    if not offsets:
+        return []
+
+    first_block = max(0, bisect_right(first_lines, start) - 1)
+    if stop is None:
+        last_block = len(offsets)
+    else:
+        last_block = max(first_block + 1, bisect_right(first_lines, stop - 1))
+
+    with open(path, 'rb') as f:
+        f.seek(offsets[first_block])
+        if last_block < len(offsets):
+            raw = f.read(offsets[last_block] - offsets[first_block])
+        else:
+            raw = f.read()
+
+    lines = TextIOWrapper(BytesIO(_inflate_members(raw)), errors='ignore').readlines()
+
+    skip = start - first_lines[first_block]
+    if stop is None:
+        return lines[skip:]
+    return lines[skip:skip + stop - start]
+
+
+def _inflate_members(raw):
+    out = []
+
+    while raw:
+        inflater = zlib.decompressobj(GZIP_WBITS)
+        out.append(inflater.decompress(raw))
+        raw = inflater.unused_data
+
+    return b''.join(out)
+
+
+def compress(path):
+    """Compress a plain log in place, writing its block index alongside."""
+    compressed_path = path + COMPRESSED_SUFFIX
+    temp_path = compressed_path + TEMP_SUFFIX
+
+    index = array('Q')
+
+    with open(path, 'rb') as src, open(temp_path, 'wb') as dst:
+        line_no = 0
+
+        while True:
+            block = list(islice(src, BLOCK_LINES))
+            if not block:
+                break
+
+            index.extend((dst.tell(), line_no))
+            dst.write(gzip.compress(b''.join(block), compresslevel=COMPRESS_LEVEL))
+            line_no += len(block)
+
+        dst.flush()
+        os.fsync(dst.fileno())
+
+    index_path = compressed_path + INDEX_SUFFIX
+    index_temp_path = index_path + TEMP_SUFFIX
+
+    with open(index_temp_path, 'wb') as f:
+        index.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    # The index goes first, so that it's whole by the time the day is.
+    os.rename(index_temp_path, index_path)
+
+    # Readers see either the plain or the compressed file, never neither;
+    # listings prefer the compressed one while there are both.
+    os.rename(temp_path, compressed_path)
+    os.unlink(path)
+
+    return compressed_path
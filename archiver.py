@@ -0,0 +1,52 @@
+"""Compress closed log days; see archive.py.
+
+Run from cron, e.g. ``python archiver.py --older-than 30``.
+"""
+from datetime import date
+from datetime import timedelta
+import argparse
+
+import archive
+import config
+import exceptions
+import log_path
+from acl import PermissiveAccessControl
+from util import log
+
+
+def compress_older_than(paths, days):
+    # Never today's, which is still being written to.
+    cutoff = min(date.today() - timedelta(days=days), date.today() - timedelta(days=1))
+
+    for network in paths.networks():
+        try:
+            channels = paths.channels(network)
+        except exceptions.NoResultsException:
+            continue
+
+        for channel in channels:
+            for logs in paths.channels_dates(network, [channel]):
+                for i in logs.between(date_end=cutoff):
+                    if logs.packed[i]:
+                        continue
+
+                    path = logs.path(i)
+
+                    if archive.is_compressed(path):
+                        continue
+
+                    log("Compressing {}".format(path))
+                    archive.compress(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compress closed log days.')
+    parser.add_argument('--older-than', type=int, default=config.ARCHIVE_AFTER_DAYS, help='compress days at least this many days old')
+    args = parser.parse_args()
+
+    paths = getattr(log_path, config.LOG_PATH_CLASS)(PermissiveAccessControl())
+    compress_older_than(paths, args.older_than)
+
+
+if __name__ == "__main__":
+    main()
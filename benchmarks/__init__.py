@@ -0,0 +1,6 @@
+"""Benchmarks against synthetic ZNC log trees.
+
+    python -m benchmarks.generate /tmp/tree --layout LogPath
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.compare before.json after.json
+"""
@@ -0,0 +1,72 @@
+"""Compare two sets of benchmark results.
+
+Prints the change in median time of every benchmark the two have in
+common, and exits non-zero if any got slower by more than --threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def _flatten(results, prefix=()):
+    """{(key, ...): stats} for every set of stats in nested ``results``."""
+    flat = {}
+
+    for key, value in results.items():
+        if isinstance(value, dict) and all(isinstance(inner, dict) for inner in value.values()):
+            flat.update(_flatten(value, prefix + (key,)))
+        else:
+            flat[prefix + (key,)] = value
+
+    return flat
+
+
+def compare(old, new, threshold, field='median', slack=0):
+    """(name, old, new, ratio, regressed) for everything timed in both.
+    Anything within ``slack`` of where it was hasn't regressed, whatever the
+    ratio.
+    """
+    old = _flatten(old['results'])
+    new = _flatten(new['results'])
+
+    rows = []
+
+    for key in sorted(set(old) & set(new)):
+        if field not in old[key] or field not in new[key]:
+            continue
+
+        before, after = old[key][field], new[key][field]
+        ratio = after / before if before else float('inf')
+
+        rows.append(('/'.join(key), before, after, ratio, ratio > 1 + threshold and after - before > slack))
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files.')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown to fail on, as a fraction')
+    parser.add_argument('--field', default='median', help='statistic to compare')
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    rows = compare(old, new, args.threshold, args.field)
+    width = max([len(name) for name, *_ in rows] + [0])
+
+    for name, before, after, ratio, regressed in rows:
+        print('{:{}}  {:12.6g}  {:12.6g}  {:+7.1%}{}'.format(
+            name, width, before, after, ratio - 1, '  REGRESSED' if regressed else '',
+        ))
+
+    if any(regressed for *_, regressed in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Synthetic ZNC log trees, in any of the layouts in log_path.
+
+Lines look like ZNC writes them: mostly messages, with actions, joins,
+parts, quits and the odd line that LINE doesn't match, from a pool of nicks
+where a few do most of the talking. Some messages carry control codes and
+some carry URLs, as often as asked for.
+"""
+from datetime import date
+from datetime import timedelta
+import argparse
+import os
+import random
+
+LAYOUTS = ('LogPath', 'DirectoryDelimitedLogPath', 'ZNC16DirectoryDelimitedLogPath')
+
+WORDS = (
+    'the a to and of is it that in you for this on be have not with are but just what '
+    'so do if was can like at no my all about get we there one out up your they how '
+    'now know think when more some time go then why make good yeah ok lol well really '
+    'build deploy server log grep index cache python regex channel network search '
+    'page render template bug fix patch commit branch release test broken works '
+    'こんにちは ありがとう なるほど 草 です'
+).split()
+
+NICKS = ['nick{}'.format(i) for i in range(40)] + ['natto', 'kenny', 'moffle', 'hikari', 'zz_top', 'a-b', 'x`y']
+
+TLDS = ('com', 'org', 'net', 'jp', 'io')
+
+COLORS = ['\x03{}'.format(i) for i in range(16)] + ['\x034,1', '\x0312,0', '\x03']
+
+
+def _url(rng):
+    url = 'http{}://{}.{}/{}'.format(
+        rng.choice(('', 's')),
+        rng.choice(('example', 'img', 'paste', 'youtube', 'github', 'www.example')),
+        rng.choice(TLDS),
+        '/'.join(rng.choice(WORDS) for _ in range(rng.randint(0, 3))),
+    )
+
+    if rng.random() < 0.3:
+        url += '?q={}&page={}'.format(rng.choice(WORDS), rng.randint(1, 20))
+
+    return rng.choice(('{}', '({})', '<{}>', '{}.', '{},')).format(url)
+
+
+def _message(rng, control_density, url_density):
+    words = [rng.choice(WORDS) for _ in range(max(1, int(rng.expovariate(1 / 9))))]
+
+    if rng.random() < url_density:
+        words.insert(rng.randint(0, len(words)), _url(rng))
+
+    if rng.random() < control_density:
+        for _ in range(rng.randint(1, 3)):
+            i = rng.randrange(len(words))
+            code = rng.choice(COLORS + ['\x02', '\x1f'])
+            words[i] = code + words[i] + rng.choice(('\x0f', '', code if len(code) == 1 else '\x03'))
+
+    if rng.random() < 0.02:
+        words.insert(0, '&gt;')
+
+    return ' '.join(words)
+
+
+def day_lines(rng, count, control_density=0.05, url_density=0.05):
+    """``count`` lines of one day, in time order."""
+    seconds = sorted(rng.randrange(24 * 60 * 60) for _ in range(count))
+    lines = []
+
+    for second in seconds:
+        stamp = '[{:02d}:{:02d}:{:02d}]'.format(second // 3600, second // 60 % 60, second % 60)
+        # A few nicks do most of the talking.
+        nick = NICKS[min(len(NICKS) - 1, int(rng.paretovariate(1.2)) - 1)]
+        kind = rng.random()
+
+        if kind < 0.8:
+            line = '{} <{}> {}'.format(stamp, nick, _message(rng, control_density, url_density))
+        elif kind < 0.85:
+            line = '{} * {} {}'.format(stamp, nick, _message(rng, control_density, url_density))
+        elif kind < 0.97:
+            event = rng.choice(('Joins', 'Parts', 'Quits'))
+            reason = '' if event == 'Joins' else ' ({})'.format(_message(rng, 0, 0))
+            line = '{} *** {}: {} ({}@{}.example.net){}'.format(stamp, event, nick, nick, rng.choice(WORDS), reason)
+        elif kind < 0.99:
+            line = '{} *** {} is now known as {}_'.format(stamp, nick, nick)
+        else:
+            line = '{} *** ChanServ sets mode: +o {}'.format(stamp, nick)
+
+        lines.append(line + '\n')
+
+    return lines
+
+
+def log_file(base, layout, network, channel, day):
+    """Where ``layout`` keeps the log of ``channel`` on ``day``."""
+    if layout == 'LogPath':
+        return os.path.join(base, network, 'moddata', 'log', 'default_{}_{}.log'.format(channel, day.strftime('%Y%m%d')))
+    elif layout == 'DirectoryDelimitedLogPath':
+        return os.path.join(base, network, channel, '{}.log'.format(day.strftime('%Y%m%d')))
+    elif layout == 'ZNC16DirectoryDelimitedLogPath':
+        return os.path.join(base, network, 'moddata', 'log', 'default', channel, '{}.log'.format(day.strftime('%Y-%m-%d')))
+
+    raise ValueError("Unknown layout", layout)
+
+
+def generate(
+    base,
+    layout='LogPath',
+    networks=1,
+    channels=3,
+    years=1,
+    lines_per_day=500,
+    control_density=0.05,
+    url_density=0.05,
+    seed=0,
+    today=None,
+):
+    """Write a tree of logs under ``base``, up to and including ``today``.
+
+    Channels are busier or quieter than ``lines_per_day`` by up to half, and
+    so is each day. Returns (network, channel, dates) for every channel.
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    days = [today - timedelta(days=back) for back in range(int(years * 365) - 1, -1, -1)]
+
+    written = []
+
+    for n in range(networks):
+        network = 'net{}'.format(n)
+
+        for c in range(channels):
+            channel = '#chan{}'.format(c)
+            busyness = lines_per_day * rng.uniform(0.5, 1.5)
+
+            for day in days:
+                path = log_file(base, layout, network, channel, day)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                count = max(1, int(busyness * rng.uniform(0.5, 1.5)))
+
+                with open(path, 'w') as f:
+                    f.writelines(day_lines(rng, count, control_density, url_density))
+
+            written.append((network, channel, [day.strftime('%Y%m%d') for day in days]))
+
+    return written
+
+
+def add_arguments(parser):
+    parser.add_argument('--networks', type=int, default=1)
+    parser.add_argument('--channels', type=int, default=3, help='channels per network')
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--lines-per-day', type=int, default=500)
+    parser.add_argument('--control-density', type=float, default=0.05, help='share of messages with control codes')
+    parser.add_argument('--url-density', type=float, default=0.05, help='share of messages with a URL')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def tree_arguments(args):
+    return dict(
+        networks=args.networks,
+        channels=args.channels,
+        years=args.years,
+        lines_per_day=args.lines_per_day,
+        control_density=args.control_density,
+        url_density=args.url_density,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic ZNC log tree.')
+    parser.add_argument('base', help='directory to write the tree into, to use as LOG_BASE')
+    parser.add_argument('--layout', choices=LAYOUTS, default='LogPath')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    generate(args.base, args.layout, **tree_arguments(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+"""Micro-benchmarks for the per-line rendering path: the line_format
+filters and the URL helpers in monkey_patch.
+
+Every case runs over the same corpus of lines, each function fed what the
+templates would feed it. Caches are emptied before every pass, so a pass
+costs what rendering the corpus for the first time would. Results are
+nanoseconds per line (best pass), plus peak and retained traced memory per
+line, since CPython has no cheap count of allocations made, and the share
+of lookups that hit in each cache used.
+
+Search results are simulated as SEARCHES searches for SEARCH_HITS random
+lines each, with SEARCH_CONTEXT lines either side, so that lines turn up
+again in other searches, as context or as hits.
+
+With --baseline, exits non-zero if any case got worse than the baseline by
+more than --threshold.
+"""
+from time import perf_counter_ns
+import argparse
+import json
+import platform
+import random
+import sys
+import tracemalloc
+
+from flask import Flask
+from jinja2.utils import _word_split_re
+from jinja2.utils import escape
+
+import line_format
+import metrics
+import monkey_patch
+from benchmarks import compare
+from benchmarks import generate
+from benchmarks.run import git_revision
+from grep import Line
+
+CASES = []
+
+# Compared against the baseline, with how much either may move regardless
+# of --threshold: a few bytes a line is noise.
+GATED_FIELDS = (('ns_per_line', 0), ('peak_bytes_per_line', 8))
+
+NOFOLLOW = ' rel="nofollow"'
+
+SEARCHES = 50
+SEARCH_HITS = 20
+SEARCH_CONTEXT = 4
+
+
+def case(name):
+    def inner(f):
+        CASES.append((name, f))
+        return f
+    return inner
+
+
+class Corpus:
+
+    def __init__(self, lines):
+        self.lines = [line.rstrip('\n') for line in lines]
+
+        # The stages of log.html, precomputed so each case times its own.
+        self.clinkified = [line_format.clinkify(line) for line in self.lines]
+        self.formatted = [line_format.irc_format(line) for line in self.clinkified]
+
+        # And of search_result.html.
+        self.urlized = [monkey_patch.urlize(line, nofollow=True) for line in self.lines]
+        search_formatted = [line_format.irc_format(line) for line in self.urlized]
+        self.search_lines = []
+
+        for _ in range(SEARCHES):
+            for hit in random.sample(range(len(self.lines)), min(SEARCH_HITS, len(self.lines))):
+                for i in range(max(0, hit - SEARCH_CONTEXT), min(len(self.lines), hit + SEARCH_CONTEXT + 1)):
+                    self.search_lines.append((
+                        search_formatted[i],
+                        Line('#chan0', '20160101', ':' if i == hit else '-', i + 1, self.lines[i]),
+                    ))
+
+        self.words = [_word_split_re.split(str(escape(line))) for line in self.lines]
+        self.paths = [
+            '/net{}/#chan{}/2016{:04d}'.format(i % 3, i % 7, i % 1231)
+            for i in range(len(self.lines))
+        ]
+
+        # Enough of a Flask app for log links.
+        self.app = Flask(__name__)
+        self.app.add_url_rule('/<network>/<channel>/', 'channel')
+        self.app.add_url_rule('/<network>/<channel>/<date>', 'log')
+
+        self.safe = frozenset(bytearray(b'/:') + monkey_patch._always_safe)
+
+
+@case('clinkify')
+def clinkify(corpus):
+    for line in corpus.lines:
+        line_format.clinkify(line)
+
+
+@case('irc_format')
+def irc_format(corpus):
+    for line in corpus.clinkified:
+        line_format.irc_format(line)
+
+
+@case('line_style')
+def line_style(corpus):
+    for line_no, line in enumerate(corpus.formatted, start=1):
+        line_format.line_style(line, line_no, False)
+
+
+@case('line_style_search')
+def line_style_search(corpus):
+    with corpus.app.test_request_context():
+        # As search_result.html does, once per day of results.
+        log_link = line_format.log_url('net0', '#chan0', '20160101')
+
+        for line, ctx in corpus.search_lines:
+            line_format.line_style(line, ctx.line_no, True, 'net0', ctx, log_link)
+
+    return len(corpus.search_lines)
+
+
+@case('urlize')
+def urlize(corpus):
+    for line in corpus.lines:
+        monkey_patch.urlize(line, nofollow=True)
+
+
+@case('_urlize_parse')
+def urlize_parse(corpus):
+    for words in corpus.words:
+        for word in words:
+            monkey_patch._urlize_parse(word, NOFOLLOW, None)
+
+
+@case('_url_quote')
+def url_quote(corpus):
+    for path in corpus.paths:
+        monkey_patch._url_quote(path)
+
+
+@case('_url_quote/_upstream_transform')
+def upstream_transform(corpus):
+    for path in corpus.paths:
+        monkey_patch._upstream_transform(path.encode('utf-8'), corpus.safe)
+
+
+@case('_url_quote/_chunking_transform')
+def chunking_transform(corpus):
+    for path in corpus.paths:
+        monkey_patch._chunking_transform(path.encode('utf-8'), corpus.safe)
+
+
+@case('_url_quote/_translate_transform')
+def translate_transform(corpus):
+    for path in corpus.paths:
+        monkey_patch._translate_transform(path.encode('utf-8'), corpus.safe)
+
+
+def clear_caches():
+    for _, cached in metrics.find_caches():
+        cached.cache_clear()
+
+
+def cache_lookups():
+    """{name: (hits, misses)} for every cache."""
+    return {
+        name: (info.hits, info.misses)
+        for name, info in ((name, cached.cache_info()) for name, cached in metrics.find_caches())
+    }
+
+
+def measure(f, corpus, passes):
+    """Run case ``f``, which returns how many lines it went through if
+    that's not the corpus.
+    """
+    times = []
+
+    for _ in range(passes):
+        clear_caches()
+        lookups_before = cache_lookups()
+
+        begin = perf_counter_ns()
+        lines = f(corpus) or len(corpus.lines)
+        times.append(perf_counter_ns() - begin)
+
+        hit_rates = {}
+        for name, (hits, misses) in cache_lookups().items():
+            hits_before, misses_before = lookups_before[name]
+            hits, misses = hits - hits_before, misses - misses_before
+
+            if hits + misses:
+                hit_rates[name] = hits / (hits + misses)
+
+    # Once more, traced; tracing is too slow to time alongside.
+    clear_caches()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        f(corpus)
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'passes': passes,
+        'ns_per_line': min(times) / lines,
+        'peak_bytes_per_line': (peak - before) / lines,
+        'retained_bytes_per_line': (after - before) / lines,
+        'cache_hit_rates': hit_rates,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark the per-line rendering path.')
+    parser.add_argument('--lines', type=int, default=5000, help='corpus size, when generated')
+    parser.add_argument('--corpus', help='a log file to use as the corpus instead')
+    parser.add_argument('--passes', type=int, default=10, help='timed passes, of which the best counts')
+    parser.add_argument('--case', action='append', help='cases to run (default: all)')
+    parser.add_argument('--output', help='file to write results to')
+    parser.add_argument('--baseline', help='results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15, help='regression to fail on, as a fraction')
+    parser.add_argument('--control-density', type=float, default=0.1)
+    parser.add_argument('--url-density', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    if args.corpus:
+        with open(args.corpus, errors='ignore') as f:
+            lines = f.readlines()
+        corpus_params = {'file': args.corpus}
+    else:
+        lines = generate.day_lines(random.Random(args.seed), args.lines, args.control_density, args.url_density)
+        corpus_params = {
+            'lines': args.lines,
+            'control_density': args.control_density,
+            'url_density': args.url_density,
+            'seed': args.seed,
+        }
+
+    corpus = Corpus(lines)
+
+    results = {
+        name: measure(f, corpus, args.passes)
+        for name, f in CASES
+        if not args.case or name in args.case
+    }
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'corpus': corpus_params,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    for name, result in sorted(results.items()):
+        print('{:32}  {:10.0f} ns/line  {:8.1f} peak B/line  {:8.1f} retained B/line'.format(
+            name, result['ns_per_line'], result['peak_bytes_per_line'], result['retained_bytes_per_line'],
+        ))
+
+        for cache, hit_rate in sorted(result['cache_hit_rates'].items()):
+            print('    {:48}  {:4.0%} hits'.format(cache, hit_rate))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressed = False
+
+        for field, slack in GATED_FIELDS:
+            for name, before, after, ratio, worse in compare.compare(baseline, report, args.threshold, field, slack):
+                if worse:
+                    regressed = True
+                    print('REGRESSED {} {}: {:.6g} -> {:.6g} ({:+.1%})'.format(name, field, before, after, ratio - 1))
+
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""Time the main paths through moffle against a synthetic tree.
+
+Each layout runs in a process of its own, with a fresh tree and config, so
+that no layout inherits another's caches. Results are seconds per call
+(min, median and mean over --repeat calls), written as JSON for
+benchmarks.compare.
+"""
+from contextlib import redirect_stdout
+from itertools import cycle
+from statistics import mean
+from statistics import median
+from time import perf_counter
+from urllib.parse import quote
+import argparse
+import io
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import generate
+
+BENCHMARKS = []
+
+# Search for a word most days have.
+SEARCH_QUERY = 'server'
+
+
+def benchmark(name):
+    def inner(f):
+        BENCHMARKS.append((name, f))
+        return f
+    return inner
+
+
+def time_calls(f, repeat):
+    times = []
+
+    for _ in range(repeat):
+        begin = perf_counter()
+        f()
+        times.append(perf_counter() - begin)
+
+    return {
+        'repeat': repeat,
+        'min': min(times),
+        'median': median(times),
+        'mean': mean(times),
+    }
+
+
+def configure(base, layout):
+    """Point config at the tree, before anything reads it."""
+    import config
+
+    config.LOG_BASE = base
+    config.LOG_PATH_CLASS = layout
+    config.GREP_BUILDER_CLASS = 'GrepBuilder'
+    config.ACL = (('allow', '*', ('*', '*'), ('root', 'root')),)
+    config.ACL_FILE = None
+    # Measure rendering, not the response cache.
+    config.RESPONSE_CACHE_SIZE = 0
+    config.WARM_UP = False
+    config.DEBUG_PROFILER = False
+    config.DEBUG_PYINSTRUMENT = False
+    config.PROFILE_SAMPLE_RATE = 0
+
+
+class Context:
+
+    def __init__(self, channels):
+        import app
+        import config
+        import log_path
+        import metrics
+        from acl import PermissiveAccessControl
+
+        self.app = app.create()
+        self.client = self.app.test_client()
+        # Outside of requests there's no user to check the ACL for.
+        self.paths = getattr(log_path, config.LOG_PATH_CLASS)(PermissiveAccessControl())
+        self.channels = channels
+        self.metrics = metrics
+        self.log_path = log_path
+
+        network, channel, dates = channels[0]
+        self.network = network
+        self.channel = channel
+        # Closed days from all over the range.
+        self.dates = dates[:-1][::max(1, len(dates) // 20)] or dates
+
+    def clear_caches(self):
+        for _, cached in self.metrics.find_caches():
+            cached.cache_clear()
+
+    def list_all(self):
+        for network in self.paths.networks():
+            for channel in self.paths.channels(network):
+                self.paths.channel_dates(network, channel)
+
+    def get(self, date, suffix=''):
+        url = '/{}/{}/{}{}'.format(self.network, quote(self.channel, safe=''), date, suffix)
+        response = self.client.get(url)
+
+        # A fast 404 is no use to anyone.
+        if response.status_code != 200:
+            raise RuntimeError("Unexpected response", url, response.status)
+
+        return response.data
+
+
+@benchmark('listing_cold')
+def listing_cold(ctx):
+    def run():
+        ctx.clear_caches()
+        ctx.list_all()
+    return run
+
+
+@benchmark('listing_warm')
+def listing_warm(ctx):
+    ctx.list_all()
+    return ctx.list_all
+
+
+@benchmark('log')
+def log(ctx):
+    dates = cycle(ctx.dates)
+    return lambda: list(ctx.paths.log(ctx.network, ctx.channel, next(dates)).log)
+
+
+@benchmark('render')
+def render(ctx):
+    dates = cycle(ctx.dates)
+    return lambda: ctx.get(next(dates))
+
+
+@benchmark('raw')
+def raw(ctx):
+    dates = cycle(ctx.dates)
+    return lambda: ctx.get(next(dates), '/raw')
+
+
+@benchmark('search')
+def search(ctx):
+    import grep
+
+    builder = grep.GrepBuilder(ctx.paths)
+
+    def run():
+        # Otherwise only the first call processes any output.
+        grep.GrepBuilder._process_output.cache_clear()
+        builder.run([ctx.channel], ctx.network, SEARCH_QUERY)
+    return run
+
+
+@benchmark('index_single')
+def index_single(ctx):
+    try:
+        from elasticsearch import Connection
+        from elasticsearch import Elasticsearch
+        import indexer
+    except ImportError as e:
+        return 'skipped: {}'.format(e)
+
+    class NullConnection(Connection):
+        """Answers every request without a cluster, so that what's timed is
+        index_single and the client's own work.
+        """
+
+        def perform_request(self, method, url, params=None, body=None, *args, **kwargs):
+            if url.endswith('/_bulk'):
+                count = body.count(b'\n') // 2
+                response = {'took': 0, 'errors': False, 'items': [{'index': {'status': 201}}] * count}
+            else:
+                response = {'took': 0, 'deleted': 0, 'failures': []}
+
+            return 200, {}, json.dumps(response)
+
+    es = Elasticsearch(connection_class=NullConnection)
+    dates = cycle(ctx.dates)
+
+    def run():
+        date = next(dates)
+        lines = ctx.paths.log(ctx.network, ctx.channel, date).log
+        indexer.index_single(es, ctx.network, ctx.channel, date, lines)
+    return run
+
+
+def run_layout(layout, tree, repeat):
+    base = tempfile.mkdtemp(prefix='moffle-bench-')
+
+    try:
+        channels = generate.generate(base, layout, **tree)
+        configure(base, layout)
+
+        results = {}
+
+        # Keep the app's and indexer's logging out of the results.
+        with redirect_stdout(io.StringIO()):
+            ctx = Context(channels)
+
+            for name, setup in BENCHMARKS:
+                f = setup(ctx)
+
+                if isinstance(f, str):
+                    results[name] = {'skipped': f}
+                else:
+                    results[name] = time_calls(f, repeat)
+
+        return results
+    finally:
+        shutil.rmtree(base)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark moffle against synthetic log trees.')
+    parser.add_argument('--layout', choices=generate.LAYOUTS, action='append', help='layouts to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=20, help='calls to time per benchmark')
+    parser.add_argument('--output', help='file to write results to (default: stdout)')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    generate.add_arguments(parser)
+    args = parser.parse_args()
+
+    tree = generate.tree_arguments(args)
+
+    if args.child:
+        layout, = args.layout
+        results = run_layout(layout, tree, args.repeat)
+
+        with open(args.output, 'w') as f:
+            json.dump(results, f)
+
+        return
+
+    results = {}
+
+    for layout in args.layout or generate.LAYOUTS:
+        with tempfile.NamedTemporaryFile(mode='r', suffix='.json') as f:
+            subprocess.check_call(
+                [sys.executable, '-m', 'benchmarks.run', '--child', '--layout', layout, '--output', f.name]
+                + ['--repeat', str(args.repeat)]
+                + ['--{}={}'.format(key.replace('_', '-'), value) for key, value in tree.items()],
+            )
+            results[layout] = json.load(f)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'tree': tree,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
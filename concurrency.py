@@ -0,0 +1,31 @@
+"""Serving many requests per process.
+
+Under uwsgi --threads each request has a thread, and blocking calls let the
+others run. Under uwsgi --gevent --gevent-monkey-patch each request has a
+greenlet instead, and anything that blocks without going through gevent
+holds up every request in the process. Filesystem calls are like that, so
+the slow ones go through blocking(), which hands them to gevent's pool of
+real threads.
+"""
+try:
+    import gevent
+    from gevent import monkey
+except ImportError:
+    gevent = None
+
+
+def cooperative():
+    """Whether requests are greenlets sharing a thread."""
+    return gevent is not None and monkey.is_module_patched('socket')
+
+
+def blocking(f, *args, **kwargs):
+    """Call ``f``, which blocks, without holding up other requests.
+
+    Under gevent it runs on another thread, so it mustn't rely on anything
+    request- or thread-local.
+    """
+    if cooperative():
+        return gevent.get_hub().threadpool.apply(f, args, kwargs)
+
+    return f(*args, **kwargs)
@@ -6,3 +6,12 @@ class MultipleResultsException(Exception):
 
 class CanonicalNameException(Exception):
     pass
+
+class SearchBusyException(Exception):
+    pass
+
+class SearchTimeoutException(Exception):
+    pass
+
+class SearchCancelledException(Exception):
+    pass
@@ -3,29 +3,41 @@
 from collections import namedtuple
 from datetime import date
 from datetime import timedelta
-from functools import partial
 from html import unescape
+from itertools import chain
 from itertools import islice
 from itertools import groupby
 from math import ceil
 from math import floor
 from multiprocessing import Pool
-from os.path import join
 from shlex import quote
 from statistics import mean
 from statistics import StatisticsError
 from subprocess import Popen
 from subprocess import PIPE
 import logging
+import os
 import re
+import selectors
 import signal
+import threading
+import time
 
 import fastcache
-from elasticsearch import Elasticsearch
-from elasticsearch_dsl import MultiSearch
-from elasticsearch_dsl import Search
 
+import archive
+import concurrency
 import config
+import exceptions
+import log_path
+import metrics
+import pack
+
+# Don't pay for importing a search backend that isn't in use.
+if config.GREP_BUILDER_CLASS == 'ESGrepBuilder':
+    from elasticsearch import Elasticsearch
+    from elasticsearch_dsl import MultiSearch
+    from elasticsearch_dsl import Search
 
 logger = logging.getLogger(__name__)
 
@@ -36,13 +48,17 @@ Line = namedtuple('Line', ['channel', 'date', 'line_marker', 'line_no', 'line'])
 
 # TODO: Having to parse the filenames again should be part of log_path's
 # responsibility
-LINE_REGEX = re.compile("(?P<channel>[#&].*)[_/](?P<date>[\d-]{8,10})\.log(?P<line_marker>-|:)(?P<line_no>\d+)(?P=line_marker)(?P<line>.*)", re.M)
+LINE_REGEX = re.compile("(?P<channel>[#&].*)[_/](?P<date>[\d-]{8,10})\.log(?:\.gz)?(?P<line_marker>-|:)(?P<line_no>\d+)(?P=line_marker)(?P<line>.*)", re.M)
+
+# The path ends at the first pack name, not at one quoted in the line.
+PACK_LINE_REGEX = re.compile("(?P<path>[^:]*?\d{6}\.pack)(?P<line_marker>-|:)(?P<line_no>\d+)(?P=line_marker)(?P<line>.*)")
 
 OUTPUT_PROCESS_CHUNK_SIZE = 32
+PIPE_READ_SIZE = 65536
 
 
 class GrepBuilder:
-    template = """LC_ALL=C xargs -0 {grep} -C {context} {search}"""
+    template = """LC_ALL=C xargs -0 {grep} -H -C {context} {search}"""
     regex = "'<{author}> .*'{query}'.*'"
 
     author_default = '[^>]*'
@@ -50,7 +66,21 @@ class GrepBuilder:
     def __init__(self, log_path):
         self.log_path = log_path
         self.context = config.SEARCH_CONTEXT
-        self.pool = Pool(config.SEARCH_WORKERS, init_worker)
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        # A pool's threads don't survive uwsgi forking the workers, so each
+        # process starts its own on first use.
+        if self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool_pid != os.getpid():
+                    self._pool = Pool(config.SEARCH_WORKERS, init_worker)
+                    self._pool_pid = os.getpid()
+
+        return self._pool
 
     def emit(self, channels, network, query, author=None, date_range=None):
         if author:
@@ -67,19 +97,37 @@ class GrepBuilder:
 
         regex = self.regex.format(author=author, query=query)
         cmd = self.template.format(grep=config.GREP, context=self.context, search=regex)
+        compressed_cmd = self.template.format(grep=config.ZGREP, context=self.context, search=regex)
 
         channel_dates = self.log_path.channels_dates(network, channels)
-        channel_paths = self._process_channel_dates(channel_dates, network, date_begin, date_end)
+        chunks = self._process_channel_dates(channel_dates, date_begin, date_end)
+
+        # zgrep copes with plain files too, but costs a few more forks.
+        jobs = [(
+            compressed_cmd if any(archive.is_compressed(path) for path in chunk) else cmd,
+            '\0'.join(chunk).encode(),
+        ) for chunk in chunks]
 
-        return channel_paths, cmd
+        return jobs
 
-    def run(self, *args, **kwargs):
-        channel_paths, cmd = self.emit(*args, **kwargs)
+    def run(self, *args, cancelled=None, date_range=None, **kwargs):
+        """``cancelled`` is polled while grep runs; if it returns True the
+        search is abandoned.
+        """
+        jobs = self.emit(*args, date_range=date_range, **kwargs)
+
+        # The pool's workers are forked with whatever this process has open.
+        # Started before any grep, none of them can hold another search's
+        # grep's input open and leave it waiting forever.
+        if not concurrency.cooperative():
+            self.pool
+
+        deadline = time.time() + config.SEARCH_TIMEOUT
 
         # No-results per worker are still '', so filter them out.
         output = filter(
             None,
-            self.pool.map(partial(run_worker, cmd), channel_paths),
+            run_workers(jobs, deadline, cancelled),
         )
 
         output = '\n--\n'.join(output)
@@ -89,6 +137,11 @@ class GrepBuilder:
         else:
             hits = self._process_output(output.strip())
 
+            # Packs hold whole months, so may turn up days outside the range.
+            if date_range:
+                date_begin, date_end = date_range
+                hits = [hit for hit in hits if date_begin < log_path.parse_date(hit.date) <= date_end]
+
             # On int(hit.begin): String sorting strikes again!
             hits.sort(key=lambda hit: (hit.date, int(hit.begin)), reverse=True)
 
@@ -100,9 +153,22 @@ class GrepBuilder:
     def _process_output(self, output):
         splits = output.split('\n--\n')
 
-        return self.pool.map(_process_hit, splits, chunksize=OUTPUT_PROCESS_CHUNK_SIZE)
+        # The pool's result handling blocks in ways gevent can't switch
+        # out of, so greenlets do the work on a thread of their own instead.
+        if concurrency.cooperative():
+            hits = concurrency.blocking(list, map(_process_hit, splits))
+            return list(chain.from_iterable(hits))
 
-    def _process_channel_dates(self, channel_dates, network, date_begin, date_end):
+        queued = ceil(len(splits) / OUTPUT_PROCESS_CHUNK_SIZE)
+        metrics.pool_queued(queued)
+        try:
+            hits = self.pool.map(_process_hit, splits, chunksize=OUTPUT_PROCESS_CHUNK_SIZE)
+        finally:
+            metrics.pool_queued(-queued)
+
+        return list(chain.from_iterable(hits))
+
+    def _process_channel_dates(self, channel_dates, date_begin, date_end):
         def next_chunk_size(chunk_sizes, target_chunk_size):
             """Allocate fair chunk sizes (instead of just ceiling all the time).
             This avoids the leftover guy who only has one path. This is bad
@@ -140,21 +206,12 @@ class GrepBuilder:
 
             return chunks_folded
 
-        filtered_channel_dates = []
-
-        for log in channel_dates:
-            date = log['date_obj']
-
-            if ((date_begin and date_begin < date) or (not date_begin)) and \
-                    ((date_end and date_end >= date) or (not date_end)):
-                filtered_channel_dates.append(log)
-
-        channel_paths = [join(
-            self.log_path.network_to_path(network),
-            log['filename'],
-        ) for log in filtered_channel_dates]
-
-        channel_paths.sort()
+        # Set: every day in a pack shares the pack's path.
+        channel_paths = sorted({
+            logs.path(i)
+            for logs in channel_dates
+            for i in logs.between(date_begin, date_end)
+        })
 
         target_chunk_size = len(channel_paths) / config.SEARCH_WORKERS
         chunk_sizes = []
@@ -172,11 +229,7 @@ class GrepBuilder:
             chunk_sizes.append(chunk_size)
             chunks.append(chunk)
 
-        chunks = fold_chunks(chunks)
-
-        channel_paths = ['\0'.join(chunk).encode() for chunk in chunks]
-
-        return channel_paths
+        return fold_chunks(chunks)
 
     def max_segment(self, oldest):
         today = date.today()
@@ -198,48 +251,155 @@ def init_worker():
     signal.signal(signal.SIGINT, signal.SIG_IGN)
 
 
-def run_worker(cmd, paths):
-    proc = Popen(cmd, shell=True, stdout=PIPE, stdin=PIPE)
-    output, _ = proc.communicate(paths)
-    output = output.decode('utf-8', errors='ignore').strip()
+def run_workers(jobs, deadline, cancelled=None):
+    """Run each (cmd, paths) grep job at once and collect their output.
+
+    Every grep gets its own process group so that the whole xargs/grep
+    pipeline can be killed if we run past the deadline or the search is
+    cancelled.
+    """
+    procs = []
+    outputs = [bytearray() for _ in jobs]
+
+    selector = selectors.DefaultSelector()
+
+    try:
+        # Started as we go, so that if one fails those before it are killed.
+        for i, (cmd, chunk) in enumerate(jobs):
+            proc = Popen(cmd, shell=True, stdout=PIPE, stdin=PIPE, start_new_session=True)
+            procs.append(proc)
+
+            os.set_blocking(proc.stdin.fileno(), False)
+            os.set_blocking(proc.stdout.fileno(), False)
+
+            selector.register(proc.stdin, selectors.EVENT_WRITE, (i, memoryview(chunk)))
+            selector.register(proc.stdout, selectors.EVENT_READ, (i, None))
+
+        while selector.get_map():
+            for key, _ in selector.select(timeout=config.SEARCH_CANCEL_POLL_INTERVAL):
+                i, pending = key.data
+
+                if pending is not None:
+                    written = os.write(key.fd, pending)
+                    pending = pending[written:]
+
+                    if pending:
+                        selector.modify(key.fileobj, selectors.EVENT_WRITE, (i, pending))
+                    else:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                else:
+                    data = os.read(key.fd, PIPE_READ_SIZE)
+
+                    if data:
+                        outputs[i].extend(data)
+                    else:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+
+            if time.time() >= deadline:
+                raise exceptions.SearchTimeoutException()
+
+            if cancelled and cancelled():
+                raise exceptions.SearchCancelledException()
+
+    except BaseException:
+        for proc in procs:
+            _kill_worker(proc)
+        raise
+
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
 
-    return output
+        for proc in procs:
+            proc.wait()
+
+    return [output.decode('utf-8', errors='ignore').strip() for output in outputs]
+
+
+def _kill_worker(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        # Already gone.
+        pass
 
 
 def _process_hit(split):
+    """Turn one grep context group into hits.
+
+    zgrep doesn't put separators between files, and context runs across day
+    boundaries in packs, so a group may span several days and hence several
+    hits.
+    """
     lines = split.strip().split('\n')
 
-    channel, date, begin = None, None, None
+    hits = []
     line_objs = []
 
-    for line in lines:
-        m = LINE_REGEX.search(line)
+    for text in lines:
+        m = LINE_REGEX.search(text)
+
+        if m:
+            line = Line(**m.groupdict())
+        else:
+            m = PACK_LINE_REGEX.match(text)
+            line = _process_pack_line(m) if m else None
 
         # For line continuations
-        if not m:
+        if not line:
             if not line_objs:
                 continue
 
             last = line_objs[-1]
-            line_objs[-1] = last._replace(line=last.line + '\n' + line)
+            line_objs[-1] = last._replace(line=last.line + '\n' + text)
             continue
 
-        line = Line(**m.groupdict())
-
-        if not channel:
-            channel = line.channel
-            date = line.date
-            begin = line.line_no
+        if line_objs and (line.channel, line.date) != (line_objs[0].channel, line_objs[0].date):
+            hits.append(_make_hit(line_objs))
+            line_objs = []
 
         line_objs.append(line)
 
-    return Hit(channel, date, begin, line_objs)
+    if line_objs:
+        hits.append(_make_hit(line_objs))
+
+    # Drop context that spilled over from a match in a neighbouring day.
+    return [hit for hit in hits if any(line.line_marker == ':' for line in hit.lines)]
+
+
+def _process_pack_line(m):
+    """Make a Line out of a PACK_LINE_REGEX match of grep output, numbered
+    within its day, or None if no day of the pack has it.
+    """
+    path = m.group('path')
+    located = pack.locate(path, int(m.group('line_no')))
+
+    if not located:
+        return None
+
+    date, line_no = located
+
+    return Line(
+        channel=pack.read_header(path).channel,
+        date=date,
+        line_marker=m.group('line_marker'),
+        line_no=str(line_no),
+        line=m.group('line'),
+    )
+
+
+def _make_hit(line_objs):
+    first = line_objs[0]
+    return Hit(first.channel, first.date, first.line_no, line_objs)
 
 
 class ESGrepBuilder:
 
     def __init__(self, _):
-        self.es = Elasticsearch(['localhost'])
+        self.es = Elasticsearch(config.ES_HOST)
 
     def _format_line(self, line, is_hit):
         if line.line_type == 'normal':
@@ -271,7 +431,8 @@ class ESGrepBuilder:
 
         return date_start, date_end
 
-    def run(self, network, channels, query, author=None, date_range=None):
+    def run(self, network, channels, query, author=None, date_range=None, cancelled=None):
+        # Elasticsearch queries can't be cancelled from here, so ``cancelled`` is ignored.
         # We don't support non-ajax, so will always have date range
         assert date_range
         date_begin, date_end = date_range
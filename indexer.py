@@ -1,5 +1,4 @@
 import argparse
-import re
 
 from elasticsearch import Elasticsearch
 from elasticsearch.helpers import bulk
@@ -7,26 +6,12 @@ from elasticsearch_dsl import Search
 
 import config
 import log_path
+from acl import PermissiveAccessControl
+from log_line import LINE
+from log_line import TYPE_MAP
 from util import log
 
 
-LINE = re.compile(
-    r'^\[(?P<time>\d{2}:\d{2}:\d{2})\] (?P<line_type>\* |<|\*\*\* (?:Join|Part|Quit)s: )(?P<author>[^ >]+)>?(?P<text>.+)'
-)
-TYPE_MAP = {
-    '* ': 'action',
-    '<': 'normal',
-    '*** Joins: ': 'join',
-    '*** Parts: ': 'part',
-    '*** Quits: ': 'quit',
-}
-
-
-class IndexerAccessControl:
-    def evaluate(*args):
-        return True
-
-
 def configure(es, delete_index):
     if es.indices.exists(index='moffle'):
         if delete_index:
@@ -113,7 +98,7 @@ def main():
     es = Elasticsearch(config.ES_HOST)
     configure(es, delete_index=args.delete_index)
 
-    paths = getattr(log_path, config.LOG_PATH_CLASS)(IndexerAccessControl())
+    paths = getattr(log_path, config.LOG_PATH_CLASS)(PermissiveAccessControl())
 
     for network in paths.networks():
         for channel in paths.channels(network):
@@ -2,6 +2,7 @@ import re
 
 import fastcache
 import jinja2.utils
+from flask import request
 from flask import url_for
 from jinja2 import escape
 
@@ -145,12 +146,33 @@ def irc_format(text, autoescape=None):
 
 
 @util.delay_template_filter('line_style')
-@fastcache.clru_cache(maxsize=16384)
-def line_style(s, line_no, is_search, network=None, ctx=None):
+def line_style(s, line_no, is_search, network=None, ctx=None, log_link=None):
     """
     ctx is a grep Line object. Yes, I know it's duplicating s and line_no.
     Deal with it.
+
+    Only the link and highlight depend on where the line is shown, and
+    search hits are all different places, so the rest is cached on the
+    line alone. Search pages can pass the log_url() of ctx as log_link.
     """
+    line_class = "irc-highlight" if ctx and ctx.line_marker == ':' else ''
+
+    # Make links back to actual line if we're in search.
+    if is_search:
+        href = '{}#L{}'.format(log_link or log_url(network, ctx.channel, ctx.date), line_no)
+        id_ = ''
+    else:
+        id_ = 'L{}'.format(line_no)
+        href = '#' + id_
+
+    return '<span class="{}"><a href="{}" id="{}" class="js-line-no-highlight">{}'.format(
+        line_class, href, id_, _line_body(s),
+    )
+
+
+@fastcache.clru_cache(maxsize=16384)
+def _line_body(s):
+    """Everything in a styled line from the timestamp on."""
 
     # At some point this should become yet another regex.
     timestamp, rest = s.split(' ', 1)
@@ -161,13 +183,9 @@ def line_style(s, line_no, is_search, network=None, ctx=None):
     else:
         user, msg = rest_split
 
-    classes = []
     msg_user_classes = []
     msg_classes = []
 
-    if ctx and ctx.line_marker == ':':
-        classes.append("irc-highlight")
-
     if msg.startswith("Quits"):
         msg_user_classes.append("irc-part")
     elif msg.startswith("Parts"):
@@ -179,44 +197,45 @@ def line_style(s, line_no, is_search, network=None, ctx=None):
     if msg.startswith("&gt;"):
         msg_classes.append("irc-greentext")
 
-    # Make links back to actual line if we're in search.
-    if is_search:
-        href = url_for(
-            'log',
-            network=network,
-            channel=ctx.channel,
-            date=ctx.date,
-            _anchor='L{}'.format(line_no),
-        )
-        id_ = ''
-    else:
-        href = '#L{}'.format(line_no)
-        id_ = 'L{}'.format(line_no)
-
     # Do we have to resort to this?
     h, m, s = timestamp.strip("[]").split(":")
 
     timestamp = "[{h}:{m}<span class='seconds'>:{s}</span>]".format(h=h, m=m, s=s)
 
-    return '<span class="{line_class}">' \
-        '<a href="{href}" id="{id_}" class="js-line-no-highlight">{timestamp}</a> ' \
+    return '{timestamp}</a> ' \
         '<span class="{msg_user_class}">{user} ' \
         '<span class="{msg_class}">{msg}' \
         '</span>' \
         '</span>' \
         '</span>' \
         .format(
-        line_class=' '.join(classes),
         timestamp=timestamp,
-        href=href,
         msg_user_class=' '.join(msg_user_classes),
         msg_class=' '.join(msg_classes),
         user=user,
-        id_=id_,
         msg=msg,
     )
 
 
+def log_url(network, channel, date):
+    """url_for('log', ...), for pages with a link per line or per day.
+
+    The quoted URL of the channel is worked out once and the date put on the
+    end, so the per-link cost is a concatenation.
+    """
+    # Dates are digits, which never need quoting.
+    if not date.isdigit():
+        return url_for('log', network=network, channel=channel, date=date)
+
+    return _channel_url(request.script_root, network, channel) + date
+
+
+@fastcache.clru_cache(maxsize=1024)
+def _channel_url(script_root, network, channel):
+    # The log route is the channel route with the date on the end.
+    return url_for('channel', network=network, channel=channel)
+
+
 @util.delay_template_filter('clinkify')
 def clinkify(s):
     splitted = s.split(' ')
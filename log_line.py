@@ -0,0 +1,13 @@
+"""Picking apart individual ZNC log lines."""
+import re
+
+LINE = re.compile(
+    r'^\[(?P<time>\d{2}:\d{2}:\d{2})\] (?P<line_type>\* |<|\*\*\* (?:Join|Part|Quit)s: )(?P<author>[^ >]+)>?(?P<text>.+)'
+)
+TYPE_MAP = {
+    '* ': 'action',
+    '<': 'normal',
+    '*** Joins: ': 'join',
+    '*** Parts: ': 'part',
+    '*** Quits: ': 'quit',
+}
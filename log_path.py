@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import defaultdict
 from collections import namedtuple
 from datetime import date
-from operator import itemgetter
-from itertools import chain
 import os
 import re
 
@@ -11,15 +13,27 @@ from natsort import ns
 import cachetools
 import fastcache
 
+import archive
+import concurrency
 import config
 import exceptions
 import looseboy
+import metrics
+import pack
 import util
 
 LOG_INTERMEDIATE_BASE = "moddata/log"
-LOG_FILENAME_REGEX = re.compile("(?P<filename>(?P<network>(default|znc)+)_(?P<channel>[#&]*[a-zA-Z0-9\u4e00-\u9fff/_\-\.\?\$]+)_(?P<date>\d{8})\.log)")
+LOG_FILENAME_REGEX = re.compile("(?P<filename>(?P<network>(default|znc)+)_(?P<channel>[#&]*[a-zA-Z0-9\u4e00-\u9fff/_\-\.\?\$]+)_(?P<date>\d{8})\.log(?:\.gz)?)$")
+PACK_FILENAME_REGEX = re.compile("(?P<filename>(?P<network>(default|znc)+)_(?P<channel>[#&]*[a-zA-Z0-9\u4e00-\u9fff/_\-\.\?\$]+)_(?P<month>\d{6})\.pack)$")
+DIRECTORY_PACK_FILENAME_REGEX = re.compile("\d{6}\.pack$")
 
-LogResult = namedtuple('LogResult', ['log', 'before', 'after'])
+# stamp identifies the version of the file the log came from.
+LogResult = namedtuple('LogResult', ['log', 'before', 'after', 'stamp'])
+# size is what the day takes up where it's kept: compressed, for a
+# compressed log.
+DaySummary = namedtuple('DaySummary', ['date', 'size', 'lines'])
+
+COUNT_READ_SIZE = 1024 * 1024
 
 ldp = looseboy.LooseDateParser()
 
@@ -35,23 +49,194 @@ def parse_date(date_string):
     return date(*components)
 
 
+class ChannelLogs:
+    """Every log of one channel, in date order.
+
+    Kept as parallel sequences rather than a dict per file: dates as ordinals
+    in an array, so that ranges can be found by bisection, and filenames
+    relative to ``base``. ``packed`` holds the date within the pack for days
+    that live in one, and None otherwise.
+    """
+    __slots__ = ('channel', 'base', 'ordinals', 'dates', 'filenames', 'packed')
+
+    def __init__(self, channel, base, files):
+        """``files`` are (date, filename, packed) tuples in any order."""
+        chosen = {}
+
+        # A day caught between being compressed or packed and its old file
+        # going has two; the new one is complete by then, and stays.
+        for log_date, filename, packed in files:
+            ordinal = parse_date(log_date).toordinal()
+            rank = (packed is not None, archive.is_compressed(filename))
+
+            if ordinal not in chosen or rank > chosen[ordinal][0]:
+                chosen[ordinal] = (rank, log_date, filename, packed)
+
+        files = sorted((ordinal,) + day[1:] for ordinal, day in chosen.items())
+
+        self.channel = channel
+        self.base = base
+        self.ordinals = array('I', (f[0] for f in files))
+        self.dates = [f[1] for f in files]
+        self.filenames = [f[2] for f in files]
+        self.packed = [f[3] for f in files]
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def path(self, i):
+        return os.path.join(self.base, self.filenames[i])
+
+    def date_obj(self, i):
+        return date.fromordinal(self.ordinals[i])
+
+    def stamp(self, i):
+        path = self.path(i)
+        st = os.stat(path)
+
+        return path, self.packed[i], st.st_mtime_ns, st.st_size
+
+    def summary(self, i):
+        """A DaySummary of the ``i``th log."""
+        path, packed, mtime_ns, size = self.stamp(i)
+
+        return DaySummary(self.dates[i], *concurrency.blocking(_measure, path, packed, mtime_ns, size))
+
+    def index(self, log_date):
+        """Position of ``log_date`` (a display date), or None."""
+        i = bisect_left(self.ordinals, parse_date(log_date).toordinal())
+
+        if i < len(self.dates) and self.dates[i] == log_date:
+            return i
+
+        return None
+
+    def between(self, date_begin=None, date_end=None):
+        """Positions of the logs after ``date_begin`` up to and including
+        ``date_end``. Either end may be None for no bound.
+        """
+        lo = bisect_right(self.ordinals, date_begin.toordinal()) if date_begin else 0
+        hi = bisect_right(self.ordinals, date_end.toordinal()) if date_end else len(self.ordinals)
+
+        return range(lo, max(lo, hi))
+
+
+class LogLines:
+    """A log's (line number, line) pairs, read each time they're iterated
+    over: a caller with a cached copy of what it would make of them needn't
+    read them at all.
+    """
+    __slots__ = ('_read', '_start')
+
+    def __init__(self, read, start):
+        self._read = read
+        self._start = start
+
+    def __iter__(self):
+        return enumerate(self._read(), start=self._start)
+
+
+# Keyed on the stamp, so today's log is counted again as it grows.
+@fastcache.clru_cache(maxsize=16384)
+def _measure(path, packed, mtime_ns, size):
+    """(size, line count) of a log, as ChannelLogs.summary has them."""
+    if packed:
+        day = pack.read_header(path).days[packed]
+        return day.length, day.line_count
+
+    if archive.is_compressed(path):
+        index = archive.read_index(path)
+
+        # Only the last block needs inflating.
+        if index and index[0]:
+            last = index[1][-1]
+            return size, last + len(archive.read_lines(path, last))
+
+        return size, len(archive.read_lines(path))
+
+    lines = 0
+    last = b'\n'
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COUNT_READ_SIZE), b''):
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+
+    # As readlines() counts them: a last line needn't end in a newline.
+    return size, lines + (last != b'\n')
+
+
+class ChannelIndex:
+    """Case-insensitive substring lookup over a network's channel names.
+
+    The lowercased names are joined into one newline-separated string, so a
+    lookup is a few str.find calls rather than a pass over every name.
+    """
+    __slots__ = ('names', 'name_set', 'haystack', 'offsets')
+
+    SEPARATOR = '\n'
+
+    def __init__(self, names):
+        self.names = sorted(set(names))
+        self.name_set = frozenset(self.names)
+
+        lowered = [name.lower() for name in self.names]
+        self.haystack = ChannelIndex.SEPARATOR.join(lowered)
+
+        self.offsets = array('I')
+        offset = 0
+        for name in lowered:
+            self.offsets.append(offset)
+            offset += len(name) + len(ChannelIndex.SEPARATOR)
+
+    def __contains__(self, channel):
+        return channel in self.name_set
+
+    def matching(self, channel):
+        """Every name containing ``channel``, ignoring case."""
+        needle = channel.lower()
+        found = set()
+
+        if not self.names or ChannelIndex.SEPARATOR in needle:
+            return found
+
+        start = 0
+        while True:
+            position = self.haystack.find(needle, start)
+            if position < 0:
+                break
+
+            i = bisect_right(self.offsets, position) - 1
+            found.add(self.names[i])
+
+            # On to the next name; one hit per name is plenty.
+            if i + 1 == len(self.offsets):
+                break
+            start = self.offsets[i + 1]
+
+        return found
+
+
 class LogPath:
 
     def __init__(self, ac):
         self.ac = ac
 
     def networks(self):
+        dirs = concurrency.blocking(self._list_networks)
+
+        return sorted(self.ac.filter_networks(dirs))
+
+    def _list_networks(self):
         base_contents = os.listdir(config.LOG_BASE)
 
-        dirs = [
+        return [
             network for network in base_contents
             if os.path.isdir(
                 self.network_to_path(network)
-            ) and self.ac.evaluate(network, None)
+            )
         ]
 
-        return sorted(dirs)
-
     def channels(self, network):
         matches = self._channels_list(network)
 
@@ -60,11 +245,7 @@ class LogPath:
             raise exceptions.NoResultsException()
 
         channels = natsorted(
-            {
-                filename['channel']
-                for filename in matches
-                if self.ac.evaluate(network, filename['channel'])
-            },
+            set(self.ac.filter(network, matches)),
             alg=ns.G | ns.LF,
         )
 
@@ -74,7 +255,11 @@ class LogPath:
         return channels
 
     def channel_dates(self, network, channel):
-        matches = self._channels_list(network)
+        return self.channel_logs(network, channel).dates[::-1]
+
+    def channel_logs(self, network, channel):
+        """The ChannelLogs of a channel."""
+        matches = self._catalog(network)
 
         if matches is None:
             raise exceptions.NoResultsException()
@@ -83,7 +268,7 @@ class LogPath:
             raise exceptions.NoResultsException()
 
         try:
-            self._maybe_channel(network, channel, matches)
+            self._maybe_channel(network, channel, self._channel_index(network))
         except (
             exceptions.NoResultsException,
             exceptions.MultipleResultsException,
@@ -91,28 +276,27 @@ class LogPath:
         ):
             raise
 
-        dates = [filename['date'] for filename in matches if filename['channel'] == channel]
-
-        return sorted(dates, reverse=True)
+        return matches[channel]
 
     def channels_dates(self, network, channels):
-        """For search use.
-        Further filtering will be performed on the search side.
+        """For search use: a ChannelLogs for each of ``channels`` that has
+        any. Further filtering will be performed on the search side.
         """
-        matches = self._channels_list(network)
+        matches = self._catalog(network)
 
         if matches is None:
             raise exceptions.NoResultsException()
 
         # This behavior is slightly different from elsewhere.
-        channels = [ch for ch in channels if self.ac.evaluate(network, ch)]
-
-        files = [filename for filename in matches if filename['channel'] in channels]
+        channels = self.ac.filter(network, channels)
 
-        return sorted(files, key=itemgetter('date_obj'), reverse=True)
+        return [matches[ch] for ch in channels if ch in matches]
 
-    def log(self, network, channel, date):
-        matches = self._channels_list(network)
+    def log(self, network, channel, date, lines=None):
+        """The log of a day. ``lines`` is (start, stop), counting from zero,
+        to read only those lines of it.
+        """
+        matches = self._catalog(network)
 
         if matches is None:
             raise exceptions.NoResultsException()
@@ -121,7 +305,7 @@ class LogPath:
             raise exceptions.NoResultsException()
 
         try:
-            self._maybe_channel(network, channel, matches)
+            self._maybe_channel(network, channel, self._channel_index(network))
         except (
             exceptions.NoResultsException,
             exceptions.MultipleResultsException,
@@ -129,10 +313,10 @@ class LogPath:
         ):
             raise
 
-        channel_files = [filename for filename in matches if filename['channel'] == channel]
-        channel_files = sorted(channel_files, key=itemgetter('date'))
+        return self._log(matches[channel], date, lines)
 
-        latest = channel_files[-1]['date']
+    def _log(self, logs, date, lines=None):
+        latest = logs.dates[-1]
 
         parsed_date = ldp.parse(date, latest)
         if not parsed_date:
@@ -140,37 +324,73 @@ class LogPath:
         elif parsed_date != date:
             raise exceptions.CanonicalNameException(util.Scope.DATE, parsed_date)
 
-        log = [filename for filename in channel_files if filename['date'] == date]
+        log_idx = logs.index(date)
 
-        if len(log) == 0:
+        if log_idx is None:
             raise exceptions.NoResultsException()
 
-        log = log[0]
-        log_idx = channel_files.index(log)
-
         before, after = None, None
         if log_idx > 0:
-            before = channel_files[log_idx - 1]['date']
-        if log_idx < len(channel_files) - 1:
-            after = channel_files[log_idx + 1]['date']
+            before = logs.dates[log_idx - 1]
+        if log_idx < len(logs) - 1:
+            after = logs.dates[log_idx + 1]
 
-        log_path = os.path.join(self.network_to_path(network), log['filename'])
+        stamp = logs.stamp(log_idx)
+
+        start, stop = lines or (0, None)
 
         # Enumerate at 1: these are log line numbers.
-        log_file = enumerate(open(log_path, errors='ignore').readlines(), start=1)
+        log_file = LogLines(lambda: self._read(logs, log_idx, start, stop), start + 1)
 
-        return LogResult(log_file, before, after)
+        return LogResult(log_file, before, after, stamp)
 
     @fastcache.clru_cache(maxsize=128)
     def network_to_path(self, network):
         return os.path.join(config.LOG_BASE, network, LOG_INTERMEDIATE_BASE)
 
-    def _maybe_channel(self, network, channel, matches):
-        # This looks a bit intensive.
+    def warm_up(self):
+        """Load every network's channels ahead of the first request."""
+        for network in os.listdir(config.LOG_BASE):
+            if os.path.isdir(self.network_to_path(network)):
+                self._channel_index(network)
+
+    def _read(self, logs, i, start=0, stop=None):
+        """Read lines [start, stop) of the ``i``th log of a ChannelLogs,
+        wherever it is kept.
+        """
+        path = logs.path(i)
+
+        with metrics.stage('read'):
+            if logs.packed[i]:
+                day = concurrency.blocking(pack.read_day, path, logs.packed[i])
+
+                if start == 0 and stop is None:
+                    return day
+                return day[start:stop]
+
+            return concurrency.blocking(archive.read_lines, path, start, stop)
+
+    def _packed_dates(self, path, filename):
+        """(date, filename, packed) for every day in a pack, or none if it
+        can't be read.
+        """
+        try:
+            packed_dates = pack.dates(path)
+        except (OSError, ValueError) as ex:
+            util.log("Skipping unreadable pack {}: {}".format(path, ex))
+            return []
+
+        return [(packed_date, filename, packed_date) for packed_date in packed_dates]
+
+    def _maybe_channel(self, network, channel, index):
+        # An exact match always stands, however many others contain it.
+        if channel in index:
+            return
+
         # Accomodate partial matches to see if containing-match only matches
         # one channel. If it does, we can 302 to the real URL, but otherwise
         # we should 404.
-        maybe_channels = {filename['channel'] for filename in matches if channel.lower() in filename['channel'].lower()}
+        maybe_channels = index.matching(channel)
 
         # Bail if it's ambiguous...
         if len(maybe_channels) > 1:
@@ -188,26 +408,75 @@ class LogPath:
             raise exceptions.NoResultsException()
 
     def _channels_list(self, network):
+        catalog = self._catalog(network)
+
+        if catalog is None:
+            return None
+
+        return list(catalog)
+
+    def _catalog(self, network):
+        """A ChannelLogs for every channel of the network, by name."""
         channel_base = self.network_to_path(network)
 
-        if not os.path.exists(channel_base):
+        try:
+            mtime_ns = os.stat(channel_base).st_mtime_ns
+        except FileNotFoundError:
             return None
 
-        files = os.listdir(channel_base)
+        return self._read_catalog(channel_base, mtime_ns)
+
+    def _channel_index(self, network):
+        channel_base = self.network_to_path(network)
 
-        file_matches = [LOG_FILENAME_REGEX.match(filename) for filename in files]
-        file_matches = [match.groupdict() for match in file_matches if match is not None]
+        try:
+            mtime_ns = os.stat(channel_base).st_mtime_ns
+        except FileNotFoundError:
+            return None
 
-        for match in file_matches:
-            match['date_obj'] = parse_date(match['date'])
+        return self._read_channel_index(channel_base, mtime_ns)
 
-        return file_matches
+    # Keyed on the directory's mtime: days and packs coming and going touch
+    # it, writes to today's log don't.
+    @fastcache.clru_cache(maxsize=128)
+    def _read_channel_index(self, channel_base, mtime_ns):
+        return ChannelIndex(self._read_catalog(channel_base, mtime_ns))
+
+    @fastcache.clru_cache(maxsize=128)
+    def _read_catalog(self, channel_base, mtime_ns):
+        with metrics.stage('listing'):
+            return concurrency.blocking(self._list_catalog, channel_base)
+
+    def _list_catalog(self, channel_base):
+        files = defaultdict(list)
+
+        for filename in os.listdir(channel_base):
+            match = LOG_FILENAME_REGEX.match(filename)
+            if match is not None:
+                files[match.group('channel')].append((match.group('date'), filename, None))
+                continue
+
+            match = PACK_FILENAME_REGEX.match(filename)
+            if match is not None:
+                files[match.group('channel')].extend(self._packed_dates(
+                    os.path.join(channel_base, filename),
+                    filename,
+                ))
+
+        return {
+            channel: ChannelLogs(channel, channel_base, channel_files)
+            for channel, channel_files in files.items()
+        }
 
 
 class DirectoryDelimitedLogPath(LogPath):
     LOG_SUFFIX = '.log'
+    LOG_SUFFIXES = (LOG_SUFFIX, LOG_SUFFIX + archive.COMPRESSED_SUFFIX)
 
     def channel_dates(self, network, channel):
+        return self.channel_logs(network, channel).dates[::-1]
+
+    def channel_logs(self, network, channel):
         dates = self._dates_list(network, channel)
 
         if not dates:
@@ -216,8 +485,7 @@ class DirectoryDelimitedLogPath(LogPath):
         if not self.ac.evaluate(network, channel):
             raise exceptions.NoResultsException()
 
-        dates = [x['date'] for x in dates]
-        return sorted(dates, reverse=True)
+        return dates
 
     def channels_dates(self, network, channels):
         """
@@ -229,13 +497,13 @@ class DirectoryDelimitedLogPath(LogPath):
             raise exceptions.NoResultsException()
 
         # This behavior is slightly different from elsewhere.
-        channels = [ch for ch in channels if self.ac.evaluate(network, ch)]
+        channels = self.ac.filter(network, channels)
 
-        files = chain.from_iterable([self._dates_list(network, ch) for ch in channels])
+        logs = [self._dates_list(network, ch) for ch in channels]
 
-        return sorted(files, key=itemgetter('date_obj'), reverse=True)
+        return [channel_logs for channel_logs in logs if channel_logs]
 
-    def log(self, network, channel, date):
+    def log(self, network, channel, date, lines=None):
         channels = self._channels_list(network)
         dates = self._dates_list(network, channel)
 
@@ -246,7 +514,7 @@ class DirectoryDelimitedLogPath(LogPath):
             raise exceptions.NoResultsException()
 
         try:
-            self._maybe_channel(network, channel, channels)
+            self._maybe_channel(network, channel, self._channel_index(network))
         except (
             exceptions.NoResultsException,
             exceptions.MultipleResultsException,
@@ -254,36 +522,10 @@ class DirectoryDelimitedLogPath(LogPath):
         ):
             raise
 
-        latest = max(dates, key=itemgetter('date'))['date']
-
-        parsed_date = ldp.parse(date, latest)
-        if not parsed_date:
-            raise exceptions.NoResultsException()
-        elif parsed_date != date:
-            raise exceptions.CanonicalNameException(util.Scope.DATE, parsed_date)
-
-        # Reverse the human-friendly ordering here.
-        channel_dates = self.channel_dates(network, channel)[::-1]
-        log = [log_date for log_date in channel_dates if log_date == date]
-
-        if len(log) == 0:
+        if not dates:
             raise exceptions.NoResultsException()
 
-        log = log[0]
-        log_idx = channel_dates.index(log)
-
-        before, after = None, None
-        if log_idx > 0:
-            before = channel_dates[log_idx - 1]
-        if log_idx < len(channel_dates) - 1:
-            after = channel_dates[log_idx + 1]
-
-        log_path = os.path.join(self.channel_to_path(network, channel),
-                                log + DirectoryDelimitedLogPath.LOG_SUFFIX)
-
-        log_file = enumerate(open(log_path, errors='ignore').readlines(), start=1)
-
-        return LogResult(log_file, before, after)
+        return self._log(dates, date, lines)
 
     # This lets us use LogPath.networks instead of reimplementing.
     @fastcache.clru_cache(maxsize=128)
@@ -302,10 +544,17 @@ class DirectoryDelimitedLogPath(LogPath):
         if not os.path.exists(network_base):
             return None
 
-        files = os.listdir(network_base)
-        files = [{'channel': channel} for channel in files]
+        with metrics.stage('listing'):
+            return concurrency.blocking(os.listdir, network_base)
 
-        return files
+    @cachetools.ttl_cache(maxsize=128, ttl=21600)
+    def _channel_index(self, network):
+        channels = self._channels_list(network)
+
+        if channels is None:
+            return None
+
+        return ChannelIndex(channels)
 
     def _dates_list(self, network, channel):
         channel_base = self.channel_to_path(network, channel)
@@ -313,17 +562,22 @@ class DirectoryDelimitedLogPath(LogPath):
         if not os.path.exists(channel_base):
             return None
 
+        with metrics.stage('listing'):
+            return concurrency.blocking(self._list_dates, channel, channel_base)
+
+    def _list_dates(self, channel, channel_base):
         files = os.listdir(channel_base)
-        files = [{
-            'channel': channel,
-            'date': filename[:-1 * len(DirectoryDelimitedLogPath.LOG_SUFFIX)],
-            'filename': os.path.join(channel_base, filename)
-        } for filename in files if filename.endswith(DirectoryDelimitedLogPath.LOG_SUFFIX)]
+        packs = [filename for filename in files if DIRECTORY_PACK_FILENAME_REGEX.match(filename)]
+        files = [(
+            filename[:filename.rindex(DirectoryDelimitedLogPath.LOG_SUFFIX)],
+            filename,
+            None,
+        ) for filename in files if filename.endswith(DirectoryDelimitedLogPath.LOG_SUFFIXES)]
 
-        for f in files:
-            f['date_obj'] = parse_date(f['date'])
+        for filename in packs:
+            files.extend(self._packed_dates(os.path.join(channel_base, filename), filename))
 
-        return files
+        return ChannelLogs(channel, channel_base, files)
 
 
 class ZNC16DirectoryDelimitedLogPath(DirectoryDelimitedLogPath):
@@ -346,60 +600,6 @@ class ZNC16DirectoryDelimitedLogPath(DirectoryDelimitedLogPath):
         if not files:
             return files
 
-        for f in files:
-            f['date'] = f['date_obj'].strftime("%Y%m%d")
+        files.dates = [date.fromordinal(ordinal).strftime("%Y%m%d") for ordinal in files.ordinals]
 
         return files
-
-    def log(self, network, channel, date):
-        channels = self._channels_list(network)
-        dates = self._dates_list(network, channel)
-
-        if channels is None or dates is None:
-            raise exceptions.NoResultsException()
-
-        if not self.ac.evaluate(network, channel):
-            raise exceptions.NoResultsException()
-
-        try:
-            self._maybe_channel(network, channel, channels)
-        except (
-            exceptions.NoResultsException,
-            exceptions.MultipleResultsException,
-            exceptions.CanonicalNameException,
-        ):
-            raise
-
-        latest = max(dates, key=itemgetter('date'))['date']
-
-        parsed_date = ldp.parse(date, latest)
-        if not parsed_date:
-            raise exceptions.NoResultsException()
-        elif parsed_date != date:
-            raise exceptions.CanonicalNameException(util.Scope.DATE, parsed_date)
-
-        # Reverse the human-friendly ordering here.
-        channel_dates = self.channel_dates(network, channel)[::-1]
-        log = [log_date for log_date in channel_dates if log_date == date]
-
-        if len(log) == 0:
-            raise exceptions.NoResultsException()
-
-        log = log[0]
-        log_idx = channel_dates.index(log)
-
-        # Convert the no-dash presentation date...
-        log = log[0:4] + '-' + log[4:6] + '-' + log[6:8]
-
-        before, after = None, None
-        if log_idx > 0:
-            before = channel_dates[log_idx - 1]
-        if log_idx < len(channel_dates) - 1:
-            after = channel_dates[log_idx + 1]
-
-        log_path = os.path.join(self.channel_to_path(network, channel),
-                                log + DirectoryDelimitedLogPath.LOG_SUFFIX)
-
-        log_file = enumerate(open(log_path, errors='ignore').readlines(), start=1)
-
-        return LogResult(log_file, before, after)
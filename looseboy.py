@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
 import re
 from collections import namedtuple
-from datetime import datetime
+from datetime import date
 from datetime import timedelta
 from itertools import repeat, chain
 
+import fastcache
+
 MatchReplace = namedtuple('MatchReplace', ['matching', 'year', 'month', 'day'])
 
 class LooseDateParser(object):
-    """It's gonna be shitty, and you know it."""
+    """It's gonna be shitty, and you know it.
+
+    Parsing depends only on the text, the latest date there is a log for and
+    today's date, which are all passed in, so one parser can be shared by
+    every thread. Results are cached on those three; when the day changes,
+    so do the keys.
+    """
 
     RENDER_FORMAT = "%Y%m%d"
     DATE_SEPARATORS = "-./"
@@ -40,9 +48,9 @@ class LooseDateParser(object):
 
         self.formats = [
             # Literals
-            (self.literal("today"), self.render_callable(datetime.now)),
+            (self.literal("today"), self.render_callable(lambda today: today)),
             (self.literal("yesterday"), self.render_callable(LooseDateParser.yesterday)),
-            (self.literal("latest"), lambda _: self.latest),
+            (self.literal("latest"), lambda _, latest, today: latest),
 
             # Weekdays
             (self.regex(
@@ -88,7 +96,7 @@ class LooseDateParser(object):
 
     @staticmethod
     def _prepend_verify_length(length, cleaners):
-        def verify_length(match_fields):
+        def verify_length(match_fields, today):
             if len(match_fields['original']) != length:
                 raise ValueError
             return match_fields
@@ -98,19 +106,20 @@ class LooseDateParser(object):
 
 
     @staticmethod
-    def yesterday():
-        now = datetime.now()
+    def yesterday(today):
         delta = timedelta(days=1)
-        return now - delta
+        return today - delta
 
     def literal(self, text):
-        def match(input):
+        def match(input, today):
             return MatchReplace(text == input, None, None, None)
         return match
 
     def regex(self, regex, cleaners):
-        def match(input):
-            result = re.match(regex, input)
+        pattern = re.compile(regex)
+
+        def match(input, today):
+            result = pattern.match(input)
             has_match = bool(result)
 
             if not has_match:
@@ -121,7 +130,7 @@ class LooseDateParser(object):
 
             try:
                 for cleaner in cleaners:
-                    match_fields = cleaner(match_fields)
+                    match_fields = cleaner(match_fields, today)
             except ValueError:
                 return MatchReplace(False, None, None, None)
 
@@ -135,8 +144,8 @@ class LooseDateParser(object):
         return match
 
     @staticmethod
-    def _guess_weekday(match_fields):
-        now = datetime.now()
+    def _guess_weekday(match_fields, today):
+        now = today
         weekday = match_fields['day']
         weekday_index = LooseDateParser.WEEKDAYS.index(weekday)
 
@@ -154,7 +163,7 @@ class LooseDateParser(object):
         return match_fields
 
     @staticmethod
-    def _int_cast(match_fields):
+    def _int_cast(match_fields, today):
         # zzz
         for k, v in match_fields.items():
             try:
@@ -165,7 +174,7 @@ class LooseDateParser(object):
         return match_fields
 
     @staticmethod
-    def _guess_disambiguation(match_fields):
+    def _guess_disambiguation(match_fields, today):
         """Time to do a bit of guessing."""
 
         def assign(match_fields, sources, targets):
@@ -181,11 +190,11 @@ class LooseDateParser(object):
         return assign(match_fields, ('ambig', 'ambigger'), order)
 
     @staticmethod
-    def _guess_year(match_fields):
+    def _guess_year(match_fields, today):
         if 'year' in match_fields:
             return match_fields
 
-        now = datetime.now()
+        now = today
         if bool(
             (match_fields['month'] == now.month and match_fields['day'] > now.day)
             or match_fields['month'] > now.month
@@ -197,8 +206,8 @@ class LooseDateParser(object):
         return match_fields
 
     @staticmethod
-    def _enrich_year(match_fields):
-        now = datetime.now()
+    def _enrich_year(match_fields, today):
+        now = today
         century = now.year // 100
 
         year = match_fields['year']
@@ -218,25 +227,29 @@ class LooseDateParser(object):
         return ''.join(list(chain.from_iterable(zip(components, fountain))))
 
     def render_callable(self, callable):
-        def render(match_replace):
-            return callable().strftime(self.RENDER_FORMAT)
+        def render(match_replace, latest, today):
+            return callable(today).strftime(self.RENDER_FORMAT)
         return render
 
-    def render(self, match_replace):
-        return datetime(
+    def render(self, match_replace, latest, today):
+        return date(
             match_replace.year,
             match_replace.month,
             match_replace.day
         ).strftime(self.RENDER_FORMAT)
 
-    def parse(self, text, latest):
-        text = text.lower()
-        self.latest = latest
+    def parse(self, text, latest, today=None):
+        """Canonicalize ``text`` to a %Y%m%d date, or None. ``latest`` is what
+        "latest" means; ``today`` defaults to the real one.
+        """
+        return self._parse(text.lower(), latest, today or date.today())
 
+    @fastcache.clru_cache(maxsize=1024)
+    def _parse(self, text, latest, today):
         for matcher, replacer in self.formats:
-            match_replace = matcher(text)
+            match_replace = matcher(text, today)
             if match_replace.matching:
-                return replacer(match_replace)
+                return replacer(match_replace, latest, today)
 
         return None
 
@@ -0,0 +1,329 @@
+"""Request and stage timings, cache statistics and search pool depth, served
+in the Prometheus text format.
+
+Everything is kept in one anonymous shared mmap made by init() before uwsgi
+forks the workers: a slot of doubles per worker, only ever written by that
+worker, and summed when scraped. Under lazy-apps each worker makes its own
+map and so only reports on itself.
+
+Stage timings are also added up per request, for the Server-Timing header.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+import inspect
+import mmap
+import sys
+import threading
+import time
+
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STAGES = ('listing', 'acl', 'read', 'stats', 'render', 'grep')
+
+# Server-Timing names and descriptions for the stages, plus template filters,
+# which are only timed per request: they run once or more a line.
+SERVER_TIMINGS = (
+    ('listing', 'catalog', 'Catalog lookup'),
+    ('acl', 'acl', 'ACL'),
+    ('read', 'read', 'Log read'),
+    ('stats', 'stats', 'Day stats'),
+    ('filters', 'filters', 'Line filters'),
+    ('render', 'template', 'Template'),
+    ('grep', 'grep', 'Search'),
+)
+
+# Modules whose clru_cache/ttl_cache functions get reported on. monkey_patch
+# installs its caches into werkzeug.urls.
+CACHED_MODULES = ('acl', 'grep', 'line_format', 'log_path', 'looseboy', 'monkey_patch', 'pack', 'stats', 'werkzeug.urls')
+
+# Seconds between a worker refreshing its cache statistics.
+CACHE_REFRESH_INTERVAL = 1
+
+# Route label for requests that didn't match one.
+UNMATCHED_ROUTE = ''
+
+# A histogram is its buckets, then +Inf, sum and count.
+HISTOGRAM_WIDTH = len(BUCKETS) + 3
+
+
+class Store:
+
+    def __init__(self, routes, caches, slots):
+        self.caches = caches
+        self.slots = slots
+        self.offsets = {}
+
+        width = 0
+
+        for key in [('route', route) for route in routes] + [('stage', stage) for stage in STAGES]:
+            self.offsets[key] = width
+            width += HISTOGRAM_WIDTH
+
+        for name, _ in caches:
+            self.offsets[('cache', name)] = width
+            width += 2
+
+        self.offsets[('pool',)] = width
+        width += 1
+
+        self.width = width
+        self.map = mmap.mmap(-1, 8 * width * slots)
+        self.values = memoryview(self.map).cast('d')
+
+        self.lock = threading.Lock()
+        self.caches_refreshed = 0
+
+        # Made after warming up and before the fork, so every worker starts
+        # out with these counts; it only reports on what it's done since.
+        self.caches_baseline = {name: cached.cache_info() for name, cached in caches}
+
+    def _base(self):
+        slot = uwsgi.worker_id() if uwsgi is not None else 0
+        return self.width * (slot if slot < self.slots else 0)
+
+    def observe(self, key, seconds):
+        offset = self._base() + self.offsets[key]
+
+        with self.lock:
+            self.values[offset + bisect_left(BUCKETS, seconds)] += 1
+            self.values[offset + len(BUCKETS) + 1] += seconds
+            self.values[offset + len(BUCKETS) + 2] += 1
+
+    def add(self, key, delta):
+        offset = self._base() + self.offsets[key]
+
+        with self.lock:
+            self.values[offset] += delta
+
+    def refresh_caches(self, force=False):
+        now = time.time()
+
+        if not force and now - self.caches_refreshed < CACHE_REFRESH_INTERVAL:
+            return
+
+        self.caches_refreshed = now
+        base = self._base()
+
+        for name, cached in self.caches:
+            info = cached.cache_info()
+            baseline = self.caches_baseline[name]
+            offset = base + self.offsets[('cache', name)]
+            self.values[offset] = info.hits - baseline.hits
+            self.values[offset + 1] = info.misses - baseline.misses
+
+    def total(self, key, width=1):
+        offset = self.offsets[key]
+
+        return [
+            sum(self.values[slot * self.width + offset + i] for slot in range(self.slots))
+            for i in range(width)
+        ]
+
+
+_store = None
+
+
+class _Request(threading.local):
+    timings = None
+
+
+_request = _Request()
+
+
+def init(routes):
+    """Lay out the store; call before the workers are forked."""
+    global _store
+
+    slots = uwsgi.numproc + 1 if uwsgi is not None else 1
+    _store = Store(sorted(routes) + [UNMATCHED_ROUTE], find_caches(), slots)
+
+
+def find_caches():
+    """(name, function) for every cached function in CACHED_MODULES, methods
+    included.
+    """
+    caches = []
+    seen = set()
+
+    def visit(prefix, namespace):
+        for name, value in sorted(vars(namespace).items()):
+            if inspect.isclass(value) and value.__module__ == namespace.__name__:
+                visit('{}{}.'.format(prefix, name), value)
+            elif _has_cache_info(value) and id(value) not in seen:
+                seen.add(id(value))
+                caches.append((prefix + name, value))
+
+    for module_name in CACHED_MODULES:
+        if module_name in sys.modules:
+            visit(module_name + '.', sys.modules[module_name])
+
+    return caches
+
+
+def _has_cache_info(value):
+    try:
+        return hasattr(value, 'cache_info')
+    except Exception:
+        # Proxies like flask.session, outside of a request.
+        return False
+
+
+def observe_request(route, seconds):
+    if _store is not None:
+        _store.observe(('route', route or UNMATCHED_ROUTE), seconds)
+        _store.refresh_caches()
+
+
+@contextmanager
+def stage(name):
+    begin = perf_counter()
+
+    try:
+        yield
+    finally:
+        _record(name, perf_counter() - begin)
+
+
+def _record(name, seconds):
+    if _store is not None:
+        _store.observe(('stage', name), seconds)
+
+    timings = _request.timings
+    if timings is not None:
+        timings[name] += seconds
+
+
+def timed_iter(name, iterable):
+    """Time producing each item of ``iterable`` as stage ``name``, but not
+    whatever happens to the items in between.
+    """
+    elapsed = 0
+    it = iter(iterable)
+
+    try:
+        while True:
+            begin = perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                break
+            finally:
+                elapsed += perf_counter() - begin
+
+            yield item
+    finally:
+        _record(name, elapsed)
+
+
+def timed_filter(f):
+    """Wrap template filter ``f`` so that its time counts towards the
+    request's Server-Timing.
+    """
+    @wraps(f)
+    def timed(*args, **kwargs):
+        begin = perf_counter()
+
+        try:
+            return f(*args, **kwargs)
+        finally:
+            timings = _request.timings
+            if timings is not None:
+                timings['filters'] += perf_counter() - begin
+
+    return timed
+
+
+def start_request():
+    """Start adding up this thread's stage timings for a new request."""
+    _request.timings = defaultdict(float)
+
+
+def server_timing(total):
+    """The Server-Timing header value for the request so far, taking
+    ``total`` seconds.
+    """
+    timings = _request.timings or {}
+
+    # Filters run inside templates; count them once.
+    template = timings.get('render', 0) - timings.get('filters', 0)
+
+    entries = []
+    for stage_name, name, description in SERVER_TIMINGS:
+        seconds = template if stage_name == 'render' else timings.get(stage_name, 0)
+
+        if seconds > 0:
+            entries.append('{};dur={:.3f};desc="{}"'.format(name, seconds * 1000, description))
+
+    entries.append('total;dur={:.3f}'.format(total * 1000))
+
+    return ', '.join(entries)
+
+
+def pool_queued(delta):
+    if _store is not None:
+        _store.add(('pool',), delta)
+
+
+def exposition():
+    _store.refresh_caches(force=True)
+
+    lines = []
+
+    def histogram(name, help_text, label, values):
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} histogram'.format(name))
+
+        for value in values:
+            counts = _store.total((label, value), HISTOGRAM_WIDTH)
+            labels = '{}="{}"'.format(label, _escape(value))
+
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, _number(cumulative)))
+
+            lines.append('{}_sum{{{}}} {}'.format(name, labels, repr(counts[-2])))
+            lines.append('{}_count{{{}}} {}'.format(name, labels, _number(counts[-1])))
+
+    routes = [key[1] for key in _store.offsets if key[0] == 'route']
+    histogram('moffle_request_duration_seconds', 'Time spent on requests, by route.', 'route', routes)
+    histogram('moffle_stage_duration_seconds', 'Time spent in each stage of handling requests.', 'stage', STAGES)
+
+    ratios = []
+    for kind in ('hits', 'misses'):
+        lines.append('# HELP moffle_cache_{}_total Cache {}, summed over workers.'.format(kind, kind))
+        lines.append('# TYPE moffle_cache_{}_total counter'.format(kind))
+
+        for name, _ in _store.caches:
+            hits, misses = _store.total(('cache', name), 2)
+            lines.append('moffle_cache_{}_total{{cache="{}"}} {}'.format(
+                kind, name, _number(hits if kind == 'hits' else misses),
+            ))
+
+            if kind == 'hits':
+                ratios.append((name, hits / (hits + misses) if hits + misses else 0))
+
+    lines.append('# HELP moffle_cache_hit_ratio Cache hits over lookups, summed over workers.')
+    lines.append('# TYPE moffle_cache_hit_ratio gauge')
+    lines.extend('moffle_cache_hit_ratio{{cache="{}"}} {}'.format(name, repr(ratio)) for name, ratio in ratios)
+
+    lines.append('# HELP moffle_search_pool_queue_depth Search output chunks waiting on or in the process pool.')
+    lines.append('# TYPE moffle_search_pool_queue_depth gauge')
+    lines.append('moffle_search_pool_queue_depth {}'.format(_number(_store.total(('pool',))[0])))
+
+    return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    return str(int(value))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
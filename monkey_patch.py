@@ -24,8 +24,6 @@ def _get_stringy_set(seq, charset, errors):
         seq = seq.encode(charset, errors)
     return bytearray(seq)
 
-_cached_get_stringy_set = fastcache.clru_cache()(_get_stringy_set)
-
 def _upstream_transform(string, safe):
     rv = bytearray()
 
@@ -58,11 +56,33 @@ def _chunking_transform(string, safe):
 
     return rv
 
-_get_stringy_set_impl = _get_stringy_set
-_transform_impl = _upstream_transform
+@fastcache.clru_cache(maxsize=128)
+def _quote_table(safe):
+    """For a frozenset of safe bytes: the bytes themselves, and what each
+    of the 256 bytes quotes to."""
+    return bytes(sorted(safe)), [
+        bytes((char,)) if char in safe else ('%%%02X' % char).encode('ascii')
+        for char in range(256)
+    ]
+
+def _translate_transform(string, safe):
+    safe_bytes, table = _quote_table(safe)
+
+    # Mostly there's nothing to quote, which translate() can tell in C.
+    if not string.translate(None, safe_bytes):
+        return string
+
+    return b''.join(map(table.__getitem__, string))
 
-_get_stringy_set_impl = _cached_get_stringy_set
-# _transform_impl = _chunking_transform
+@fastcache.clru_cache(maxsize=128)
+def _safe_set(safe, unsafe, charset, errors):
+    safe = _get_stringy_set(safe, charset, errors)
+    unsafe = _get_stringy_set(unsafe, charset, errors)
+
+    return frozenset(safe + _always_safe) - frozenset(unsafe)
+
+# The other two are kept for benchmarks.micro to measure against.
+_transform_impl = _translate_transform
 
 def _url_quote(string, charset='utf-8', errors='strict', safe='/:', unsafe=''):
     """URL encode a single string with a given encoding.
@@ -80,11 +100,7 @@ def _url_quote(string, charset='utf-8', errors='strict', safe='/:', unsafe=''):
     if isinstance(string, text_type):
         string = string.encode(charset, errors)
 
-    safe = _get_stringy_set_impl(safe, charset, errors)
-    unsafe = _get_stringy_set_impl(unsafe, charset, errors)
-
-    safe = frozenset(safe + _always_safe) - frozenset(unsafe)
-    rv = _transform_impl(string, safe)
+    rv = _transform_impl(bytes(string), _safe_set(safe, unsafe, charset, errors))
     return to_native(bytes(rv))
 
 
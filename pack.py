@@ -0,0 +1,261 @@
+"""Packed per-channel monthly archives.
+
+A pack holds a run of closed days for one channel in one file: the text of
+each day back to back, so that grep reads nothing but log lines, with line
+numbers that map back to days through the header. The header, a line of
+JSON, sits next to the pack in a file of its own.
+
+The header optionally carries per-line columns (time of day, line type and
+nick) so that tools can skip parsing the text. With those it runs to
+megabytes for a busy month, which is why grep mustn't see it.
+
+A pack is rewritten days first, header second. A header that doesn't match
+the days it sits next to is passed over for the one waiting to be moved in
+after them, so a reader caught between the two, or a crash there, still
+sees a whole pack.
+"""
+from array import array
+from base64 import b64decode
+from base64 import b64encode
+from bisect import bisect_right
+from collections import namedtuple
+from collections import OrderedDict
+from io import BytesIO
+from io import TextIOWrapper
+import json
+import mmap
+import os
+import re
+
+import fastcache
+
+from log_line import LINE
+from log_line import TYPE_MAP
+
+MAGIC = b'MOFFLEPACK1 '
+SUFFIX = '.pack'
+HEADER_SUFFIX = '.head'
+TEMP_SUFFIX = '.tmp'
+
+LINE_TYPES = tuple(sorted(set(TYPE_MAP.values())))
+NONE_TYPE = 0xFF
+NONE_ID = 0xFFFFFFFF
+
+TIME_REGEX = re.compile(r'^\[(\d{2}):(\d{2}):(\d{2})\]')
+
+# day_list and first_lines are the days and their first lines, in order.
+Header = namedtuple('Header', ['channel', 'days', 'day_list', 'first_lines', 'nicks', 'columns'])
+Day = namedtuple('Day', ['date', 'offset', 'length', 'first_line', 'line_count'])
+Columns = namedtuple('Columns', ['time', 'type', 'nick'])
+
+
+def is_pack(path):
+    return path.endswith(SUFFIX)
+
+
+def read_header(path):
+    st = os.stat(path)
+
+    try:
+        header_mtime_ns = os.stat(path + HEADER_SUFFIX).st_mtime_ns
+    except FileNotFoundError:
+        header_mtime_ns = None
+
+    return _read_header(path, st.st_mtime_ns, st.st_size, header_mtime_ns)
+
+
+@fastcache.clru_cache(maxsize=1024)
+def _read_header(path, mtime_ns, size, header_mtime_ns):
+    header_path = path + HEADER_SUFFIX
+
+    for candidate in (header_path, header_path + TEMP_SUFFIX):
+        try:
+            header = _parse_header(candidate, size)
+        except (FileNotFoundError, ValueError):
+            continue
+
+        if header is not None:
+            return header
+
+    raise ValueError("Pack doesn't match its header", path)
+
+
+def _parse_header(header_path, size):
+    """The Header in ``header_path``, or None if it's for a pack of another
+    size.
+    """
+    with open(header_path, 'rb') as f:
+        line = f.readline()
+
+    if not line.startswith(MAGIC):
+        raise ValueError("Not a pack header", header_path)
+
+    raw = json.loads(line[len(MAGIC):].decode('utf-8'))
+
+    days = OrderedDict()
+    # As grep -n counts them.
+    first_line = 1
+    end = 0
+
+    for date, offset, length, line_count in raw['days']:
+        days[date] = Day(date, offset, length, first_line, line_count)
+        first_line += line_count
+        end = max(end, offset + length)
+
+    if end != size:
+        return None
+
+    day_list = tuple(days.values())
+
+    return Header(
+        channel=raw['channel'],
+        days=days,
+        day_list=day_list,
+        first_lines=[day.first_line for day in day_list],
+        nicks=raw.get('nicks'),
+        columns=raw.get('columns'),
+    )
+
+
+def dates(path):
+    return list(read_header(path).days)
+
+
+def read_day(path, date):
+    raw = read_raw_day(path, date)
+    return TextIOWrapper(BytesIO(raw), errors='ignore').readlines()
+
+
+def read_raw_day(path, date):
+    header = read_header(path)
+    day = header.days[date]
+    start = day.offset
+
+    if not day.length:
+        return b''
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return mm[start:start + day.length]
+
+
+def read_columns(path, date):
+    """Return the Columns of a day and the pack's nick table, or None if the
+    pack was written without columns.
+    """
+    header = read_header(path)
+
+    if header.columns is None:
+        return None
+
+    encoded = header.columns[date]
+    columns = Columns(*(
+        _decode_array(typecode, encoded[name])
+        for name, typecode in zip(Columns._fields, ('I', 'B', 'I'))
+    ))
+
+    return columns, header.nicks
+
+
+def locate(path, line_no):
+    """Map a line number in the pack file (as grep -n reports it) to the
+    date and line number within that day, or None if it's not in any.
+    """
+    header = read_header(path)
+
+    i = bisect_right(header.first_lines, line_no) - 1
+    if i < 0:
+        return None
+
+    day = header.day_list[i]
+    local_line_no = line_no - day.first_line + 1
+
+    if local_line_no > day.line_count:
+        return None
+
+    return day.date, local_line_no
+
+
+def write(path, channel, days, columns=False):
+    """Write a pack of ``days``, a list of (date, raw bytes) in date order."""
+    # Keep every day newline-terminated so days don't run together.
+    days = [
+        (date, raw if not raw or raw.endswith(b'\n') else raw + b'\n')
+        for date, raw in days
+    ]
+
+    entries = []
+    offset = 0
+
+    nicks = OrderedDict()
+    encoded_columns = OrderedDict()
+
+    for date, raw in days:
+        line_count = raw.count(b'\n')
+        entries.append([date, offset, len(raw), line_count])
+        offset += len(raw)
+
+        if columns:
+            encoded_columns[date] = _encode_columns(raw, nicks)
+
+    header = OrderedDict((
+        ('channel', channel),
+        ('days', entries),
+    ))
+
+    if columns:
+        header['nicks'] = list(nicks)
+        header['columns'] = encoded_columns
+
+    header_path = path + HEADER_SUFFIX
+    header_temp_path = header_path + TEMP_SUFFIX
+    temp_path = path + TEMP_SUFFIX
+
+    with open(temp_path, 'wb') as f:
+        for _, raw in days:
+            f.write(raw)
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    with open(header_temp_path, 'wb') as f:
+        f.write(MAGIC + json.dumps(header, separators=(',', ':')).encode('utf-8') + b'\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+    # Until the header follows, read_header finds it waiting at its temp
+    # path.
+    os.rename(temp_path, path)
+    os.rename(header_temp_path, header_path)
+
+
+def _encode_columns(raw, nicks):
+    times = array('I')
+    types = array('B')
+    nick_ids = array('I')
+
+    for line in TextIOWrapper(BytesIO(raw), errors='ignore'):
+        m = TIME_REGEX.match(line)
+        if m:
+            h, mi, s = map(int, m.groups())
+            times.append(h * 3600 + mi * 60 + s)
+        else:
+            times.append(NONE_ID)
+
+        m = LINE.match(line)
+        if m:
+            types.append(LINE_TYPES.index(TYPE_MAP[m.group('line_type')]))
+            nick_ids.append(nicks.setdefault(m.group('author'), len(nicks)))
+        else:
+            types.append(NONE_TYPE)
+            nick_ids.append(NONE_ID)
+
+    return OrderedDict(
+        (name, b64encode(column.tobytes()).decode('ascii'))
+        for name, column in zip(Columns._fields, (times, types, nick_ids))
+    )
+
+
+def _decode_array(typecode, encoded):
+    column = array(typecode)
+    column.frombytes(b64decode(encoded))
+    return column
@@ -0,0 +1,102 @@
+"""Pack closed months of logs into one file per channel; see pack.py.
+
+Run from cron, e.g. ``python packer.py --columns``.
+"""
+from collections import defaultdict
+from collections import OrderedDict
+from datetime import date
+from os.path import basename
+from os.path import dirname
+from os.path import join
+import argparse
+import gzip
+import os
+import re
+
+import archive
+import config
+import exceptions
+import log_path
+import pack
+from acl import PermissiveAccessControl
+from util import log
+
+MONTH_FORMAT = '%Y%m'
+DATE_SUFFIX_REGEX = re.compile(r'(?P<date>[\d-]{8,10})\.log(?:\.gz)?$')
+
+
+def read_raw(path):
+    if archive.is_compressed(path):
+        with gzip.open(path, 'rb') as f:
+            return f.read()
+
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def pack_path(path, month):
+    """Where the pack for the month of the log at ``path`` goes: next to it,
+    named like it, with the month in place of the date.
+    """
+    name = basename(path)
+    prefix = name[:DATE_SUFFIX_REGEX.search(name).start()]
+    return join(dirname(path), prefix + month + pack.SUFFIX)
+
+
+def pack_channel(paths, network, channel, columns):
+    this_month = date.today().strftime(MONTH_FORMAT)
+    by_month = defaultdict(list)
+
+    for logs in paths.channels_dates(network, [channel]):
+        for i in range(len(logs)):
+            if logs.packed[i]:
+                continue
+
+            month = logs.date_obj(i).strftime(MONTH_FORMAT)
+
+            if month >= this_month:
+                continue
+
+            by_month[month].append(logs.path(i))
+
+    for month, day_paths in sorted(by_month.items()):
+        target = pack_path(day_paths[0], month)
+
+        days = OrderedDict()
+
+        # Days that turned up late get merged into an existing pack.
+        if os.path.exists(target):
+            for packed_date in pack.dates(target):
+                days[packed_date] = pack.read_raw_day(target, packed_date)
+
+        for path in day_paths:
+            days[DATE_SUFFIX_REGEX.search(basename(path)).group('date')] = read_raw(path)
+
+        log("Packing {} days into {}".format(len(day_paths), target))
+        pack.write(target, channel, sorted(days.items()), columns=columns)
+
+        for path in day_paths:
+            os.unlink(path)
+            if archive.is_compressed(path) and os.path.exists(path + archive.INDEX_SUFFIX):
+                os.unlink(path + archive.INDEX_SUFFIX)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack closed months of logs.')
+    parser.add_argument('--columns', action='store_true', help='also store per-line time, type and nick columns')
+    args = parser.parse_args()
+
+    paths = getattr(log_path, config.LOG_PATH_CLASS)(PermissiveAccessControl())
+
+    for network in paths.networks():
+        try:
+            channels = paths.channels(network)
+        except exceptions.NoResultsException:
+            continue
+
+        for channel in channels:
+            pack_channel(paths, network, channel, args.columns)
+
+
+if __name__ == "__main__":
+    main()
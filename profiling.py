@@ -0,0 +1,121 @@
+"""Sampled request profiling.
+
+One in every PROFILE_SAMPLE_RATE requests, plus any request carrying a
+signed HEADER, is profiled by a thread that samples the request thread's
+stack every PROFILE_INTERVAL seconds. The samples are written as collapsed
+stacks (one "frame;frame;frame count" line per distinct stack, as
+flamegraph.pl, speedscope and friends read them) to a file in PROFILE_DIR,
+which keeps the newest PROFILE_KEEP of them.
+
+Run this module to print a header value to send.
+"""
+from collections import Counter
+from os.path import join
+import os
+import random
+import sys
+import threading
+import time
+
+from itsdangerous import BadSignature
+from itsdangerous import TimestampSigner
+
+import config
+import util
+from util import log
+
+HEADER = 'X-Moffle-Profile'
+SUFFIX = '.folded'
+
+# Seconds a header value stays good for.
+TOKEN_MAX_AGE = 24 * 60 * 60
+
+_signer = TimestampSigner(config.SECRET_KEY, salt='moffle-profile')
+
+
+def token():
+    return _signer.sign(str(os.getpid())).decode('ascii')
+
+
+def wanted(header):
+    """Whether to profile a request sent with ``header`` (or None)."""
+    if header:
+        try:
+            _signer.unsign(header, max_age=TOKEN_MAX_AGE)
+            return True
+        except BadSignature:
+            pass
+
+    return bool(config.PROFILE_SAMPLE_RATE) and random.randrange(config.PROFILE_SAMPLE_RATE) == 0
+
+
+def _collapse(frame):
+    stack = []
+
+    while frame is not None:
+        code = frame.f_code
+        stack.append('{} ({}:{})'.format(code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+
+    return ';'.join(reversed(stack))
+
+
+class Sampler:
+
+    def __init__(self, thread_id=None):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(config.PROFILE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+
+            if frame is None:
+                break
+
+            self.samples[_collapse(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def save(self, label):
+        """Write the samples out under ``label``, and drop the oldest files
+        past PROFILE_KEEP.
+        """
+        util.private_dir(config.PROFILE_DIR)
+
+        name = '{:.6f}-{}-{}{}'.format(time.time(), os.getpid(), label or 'unmatched', SUFFIX)
+        path = join(config.PROFILE_DIR, name)
+
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+        _rotate()
+
+        return path
+
+
+def _rotate():
+    # Names start with the time they were written, so they sort oldest first.
+    names = sorted(name for name in os.listdir(config.PROFILE_DIR) if name.endswith(SUFFIX))
+
+    for name in names[:-config.PROFILE_KEEP]:
+        path = join(config.PROFILE_DIR, name)
+
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            # Another worker got there first.
+            pass
+
+
+if __name__ == '__main__':
+    log("Send {}: {}".format(HEADER, token()))
@@ -0,0 +1,85 @@
+"""Compressed copies of responses that won't change: rendered past days and
+their raw logs.
+
+Each is compressed once per encoding and kept in an LRU bounded by size. Keys
+carry everything the body depends on, including the log's mtime and size, so
+a changed log simply misses; the same key makes the ETag. Keys are made
+without reading the log, so a hit, or a client that has the page already,
+costs no read at all.
+"""
+from hashlib import sha1
+import gzip
+import threading
+
+from flask import request
+from flask import Response
+import cachetools
+
+import concurrency
+import config
+from util import log
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# In order of preference.
+ENCODERS = [
+    ('gzip', lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL)),
+]
+
+if brotli is not None:
+    ENCODERS.insert(0, ('br', lambda body: brotli.compress(body, quality=BROTLI_QUALITY)))
+
+ENCODINGS = [encoding for encoding, _ in ENCODERS]
+
+_cache = cachetools.LRUCache(maxsize=config.RESPONSE_CACHE_SIZE, getsizeof=len)
+# LRUCache isn't safe to share between threads on its own.
+_lock = threading.Lock()
+
+
+def negotiate():
+    """The encoding to send the current request, or None for identity."""
+    if not config.RESPONSE_CACHE_SIZE:
+        return None
+
+    return request.accept_encodings.best_match(ENCODINGS)
+
+
+def respond(key, encoding, render, mimetype):
+    """A response of ``render()`` compressed with ``encoding``, which is only
+    called on a miss, and not at all if the client has it already.
+    """
+    etag = '{}-{}'.format(sha1(repr(key).encode('utf-8')).hexdigest(), encoding)
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+
+        return response
+
+    with _lock:
+        body = _cache.get((key, encoding))
+
+    if body is None:
+        # Two requests may both miss and compress; the cache ends up the same.
+        body = concurrency.blocking(dict(ENCODERS)[encoding], render().encode('utf-8'))
+
+        try:
+            with _lock:
+                _cache[(key, encoding)] = body
+        except ValueError:
+            # Bigger than the whole cache.
+            log("Not caching a {} byte response".format(len(body)))
+
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+
+    return response.make_conditional(request)
@@ -0,0 +1,93 @@
+"""The revision being served, as shown in the page footer.
+
+Worked out once per process, from a file stamped at deploy time if there is
+one and from git otherwise, instead of asking git on every render.
+"""
+from collections import namedtuple
+import os
+import subprocess
+import threading
+import time
+
+import config
+from util import log
+
+Revision = namedtuple('Revision', ['revision', 'dirty'])
+
+_current = None
+_refresher_pid = None
+_refresher_lock = threading.Lock()
+
+
+def current():
+    if _current is None:
+        refresh()
+
+    if config.REVISION_REFRESH_INTERVAL:
+        _ensure_refresher()
+
+    return _current
+
+
+def refresh():
+    global _current
+
+    if config.REVISION_FILE:
+        _current = _from_file(config.REVISION_FILE)
+    else:
+        _current = _from_git()
+
+
+def _from_file(path):
+    try:
+        with open(path) as f:
+            revision = f.readline().strip()
+    except OSError:
+        return Revision(None, False)
+
+    return Revision(revision or None, False)
+
+
+def _from_git():
+    p = subprocess.Popen(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE)
+    revision, __ = p.communicate()
+
+    dirty = False
+
+    if p.returncode != 0:
+        revision = None
+    else:
+        revision = revision.decode("utf-8").strip()[:8]
+        p = subprocess.Popen(["git", "status", "--porcelain"], stdout=subprocess.PIPE)
+        status, __ = p.communicate()
+        if p.returncode == 0:
+            if status.strip():
+                dirty = True
+
+    return Revision(revision, dirty)
+
+
+def _ensure_refresher():
+    global _refresher_pid
+
+    # Threads don't survive uwsgi forking its workers, so each process
+    # starts its own on first use.
+    pid = os.getpid()
+
+    if _refresher_pid == pid:
+        return
+
+    with _refresher_lock:
+        if _refresher_pid != pid:
+            threading.Thread(target=_refresh_forever, daemon=True).start()
+            _refresher_pid = pid
+
+
+def _refresh_forever():
+    while True:
+        time.sleep(config.REVISION_REFRESH_INTERVAL)
+
+        try:
+            refresh()
+        except Exception as e:
+            log("Can't refresh the revision: {!r}".format(e))
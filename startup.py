@@ -0,0 +1,33 @@
+"""Startup timing, to see where a cold start goes."""
+from contextlib import contextmanager
+import os
+import time
+
+from util import log
+
+# As near to process start as the first import gets us.
+STARTED = time.time()
+
+_phases = []
+
+
+def record(name, seconds):
+    _phases.append((name, seconds))
+
+
+@contextmanager
+def phase(name):
+    begin = time.time()
+    yield
+    record(name, time.time() - begin)
+
+
+def report():
+    log("Started in {:.3f}s: {}".format(
+        time.time() - STARTED,
+        ', '.join('{} {:.3f}s'.format(name, seconds) for name, seconds in _phases),
+    ))
+
+
+def forked():
+    log("Worker {} forked {:.3f}s after startup".format(os.getpid(), time.time() - STARTED))
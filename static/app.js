@@ -81,6 +81,7 @@ function AjaxSearch(network, channels, author, query, maxSegment) {
     this.container = $(".js-results-container");
     this.message = $(".js-loading-spinner");
     this.noResults = $(".no-results");
+    this.timedOut = $(".search-timed-out");
 
     this.setupAjax();
 }
@@ -114,7 +115,67 @@ AjaxSearch.prototype.setupAjax = function() {
             text: this.query,
             segment: this.segment
         }
-    }).done($.proxy(this.onSuccess, this));
+    }).done($.proxy(this.onSuccess, this)).fail($.proxy(this.onFailure, this));
+};
+
+AjaxSearch.prototype.onFailure = function(xhr) {
+    if (xhr.status == 429) {
+        /* Too many searches going on; get back in line. */
+        var retryAfter = parseInt(xhr.getResponseHeader("Retry-After"), 10) || 1;
+        window.setTimeout($.proxy(this.setupAjax, this), retryAfter * 1000);
+    } else {
+        /* Skip this segment, but say that we did. */
+        this.timedOut.removeClass("hidden");
+        this.onSuccess("");
+    }
+};
+
+/**
+ * Append lines to today's log as they're written, following along if
+ * scrolled to the bottom.
+ */
+function LiveTail(url, date) {
+    if (!window.EventSource) {
+        return;
+    }
+
+    this.log = $(".log-entry");
+
+    var last = this.log.find(".js-line-no-highlight").last().attr("id");
+    this.lineNo = last ? parseInt(last.substring(1), 10) : 0;
+
+    this.source = new EventSource(url + "?after=" + encodeURIComponent(date + ":" + this.lineNo));
+    this.source.onmessage = $.proxy(this.onLine, this);
+    this.source.addEventListener("closed", $.proxy(this.onClosed, this));
+}
+
+LiveTail.prototype.onLine = function(evt) {
+    var lineNo = parseInt(evt.lastEventId.split(":")[1], 10);
+
+    if (lineNo <= this.lineNo) {
+        return;
+    }
+
+    if (lineNo > this.lineNo + 1) {
+        /* Missed some while away; start over. */
+        this.source.close();
+        location.reload();
+        return;
+    }
+
+    var atBottom = $(window).scrollTop() + $(window).height() >= $(document).height() - 10;
+
+    this.log.append(evt.data);
+    this.lineNo = lineNo;
+
+    if (atBottom) {
+        $(window).scrollTop($(document).height());
+    }
+};
+
+LiveTail.prototype.onClosed = function(evt) {
+    /* The day is over; don't reconnect to tomorrow's. */
+    this.source.close();
 };
 
 /**
@@ -132,6 +193,131 @@ function MovementTooltip() {
     $('[data-toggle="tooltip"]').tooltip();
 }
 
+/**
+ * Levels 0 to 4 for counts: 0 for none, and otherwise which quarter of the
+ * non-zero counts they fall in.
+ */
+function activityLevels(counts) {
+    var sorted = counts.filter(function (count) { return count > 0; }).sort(function (a, b) { return a - b; });
+    var quartiles = [1, 2, 3].map(function (q) { return sorted[Math.floor(sorted.length * q / 4)]; });
+
+    return counts.map(function (count) {
+        if (count === 0) {
+            return 0;
+        }
+
+        var level = 1;
+        while (level < 4 && count >= quartiles[level - 1]) {
+            level++;
+        }
+        return level;
+    });
+}
+
+/**
+ * YYYYMMDD dates from ``since``, one a day.
+ */
+function activityDate(since, days) {
+    var d = new Date(Date.UTC(+since.substring(0, 4), +since.substring(4, 6) - 1, +since.substring(6, 8) + days));
+    return d.toISOString().substring(0, 10).replace(/-/g, "");
+}
+
+/**
+ * A calendar of how busy each day was, a column a week, from the
+ * channel's activity.
+ */
+function Heatmap() {
+    this.container = $(".js-heatmap");
+
+    if (this.container.length === 0) {
+        return;
+    }
+
+    $.getJSON(this.container.data("url"), $.proxy(this.render, this));
+}
+
+Heatmap.prototype.render = function (data) {
+    var channelUrl = this.container.data("channel-url");
+    var levels = activityLevels(data.counts);
+    var first = new Date(Date.UTC(+data.since.substring(0, 4), +data.since.substring(4, 6) - 1, +data.since.substring(6, 8)));
+    /* Weeks start on Monday. */
+    var offset = (first.getUTCDay() + 6) % 7;
+    var html = [];
+
+    for (var i = -offset; i < data.counts.length; i++) {
+        if ((i + offset) % 7 === 0) {
+            html.push(i === -offset ? '<div class="heatmap-week">' : '</div><div class="heatmap-week">');
+        }
+
+        if (i < 0) {
+            html.push('<span class="heatmap-day"></span>');
+            continue;
+        }
+
+        var date = activityDate(data.since, i);
+        var title = date + ": " + data.counts[i];
+
+        if (data.counts[i] > 0) {
+            html.push('<a class="heatmap-day heat-' + levels[i] + '" href="' + channelUrl + date + '" title="' + title + '"></a>');
+        } else {
+            html.push('<span class="heatmap-day heat-0" title="' + title + '"></span>');
+        }
+    }
+
+    html.push('</div>');
+    this.container.html(html.join(""));
+};
+
+/**
+ * A row of how busy each hour of the last week was for each channel that
+ * had any messages, busiest first.
+ */
+function Timeline() {
+    this.container = $(".js-timeline");
+
+    if (this.container.length === 0) {
+        return;
+    }
+
+    $.getJSON(this.container.data("url"), $.proxy(this.render, this));
+}
+
+Timeline.prototype.render = function (data) {
+    var networkUrl = this.container.data("network-url");
+    var rows = data.channels.map(function (row) {
+        return {channel: row.channel, counts: row.counts, total: row.counts.reduce(function (a, b) { return a + b; }, 0)};
+    }).filter(function (row) {
+        return row.total > 0;
+    }).sort(function (a, b) {
+        return b.total - a.total;
+    });
+
+    if (rows.length === 0) {
+        return;
+    }
+
+    /* On one scale, so that rows can be compared. */
+    var levels = activityLevels([].concat.apply([], rows.map(function (row) { return row.counts; })));
+    var html = [];
+
+    rows.forEach(function (row, r) {
+        var channelUrl = networkUrl + encodeURIComponent(row.channel) + "/";
+
+        html.push('<div class="timeline-row"><a class="timeline-channel" href="' + channelUrl + '" title="' + row.total + '">' + $("<span>").text(row.channel).html() + '</a>');
+
+        for (var i = 0; i < row.counts.length; i++) {
+            var date = activityDate(data.since, Math.floor(i / 24));
+            var title = date + " " + ("0" + i % 24).slice(-2) + ":00: " + row.counts[i];
+
+            html.push('<a class="timeline-hour heat-' + levels[r * row.counts.length + i] + '" href="' + channelUrl + date + '" title="' + title + '"></a>');
+        }
+
+        html.push('</div>');
+    });
+
+    this.container.html(html.join(""));
+};
+
 function PrivateMessages() {
     this.pm = $(".js-pm-hide").not("[data-filter-value^='#']");
     this.pmShow = $(".js-pm-action-show");
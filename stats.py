@@ -0,0 +1,391 @@
+"""Per-day statistics of channels: lines, bytes, messages in each hour,
+joins, parts, quits, and how many nicks turned up.
+
+A channel's closed days are kept together in one file under STATS_DIR,
+a line of JSON with a record per day. They're counted once, by tallier.py
+or the first look at the channel after they close, and never again. Days
+still being logged are kept in a small file of their own next to it,
+which is rewritten as they grow: with the nicks seen so far, and a size
+that says how far into the log it has got, so counting again only reads
+what has been appended since. Days in packs written with columns are
+counted from the columns, without their text.
+
+The messages in each hour make for range queries, of a channel or of all a
+network's channels, for heatmaps and timelines: a channel's closed days are
+indexed once per change to their file, as arrays in date order, so that
+filling in a range is a few slice copies per day logged.
+"""
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import date
+from io import BytesIO
+from io import TextIOWrapper
+from statistics import median
+from urllib.parse import quote
+import gzip
+import json
+import os
+import tempfile
+
+import fastcache
+
+import archive
+import concurrency
+import config
+import log_path
+import pack
+import util
+from log_line import LINE
+from log_line import TYPE_MAP
+
+SUFFIX = '.stats'
+OPEN_SUFFIX = '.open'
+TEMP_SUFFIX = '.tmp'
+
+HOURS = 24
+
+# size is in bytes of text, however the day is kept.
+DayStats = namedtuple('DayStats', ['lines', 'size', 'messages', 'joins', 'parts', 'quits', 'nicks', 'hours'])
+
+# Per line type: the DayStats field it counts towards.
+COUNTED = {'normal': 'messages', 'action': 'messages', 'join': 'joins', 'part': 'parts', 'quit': 'quits'}
+
+
+class Tally:
+    """Running counts of one day."""
+
+    def __init__(self, stats=None, nicks=()):
+        """Carries on from ``stats``, which saw ``nicks``."""
+        stats = stats or DayStats(0, 0, 0, 0, 0, 0, 0, (0,) * HOURS)
+
+        self.counts = stats._asdict()
+        self.hours = list(stats.hours)
+        self.nicks = set(nicks)
+
+    def add_text(self, raw):
+        """Count ``raw``, bytes of whole lines."""
+        self.counts['size'] += len(raw)
+
+        for line in TextIOWrapper(BytesIO(raw), errors='ignore'):
+            m = LINE.match(line)
+
+            if m:
+                self.add(int(m.group('time')[:2]), TYPE_MAP[m.group('line_type')], m.group('author'))
+            else:
+                self.counts['lines'] += 1
+
+    def add_columns(self, columns, nicks, size):
+        """Count a day from its pack columns and the pack's nick table."""
+        self.counts['size'] += size
+
+        for time, type_index, nick_id in zip(*columns):
+            if type_index == pack.NONE_TYPE:
+                self.counts['lines'] += 1
+            else:
+                self.add(time // 3600, pack.LINE_TYPES[type_index], nicks[nick_id])
+
+    def add(self, hour, line_type, nick):
+        field = COUNTED[line_type]
+
+        self.counts['lines'] += 1
+        self.counts[field] += 1
+        self.nicks.add(nick)
+
+        if field == 'messages':
+            self.hours[hour] += 1
+
+    def stats(self):
+        return DayStats(**dict(self.counts, nicks=len(self.nicks), hours=tuple(self.hours)))
+
+
+class DayIndex:
+    """Days in date order: their ordinals, their messages, and their
+    messages in each hour, HOURS to a day, end to end.
+    """
+
+    def __init__(self, days):
+        """Indexes ``days``, {display date: DayStats}."""
+        ordered = sorted(
+            (log_path.parse_date(day).toordinal(), stats)
+            for day, stats in days.items()
+        )
+
+        self.ordinals = array('I', (ordinal for ordinal, _ in ordered))
+        self.messages = array('I', (stats.messages for _, stats in ordered))
+        self.hours = array('I')
+
+        for _, stats in ordered:
+            self.hours.extend(stats.hours)
+
+
+class ChannelStats:
+    """The stats of a channel's days, by display date. ``final`` are those
+    that won't change; ``open_nicks`` are the nicks seen on the rest.
+    ``index`` is a DayIndex of the final days, if one's been made already.
+    """
+
+    def __init__(self, days=None, final=None, open_nicks=None, index=None):
+        self.days = days or {}
+        self.final = final or set()
+        self.open_nicks = open_nicks or {}
+        self.index = index
+        self._flags = None
+
+    def activity(self, begin, end, hourly=False):
+        """Messages on each day from date ``begin`` to ``end`` inclusive, or
+        in each hour of them, as an array; days not logged count 0.
+        """
+        width = HOURS if hourly else 1
+        first, last = begin.toordinal(), end.toordinal()
+        counts = array('I', [0]) * (width * max(0, last - first + 1))
+
+        if self.index is None:
+            self.index = DayIndex({day: self.days[day] for day in self.final})
+
+        ordinals = self.index.ordinals
+        values = self.index.hours if hourly else self.index.messages
+
+        for i in range(bisect_left(ordinals, first), bisect_right(ordinals, last)):
+            at = (ordinals[i] - first) * width
+            counts[at:at + width] = values[i * width:(i + 1) * width]
+
+        # The open days are only ever a few.
+        for day in self.open_nicks:
+            ordinal = log_path.parse_date(day).toordinal()
+
+            if first <= ordinal <= last and day in self.days:
+                stats = self.days[day]
+                at = (ordinal - first) * width
+                counts[at:at + width] = array('I', stats.hours if hourly else (stats.messages,))
+
+        return counts
+
+    def flag(self, day):
+        """'quiet' for a day with no messages, 'busy' for one with
+        STATS_BUSY_FACTOR times as many as a usual day, and otherwise None.
+        """
+        if self._flags is None:
+            self._flags = self._flag_days()
+
+        return self._flags.get(day)
+
+    def _flag_days(self):
+        messages = [stats.messages for stats in self.days.values() if stats.messages]
+        busy = median(messages) * config.STATS_BUSY_FACTOR if messages else 0
+
+        flags = {}
+
+        for day, stats in self.days.items():
+            if not stats.messages:
+                flags[day] = 'quiet'
+            elif stats.messages >= busy:
+                flags[day] = 'busy'
+
+        return flags
+
+    def to_json(self, final):
+        """The final days, or the open ones with their nicks."""
+        days = {
+            day: list(stats[:-1]) + [list(stats.hours)]
+            for day, stats in self.days.items()
+            if (day in self.final) == final
+        }
+
+        if final:
+            return {'days': days}
+
+        return {'days': days, 'nicks': {day: sorted(nicks) for day, nicks in self.open_nicks.items()}}
+
+    @classmethod
+    def from_json(cls, final, open_, index=None):
+        """From the final and open days as _read gives them."""
+        # A day may be in both, if a save of the open days fell through.
+        days = dict(open_['days'])
+        days.update(final['days'])
+
+        open_nicks = {
+            day: set(nicks)
+            for day, nicks in open_.get('nicks', {}).items()
+            if day not in final['days']
+        }
+
+        return cls(days, set(final['days']), open_nicks, index)
+
+
+def store_path(network, channel, suffix=SUFFIX):
+    return os.path.join(config.STATS_DIR, quote(network, safe=''), quote(channel, safe='') + suffix)
+
+
+def load(network, channel):
+    """The ChannelStats kept for a channel; treat it as read-only."""
+    return _load(*(
+        _stamp(store_path(network, channel, suffix))
+        for suffix in (SUFFIX, OPEN_SUFFIX)
+    ))
+
+
+def _stamp(path):
+    try:
+        return path, os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return path, None
+
+
+@fastcache.clru_cache(maxsize=256)
+def _load(final, open_):
+    return ChannelStats.from_json(_read(*final), _read(*open_), _index(*final))
+
+
+# Each file is read once per change, so that a growing open day doesn't
+# mean reading all the final ones again.
+@fastcache.clru_cache(maxsize=512)
+def _read(path, mtime_ns):
+    """A file's JSON, with its days as DayStats; treat it as read-only."""
+    if mtime_ns is None:
+        return {'days': {}}
+
+    with open(path, 'rb') as f:
+        raw = json.loads(f.read().decode('utf-8'))
+
+    raw['days'] = {
+        day: DayStats(*counts[:-1], tuple(counts[-1]))
+        for day, counts in raw['days'].items()
+    }
+
+    return raw
+
+
+# Once per change to the final days, however often the open ones change.
+@fastcache.clru_cache(maxsize=256)
+def _index(path, mtime_ns):
+    return DayIndex(_read(path, mtime_ns)['days'])
+
+
+def save(network, channel, channel_stats, final):
+    """Write out the final days, or the open ones."""
+    path = store_path(network, channel, SUFFIX if final else OPEN_SUFFIX)
+    util.private_dir(config.STATS_DIR)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Other workers may be saving the same channel; the last one wins.
+    fd, temp_path = tempfile.mkstemp(suffix=TEMP_SUFFIX, dir=os.path.dirname(path))
+
+    with os.fdopen(fd, 'wb') as f:
+        f.write(json.dumps(channel_stats.to_json(final), separators=(',', ':')).encode('utf-8'))
+
+    os.rename(temp_path, path)
+
+
+def update(logs, network, backfill=True):
+    """Count whatever of ChannelLogs ``logs`` hasn't been counted, save it,
+    and return the channel's ChannelStats. Without ``backfill`` only days
+    that are still open, or were last time, are counted: those are quick.
+    """
+    old = load(network, logs.channel)
+    new = ChannelStats(dict(old.days), set(old.final), dict(old.open_nicks), old.index)
+    today = date.today()
+    # Which of the files need writing: final days, open days.
+    changed = set()
+
+    if backfill:
+        todo = range(len(logs))
+    else:
+        todo = {logs.index(day) for day in old.open_nicks} - {None}
+
+        # Days that have started since, newest last.
+        i = len(logs) - 1
+        while i >= 0 and logs.date_obj(i) >= today:
+            todo.add(i)
+            i -= 1
+
+        todo = sorted(todo)
+
+    for i in todo:
+        day = logs.dates[i]
+
+        if day in old.final:
+            continue
+
+        closed = logs.date_obj(i) < today
+
+        counted = concurrency.blocking(_count, logs, i, old.days.get(day), old.open_nicks.get(day, ()), closed)
+
+        if counted is not None:
+            new.days[day] = counted.stats()
+            new.open_nicks[day] = counted.nicks
+            changed.add(False)
+
+        if closed:
+            new.final.add(day)
+            new.open_nicks.pop(day, None)
+            changed.update((True, False))
+
+    if not changed:
+        return old
+
+    for final in changed:
+        save(network, logs.channel, new, final)
+
+    # Made again for the new final days when it's next wanted.
+    if True in changed:
+        new.index = None
+
+    return new
+
+
+def _count(logs, i, previous, nicks, closed):
+    """A Tally of the ``i``th day of ``logs``, carrying on from its
+    ``previous`` stats and ``nicks`` where it can, or None if nothing has
+    changed since. Until the day is ``closed``, its last line may still be
+    being written.
+    """
+    path = logs.path(i)
+
+    if logs.packed[i]:
+        day = pack.read_header(path).days[logs.packed[i]]
+        tally = Tally()
+
+        columns = pack.read_columns(path, logs.packed[i])
+        if columns is not None:
+            tally.add_columns(*columns, size=day.length)
+        else:
+            tally.add_text(pack.read_raw_day(path, logs.packed[i]))
+
+        return tally
+
+    if archive.is_compressed(path):
+        tally = Tally()
+
+        with gzip.open(path, 'rb') as f:
+            tally.add_text(f.read())
+
+        return tally
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+
+        if previous is not None and previous.size == size:
+            return None
+
+        # Only ever appended to, unless it's been replaced.
+        if previous is not None and previous.size < size:
+            tally = Tally(previous, nicks)
+            f.seek(previous.size)
+        else:
+            tally = Tally()
+
+        raw = f.read()
+
+    # A line that's still being written is counted next time. Once the
+    # day is over, it's as whole as it will get, as gzip and packs have it.
+    end = len(raw) if closed else raw.rfind(b'\n') + 1
+
+    # Nothing whole yet.
+    if not end and previous is not None and previous.size < size:
+        return None
+
+    tally.add_text(raw[:end])
+
+    return tally
@@ -0,0 +1,219 @@
+"""Today's log as it's written, for /<network>/<channel>/today/stream.
+
+Everyone watching the same file shares one Follower, whose thread reads
+each appended line and renders it once, as log.html would, keeping the
+last TAIL_LINES for watchers to pick up. With the inotify_simple package
+installed, the thread wakes when the file is written to; otherwise, and
+under gevent, where waiting on inotify would hold up every request, it
+checks the file's size every TAIL_POLL_INTERVAL seconds.
+
+Watchers get server-sent events with ids of "date:line number", so that a
+reconnecting EventSource carries on where it left off.
+"""
+from collections import deque
+from datetime import date
+from io import BytesIO
+from io import TextIOWrapper
+import os
+import threading
+import time
+
+import concurrency
+import config
+import line_format
+import log_path
+
+try:
+    from inotify_simple import flags
+    from inotify_simple import INotify
+except ImportError:
+    INotify = None
+
+# Watchers of each path, and the lock for taking them on and letting them go.
+_followers = {}
+_lock = threading.Lock()
+
+
+class Follower:
+
+    def __init__(self, path, day):
+        """Follows ``path``, the log of ``day`` (a display date)."""
+        self.path = path
+        self.day = day
+        # (line_no, html), oldest first.
+        self.lines = deque(maxlen=config.TAIL_LINES)
+        self.line_no = 0
+        self.offset = 0
+        self.started = False
+        self.closed = False
+        self.watchers = 0
+        self.changed = threading.Condition()
+
+    def start(self):
+        threading.Thread(target=self._run, name='tail {}'.format(self.path), daemon=True).start()
+
+    def _run(self):
+        inotify = None
+
+        if INotify is not None and not concurrency.cooperative():
+            inotify = INotify()
+            inotify.add_watch(self.path, flags.MODIFY | flags.MOVE_SELF | flags.DELETE_SELF)
+
+        try:
+            self._update()
+
+            with self.changed:
+                self.started = True
+                self.changed.notify_all()
+
+            while not self.closed and self.watchers:
+                if inotify is not None:
+                    inotify.read(timeout=int(config.TAIL_POLL_INTERVAL * 1000))
+                else:
+                    time.sleep(config.TAIL_POLL_INTERVAL)
+
+                # ZNC moves on to the next day's file at midnight.
+                if not self._update() and log_path.parse_date(self.day) < date.today():
+                    self.closed = True
+        except OSError:
+            self.closed = True
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+            with _lock:
+                if _followers.get(self.path) is self:
+                    del _followers[self.path]
+
+            with self.changed:
+                self.closed = True
+                self.changed.notify_all()
+
+    def _update(self):
+        """Take in whatever has been appended. Returns whether there was
+        anything.
+        """
+        new = concurrency.blocking(self._read_new)
+
+        if not new:
+            return False
+
+        # The first time round, that's the whole file so far.
+        skip = max(0, len(new) - config.TAIL_LINES)
+        first = self.line_no + 1 + skip
+
+        rendered = [
+            (line_no, render(line, line_no))
+            for line_no, line in enumerate(new[skip:], start=first)
+        ]
+
+        with self.changed:
+            self.line_no += len(new)
+            self.lines.extend(rendered)
+            self.changed.notify_all()
+
+        return True
+
+    def _read_new(self):
+        """The whole lines after ``offset``, decoded as open() would."""
+        try:
+            with open(self.path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+
+                if size == self.offset:
+                    return []
+
+                # Truncated or replaced: line numbers mean nothing anymore.
+                if size < self.offset:
+                    self.closed = True
+                    return []
+
+                f.seek(self.offset)
+                raw = f.read(size - self.offset)
+        except FileNotFoundError:
+            # Compressed or packed away, so the day is over.
+            self.closed = True
+            return []
+
+        # Leave a line that's still being written for next time.
+        end = raw.rfind(b'\n') + 1
+        self.offset += end
+
+        return TextIOWrapper(BytesIO(raw[:end]), errors='ignore').readlines()
+
+    def events(self, after=None):
+        """Server-sent events of the lines after line ``after``, or the
+        last TAIL_LINES if None, then of each line as it comes. A comment
+        every TAIL_KEEPALIVE seconds keeps proxies from hanging up.
+        """
+        with self.changed:
+            self.changed.wait_for(lambda: self.started or self.closed)
+
+            if after is None:
+                after = self.lines[0][0] - 1 if self.lines else self.line_no
+            else:
+                after = min(after, self.line_no)
+
+        while True:
+            with self.changed:
+                self.changed.wait_for(lambda: self.line_no > after or self.closed, config.TAIL_KEEPALIVE)
+                new = [(line_no, html) for line_no, html in self.lines if line_no > after]
+                closed = self.closed
+
+            if new:
+                after = new[-1][0]
+                yield ''.join(self._event(line_no, html) for line_no, html in new)
+            elif closed:
+                yield 'event: closed\ndata: {}\n\n'.format(self.day)
+                return
+            else:
+                yield ': keepalive\n\n'
+
+    def _event(self, line_no, html):
+        data = ''.join('data: {}\n'.format(part) for part in html.split('\n'))
+        return 'id: {}:{}\n{}\n'.format(self.day, line_no, data)
+
+
+def render(line, line_no):
+    """A line, as log.html renders it."""
+    return '<span>{}</span><br>'.format(line_format.line_style(
+        line_format.irc_format(line_format.clinkify(line)),
+        line_no,
+        is_search=False,
+    ))
+
+
+def stream(path, day, last_event_id=None):
+    """Server-sent events following ``path``, the log of ``day``, from just
+    after ``last_event_id`` if that was from the same day.
+    """
+    after = None
+
+    if last_event_id:
+        event_day, _, line_no = last_event_id.partition(':')
+
+        if event_day == day and line_no.isdigit():
+            after = int(line_no)
+
+    with _lock:
+        follower = _followers.get(path)
+        running = follower is not None and not follower.closed
+
+        if not running:
+            follower = _followers[path] = Follower(path, day)
+
+        follower.watchers += 1
+
+        # Once it has a watcher, or it would stop straight away.
+        if not running:
+            follower.start()
+
+    try:
+        yield from follower.events(after)
+    finally:
+        with _lock:
+            follower.watchers -= 1
+
+            # Its thread sees this and stops; anyone new starts afresh.
+            if not follower.watchers and _followers.get(path) is follower:
+                del _followers[path]
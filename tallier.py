@@ -0,0 +1,38 @@
+"""Count every channel's days into the stats store; see stats.py.
+
+Run from cron, e.g. ``python tallier.py``. The first run counts every
+closed day, which takes a while; after that, each run only counts the
+days that are still open and those that have closed since.
+"""
+import argparse
+
+import config
+import exceptions
+import log_path
+import stats
+from acl import PermissiveAccessControl
+from util import log
+
+
+def tally_all(paths):
+    for network in paths.networks():
+        try:
+            channels = paths.channels(network)
+        except exceptions.NoResultsException:
+            continue
+
+        for channel in channels:
+            for logs in paths.channels_dates(network, [channel]):
+                log("Counting {}/{}".format(network, channel))
+                stats.update(logs, network)
+
+
+def main():
+    argparse.ArgumentParser(description='Count every channel\'s days into the stats store.').parse_args()
+
+    paths = getattr(log_path, config.LOG_PATH_CLASS)(PermissiveAccessControl())
+    tally_all(paths)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,3 @@
-import subprocess
 from urllib.parse import quote
 
 from flask import request
@@ -6,6 +5,8 @@ from flask import session
 from flask_babel import gettext as _
 
 import config
+import line_format
+import revision
 import util
 
 
@@ -13,7 +14,6 @@ import util
 def get_encoded_path():
     """Get the URL-encoded path part of the input ``url``."""
     def inner(url):
-        print(url)
         # '#' is an especially problematic character, since we want
         # the unquoted string to be '%23', not '#'
         path = url.split('/', 3)[-1].replace('#', '%23')
@@ -27,6 +27,11 @@ def inject_encoded_url():
     return dict(encoded_path=path)
 
 
+@util.delay_context_processor
+def inject_log_url():
+    return dict(log_url=line_format.log_url)
+
+
 @util.delay_context_processor
 def inject_session_user():
     return dict(session_user=session.get('user'))
@@ -55,19 +60,6 @@ def inject_site_brand():
 
 @util.delay_context_processor
 def inject_git_status():
-    p = subprocess.Popen(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE)
-    revision, __ = p.communicate()
-
-    dirty = False
-
-    if p.returncode != 0:
-        revision = None
-    else:
-        revision = revision.decode("utf-8").strip()[:8]
-        p = subprocess.Popen(["git", "status", "--porcelain"], stdout=subprocess.PIPE)
-        status, __ = p.communicate()
-        if p.returncode == 0:
-            if status.strip():
-                dirty = True
-
-    return dict(git_status="{}{}".format(revision, _(" (dirty)") if dirty else ""))
+    current = revision.current()
+
+    return dict(git_status="{}{}".format(current.revision, _(" (dirty)") if current.dirty else ""))
@@ -1,7 +1,10 @@
 from collections import OrderedDict
+import random
+
 import pytest
 
 from acl import AccessControl
+from acl import value_multi
 
 TEST_INTEGRATION_INPUTS = OrderedDict((
     (
@@ -255,3 +258,104 @@ TEST_INTEGRATION_INPUTS = OrderedDict((
 def test_integration(rules, email, network, channel, expected):
     ac = AccessControl(rules)
     assert ac._evaluate(email, network, channel) == expected
+
+
+QUERY_USERS = ('test@example.com', 'test2@example.com', 'stranger@example.com', '')
+QUERY_NETWORKS = ('net', 'net2', 'net3', 'othernet', 'PRIVATE_MESSAGE')
+QUERY_CHANNELS = (None, '#channel', '#channel2', '&channel', '#other', 'notachannel', 'PRIVATE_MESSAGE')
+
+
+def _verdict(evaluate, email, network, channel):
+    try:
+        return evaluate(email, network, channel)
+    except AssertionError:
+        # No rule applies at all.
+        return None
+
+
+def _assert_same_verdicts(ac):
+    for email in QUERY_USERS:
+        for network in QUERY_NETWORKS:
+            verdicts = {}
+
+            for channel in QUERY_CHANNELS:
+                verdicts[channel] = _verdict(ac._walk, email, network, channel)
+                assert _verdict(ac._evaluate, email, network, channel) == verdicts[channel], (email, network, channel)
+
+            if None not in verdicts.values():
+                channels = QUERY_CHANNELS[1:]
+                assert ac._filter(email, network, channels) == [
+                    channel for channel in channels if verdicts[channel]
+                ], (email, network)
+
+        network_verdicts = [_verdict(ac._walk, email, network, None) for network in QUERY_NETWORKS]
+        if None not in network_verdicts:
+            assert ac._table(email).filter_networks(QUERY_NETWORKS) == [
+                network for network, verdict in zip(QUERY_NETWORKS, network_verdicts) if verdict
+            ], email
+
+
+@pytest.mark.parametrize(
+    "rules",
+    [rules for rules, *_ in TEST_INTEGRATION_INPUTS.values()],
+    ids=list(TEST_INTEGRATION_INPUTS.keys()),
+)
+def test_compiled_matches_tree(rules):
+    _assert_same_verdicts(AccessControl(rules))
+
+
+def _random_value(rng, pool):
+    if rng.random() < 0.25:
+        return rng.sample(pool, 2)
+    return rng.choice(pool)
+
+
+def _random_rules(rng):
+    users = ('*', 'test@example.com', 'test2@example.com')
+    networks = ('net', 'net2', 'net3')
+    channels = ('#channel', '#channel2', '&channel', 'notachannel', 'PRIVATE_MESSAGE')
+
+    rules = []
+    if rng.random() < 0.8:
+        rules.append(('deny', '*', ('*', '*'), ('root', 'root')))
+
+    network_values = []
+
+    for _ in range(rng.randint(1, 8)):
+        verdict = rng.choice(('allow', 'deny'))
+        user = rng.choice(users) if rng.random() < 0.75 else rng.sample(users[1:], 2)
+        kind = rng.random()
+
+        if kind < 0.3:
+            value = _random_value(rng, networks)
+            network_values.extend(value_multi(value))
+            rules.append((verdict, user, ('network', value), ('root', 'root')))
+        elif kind < 0.6 and network_values:
+            parent = rng.choice(network_values) if rng.random() < 0.75 else rng.sample(network_values, 1)
+            rules.append((verdict, user, ('channel', _random_value(rng, channels)), ('network', parent)))
+        elif kind < 0.7:
+            # Straight off the root; PRIVATE_MESSAGE here trips up network decisions.
+            rules.append((verdict, user, ('channel', _random_value(rng, channels[:4])), ('root', 'root')))
+        else:
+            scope = rng.choice(('*', 'network', 'channel'))
+            value = rng.choice(('*',) + networks + channels)
+            parent = rng.choice((('root', 'root'), ('network', '*'), ('*', '*'), ('network', rng.choice(networks))))
+            if (scope, value, parent) == ('channel', 'PRIVATE_MESSAGE', ('root', 'root')):
+                scope = '*'
+            rules.append((verdict, user, (scope, value), parent))
+
+    return rules
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_compiled_matches_tree_random(seed):
+    rng = random.Random(seed)
+
+    rules = _random_rules(rng)
+    try:
+        ac = AccessControl(rules)
+    except RuntimeError:
+        # Unresolvable parent; nothing to compare.
+        return
+
+    _assert_same_verdicts(ac)
@@ -0,0 +1,158 @@
+import json
+
+import pytest
+
+import api
+import app
+import config
+import grep
+import log_path
+from acl import PermissiveAccessControl
+
+NETWORK = 'net'
+CHANNEL = '#chan'
+DATES = ['20160101', '20160102', '20160103', '20160104', '20160105']
+LINES = 12
+
+LOGS = api.PREFIX + '/networks/net/channels/%23chan/logs/'
+SEARCH = api.PREFIX + '/networks/net/channels/%23chan/search'
+
+
+def text(i):
+    if i % 3 == 0:
+        return '[10:{:02d}:00] <alice> hello {}\n'.format(i, i)
+
+    return '[10:{:02d}:00] <bob> chat {}\n'.format(i, i)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LOG_BASE', str(tmp_path / 'logs'))
+    monkeypatch.setattr(config, 'SEARCH_LOCK_DIR', str(tmp_path / 'search'))
+    monkeypatch.setattr(config, 'SEARCH_CONTEXT', 0)
+    monkeypatch.setattr(config, 'API_LINES_PAGE_SIZE', 5)
+    monkeypatch.setattr(config, 'API_SEARCH_PAGE_SIZE', 3)
+    monkeypatch.setattr(config, 'API_SEARCH_PAGE_DAYS', 2)
+
+    base = tmp_path / 'logs' / NETWORK / log_path.LOG_INTERMEDIATE_BASE
+    base.mkdir(parents=True)
+
+    for day in DATES:
+        with open(str(base / 'default_{}_{}.log'.format(CHANNEL, day)), 'w') as f:
+            f.write(''.join(text(i) for i in range(LINES)))
+
+    paths = log_path.LogPath(PermissiveAccessControl())
+    builder = grep.GrepBuilder(paths)
+
+    # As create() would set them.
+    monkeypatch.setattr(app, 'paths', paths, raising=False)
+    monkeypatch.setattr(app, 'grep', builder)
+
+    yield app.app.test_client()
+
+    if builder._pool is not None:
+        builder._pool.terminate()
+
+
+def get(client, url):
+    response = client.get(url)
+    return response.status_code, json.loads(response.get_data(as_text=True))
+
+
+def line_nos(data):
+    return [line['line_no'] for line in data['lines']]
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ('line=4', [4]),
+        ('line=4&before=1&after=2', [3, 4, 5, 6]),
+        ('line=1&before=3', [1]),
+        ('line=12&after=3', [12]),
+        ('from=10:03&until=10:04', [4, 5]),
+        ('from=10:03&until=10:04&before=1&after=1', [3, 4, 5, 6]),
+        ('from=10:10', [11, 12]),
+        ('until=10:01', [1, 2]),
+        ('from=11:00', []),
+    ],
+)
+def test_log_window(client, query, expected):
+    status, data = get(client, LOGS + '20160103?' + query)
+
+    assert status == 200
+    assert line_nos(data) == expected
+    assert data['cursor'] is None
+    assert [line['line'] for line in data['lines']] == [text(line_no - 1).rstrip('\n') for line_no in expected]
+
+
+@pytest.mark.parametrize(
+    "query, pages",
+    [
+        ('', [[1, 2, 3, 4, 5], [6, 7, 8, 9, 10], [11, 12]]),
+        ('line=2&after=6', [[2, 3, 4, 5, 6], [7, 8]]),
+        ('from=10:01&until=10:08', [[2, 3, 4, 5, 6], [7, 8, 9]]),
+    ],
+)
+def test_log_pages(client, query, pages):
+    url = LOGS + '20160103?' + query
+    seen = []
+
+    while url:
+        status, data = get(client, url)
+        assert status == 200
+
+        seen.append(line_nos(data))
+        url = data['cursor'] and LOGS + '20160103?cursor=' + data['cursor']
+
+    assert seen == pages
+
+
+@pytest.mark.parametrize("query", ['line=0', 'line=-1', 'line=x', 'before=-1', 'from=10', 'cursor=zz!'])
+def test_log_bad_request(client, query):
+    status, _ = get(client, LOGS + '20160103?' + query)
+
+    assert status == 400
+
+
+def search_pages(client, query):
+    url = SEARCH + '?' + query
+    pages = []
+
+    while url:
+        status, data = get(client, url)
+        assert status == 200
+
+        pages.append([(hit['date'], hit['begin']) for hit in data['hits']])
+        url = data['cursor'] and SEARCH + '?' + query + '&cursor=' + data['cursor']
+
+    return pages
+
+
+def test_search_pages(client):
+    pages = search_pages(client, 'q=hello')
+    hits = [hit for page in pages for hit in page]
+
+    # Every hit once, newest first, a page at a time.
+    assert hits == [(day, begin) for day in reversed(DATES) for begin in (10, 7, 4, 1)]
+    assert all(len(page) <= config.API_SEARCH_PAGE_SIZE for page in pages)
+    assert len(pages) > len(hits) // config.API_SEARCH_PAGE_SIZE
+
+
+def test_search_pages_within_dates(client):
+    pages = search_pages(client, 'q=hello&since=20160102&until=20160103&author=alice')
+
+    assert [hit for page in pages for hit in page] == [
+        (day, begin) for day in ('20160103', '20160102') for begin in (10, 7, 4, 1)
+    ]
+
+
+def test_search_nothing_found(client):
+    assert search_pages(client, 'q=nowhere') == [[], [], []]
+
+
+@pytest.mark.parametrize("query", ['', 'q=hello&since=2016', 'q=hello&cursor=zz!'])
+def test_search_bad_request(client, query):
+    status, _ = get(client, SEARCH + '?' + query)
+
+    assert status == 400
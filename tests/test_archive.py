@@ -0,0 +1,145 @@
+from datetime import date
+from datetime import timedelta
+import gzip
+import os
+
+import pytest
+
+import archive
+import archiver
+import config
+import log_path
+from acl import PermissiveAccessControl
+
+BLOCK_LINES = 4
+
+
+def make_log(tmp_path, lines, trailing_newline=True, name='default_#chan_20160101.log'):
+    path = str(tmp_path / name)
+    text = ''.join('[00:00:{:02d}] <nick> line {}\n'.format(i % 60, i) for i in range(lines))
+
+    if not trailing_newline:
+        text = text[:-1]
+
+    with open(path, 'w') as f:
+        f.write(text)
+
+    return path, text.splitlines(True)
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(archive, 'BLOCK_LINES', BLOCK_LINES)
+
+
+def test_compress_writes_block_index(tmp_path, small_blocks):
+    path, lines = make_log(tmp_path, 10)
+    compressed_path = archive.compress(path)
+
+    assert not os.path.exists(path)
+    assert not os.path.exists(compressed_path + archive.TEMP_SUFFIX)
+    assert not os.path.exists(compressed_path + archive.INDEX_SUFFIX + archive.TEMP_SUFFIX)
+
+    offsets, first_lines = archive.read_index(compressed_path)
+
+    assert list(first_lines) == [0, 4, 8]
+    assert offsets[0] == 0
+
+    # Still one gzip file, as zcat sees it.
+    with gzip.open(compressed_path, 'rt') as f:
+        assert f.readlines() == lines
+
+
+@pytest.mark.parametrize("trailing_newline", [True, False])
+@pytest.mark.parametrize(
+    "start, stop",
+    [
+        (0, None),
+        (0, 2),
+        (0, 4),
+        (1, 3),
+        (3, 5),
+        (4, 8),
+        (5, 7),
+        (2, 9),
+        (8, 10),
+        (9, None),
+        (7, None),
+        (10, None),
+        (3, 3),
+        (0, 100),
+    ],
+)
+def test_read_lines_windows(tmp_path, small_blocks, trailing_newline, start, stop):
+    path, lines = make_log(tmp_path, 10, trailing_newline)
+    plain = archive.read_lines(path, start, stop)
+    compressed_path = archive.compress(path)
+
+    assert plain == lines[start:stop]
+    assert archive.read_lines(compressed_path, start, stop) == lines[start:stop]
+
+
+def test_read_lines_without_index(tmp_path, small_blocks):
+    path, lines = make_log(tmp_path, 10)
+    compressed_path = archive.compress(path)
+    os.unlink(compressed_path + archive.INDEX_SUFFIX)
+
+    assert archive.read_index(compressed_path) is None
+    assert archive.read_lines(compressed_path, 5, 7) == lines[5:7]
+
+
+def test_torn_index_is_ignored(tmp_path, small_blocks):
+    path, lines = make_log(tmp_path, 10)
+    compressed_path = archive.compress(path)
+    index_path = compressed_path + archive.INDEX_SUFFIX
+
+    with open(index_path, 'rb') as f:
+        raw = f.read()
+    with open(index_path, 'wb') as f:
+        f.write(raw[:-3])
+
+    assert archive.read_index(compressed_path) is None
+    assert archive.read_lines(compressed_path, 5, 7) == lines[5:7]
+
+
+def test_listing_prefers_compressed_day(tmp_path):
+    """A crash between the rename and the unlink leaves both files."""
+    network_path = tmp_path / 'net' / 'moddata' / 'log'
+    network_path.mkdir(parents=True)
+
+    path, _ = make_log(network_path, 3)
+    make_log(network_path, 3, name='default_#chan_20160102.log')
+
+    with open(path, 'rb') as src, gzip.open(path + archive.COMPRESSED_SUFFIX, 'wb') as dst:
+        dst.write(src.read())
+
+    logs = log_path.LogPath(None)._list_catalog(str(network_path))['#chan']
+
+    assert logs.dates == ['20160101', '20160102']
+    assert logs.filenames == ['default_#chan_20160101.log.gz', 'default_#chan_20160102.log']
+
+
+@pytest.mark.parametrize(
+    "older_than, compressed",
+    [
+        (30, [31, 30]),
+        (1, [31, 30, 29, 1]),
+        # Never the open day.
+        (0, [31, 30, 29, 1]),
+    ],
+)
+def test_compress_older_than(tmp_path, monkeypatch, older_than, compressed):
+    monkeypatch.setattr(config, 'LOG_BASE', str(tmp_path))
+    network_path = tmp_path / 'net' / log_path.LOG_INTERMEDIATE_BASE
+    network_path.mkdir(parents=True)
+
+    ages = [31, 30, 29, 1, 0]
+    paths = {}
+
+    for age in ages:
+        name = 'default_#chan_{:%Y%m%d}.log'.format(date.today() - timedelta(days=age))
+        paths[age], _ = make_log(network_path, 3, name=name)
+
+    archiver.compress_older_than(log_path.LogPath(PermissiveAccessControl()), older_than)
+
+    assert [age for age in ages if os.path.exists(paths[age] + archive.COMPRESSED_SUFFIX)] == compressed
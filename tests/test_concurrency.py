@@ -0,0 +1,128 @@
+"""Many requests at once should see what one request at a time does."""
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import threading
+
+import cachetools
+from flask import Flask
+import pytest
+
+import concurrency
+import config
+import grep
+import log_path
+import response_cache
+from acl import PermissiveAccessControl
+
+THREADS = 8
+
+NETWORK = 'net'
+CHANNELS = ['#moffle', '#other']
+NICKS = ['alice', 'bob', 'carol']
+WORDS = ['hello', 'world', 'moffle', 'grep', 'thread']
+
+
+def in_threads(f, calls):
+    """f(*args) for each of ``calls``, spread over THREADS threads, in order."""
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        return list(executor.map(lambda args: f(*args), calls))
+
+
+def test_blocking_calls_through():
+    assert not concurrency.cooperative()
+
+    def work(i, offset=0):
+        return i + offset, threading.get_ident()
+
+    results = in_threads(
+        lambda i: (concurrency.blocking(work, i, offset=1), threading.get_ident()),
+        [(i,) for i in range(100)],
+    )
+
+    # Run there and then, on the caller's thread.
+    for i, ((value, ident), caller) in enumerate(results):
+        assert value == i + 1
+        assert ident == caller
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LOG_BASE', str(tmp_path))
+    base = tmp_path / NETWORK / log_path.LOG_INTERMEDIATE_BASE
+    base.mkdir(parents=True)
+
+    for c, channel in enumerate(CHANNELS):
+        for day in range(1, 29):
+            with open(str(base / 'default_{}_201602{:02d}.log'.format(channel, day)), 'w') as f:
+                for i in range(50):
+                    f.write('[10:{:02d}:00] <{}> {} {}\n'.format(
+                        i, NICKS[(c + day + i) % len(NICKS)], WORDS[(day * i) % len(WORDS)], i,
+                    ))
+
+    return log_path.LogPath(PermissiveAccessControl())
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    """Every search pool started."""
+    started = []
+    Pool = grep.Pool
+
+    def pool(*args, **kwargs):
+        started.append(Pool(*args, **kwargs))
+        return started[-1]
+
+    monkeypatch.setattr(grep, 'Pool', pool)
+    yield started
+
+    for started_pool in started:
+        started_pool.terminate()
+
+
+def test_grep(paths, pools):
+    searches = [
+        (CHANNELS, NETWORK, word, nick)
+        for word in WORDS
+        for nick in NICKS + [None]
+    ] * 3
+
+    # A fresh builder each, as they share neither the pool nor the cache.
+    together = in_threads(grep.GrepBuilder(paths).run, searches)
+
+    assert len(pools) == 1
+
+    alone = grep.GrepBuilder(paths)
+    assert together == [alone.run(*search) for search in searches]
+    assert all(together)
+
+
+@pytest.fixture
+def small_cache(monkeypatch):
+    # Small enough that threads are evicting each other's responses.
+    monkeypatch.setattr(response_cache, '_cache', cachetools.LRUCache(maxsize=4096, getsizeof=len))
+
+
+def test_response_cache(small_cache):
+    app = Flask(__name__)
+    renders = []
+
+    def body(key):
+        return '{}\n'.format(key) * (key % 7 + 1) * 20
+
+    def respond(key):
+        def render():
+            renders.append(key)
+            return body(key)
+
+        with app.test_request_context():
+            response = response_cache.respond(('page', key), 'gzip', render, 'text/plain')
+            return response.status_code, response.get_etag()[0], gzip.decompress(response.get_data())
+
+    keys = [(i % 40,) for i in range(400)]
+    together = in_threads(respond, keys)
+
+    assert together == [respond(*key) for key in keys]
+    assert [text for _, _, text in together] == [body(key).encode('utf-8') for key, in keys]
+
+    # Some came from the cache.
+    assert len(renders) < 2 * len(keys)
@@ -0,0 +1,269 @@
+from datetime import date
+from datetime import timedelta
+import os
+import random
+
+import pytest
+
+import config
+import exceptions
+import log_path
+import util
+from acl import PermissiveAccessControl
+
+NETWORK = 'net'
+
+# Gaps, and month and year boundaries.
+DATES = [
+    date(2015, 12, 30),
+    date(2015, 12, 31),
+    date(2016, 1, 1),
+    date(2016, 1, 4),
+    date(2016, 2, 28),
+    date(2016, 2, 29),
+    date(2016, 3, 1),
+    date(2016, 7, 15),
+]
+
+CHANNELS = {
+    '#moffle': DATES,
+    '#other': DATES[2:5],
+}
+
+LAYOUTS = {
+    'LogPath': lambda base, channel, day: os.path.join(
+        base, NETWORK, log_path.LOG_INTERMEDIATE_BASE,
+        'default_{}_{:%Y%m%d}.log'.format(channel, day),
+    ),
+    'DirectoryDelimitedLogPath': lambda base, channel, day: os.path.join(
+        base, NETWORK, channel, '{:%Y%m%d}.log'.format(day),
+    ),
+    'ZNC16DirectoryDelimitedLogPath': lambda base, channel, day: os.path.join(
+        base, NETWORK, log_path.LOG_INTERMEDIATE_BASE, 'default', channel, '{:%Y-%m-%d}.log'.format(day),
+    ),
+}
+
+
+def display(day):
+    return day.strftime('%Y%m%d')
+
+
+def write_tree(base, layout, channels):
+    for channel, days in channels.items():
+        for day in days:
+            path = LAYOUTS[layout](base, channel, day)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            with open(path, 'w') as f:
+                f.write('[00:00:00] <nick> {} {}\n'.format(channel, display(day)))
+
+
+@pytest.fixture(params=sorted(LAYOUTS))
+def paths(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LOG_BASE', str(tmp_path))
+    write_tree(str(tmp_path), request.param, CHANNELS)
+
+    return getattr(log_path, request.param)(PermissiveAccessControl())
+
+
+# What the dict per log file gave, as the search and the log page used it.
+
+def old_between(days, date_begin, date_end):
+    return [
+        day for day in sorted(days)
+        if ((date_begin and date_begin < day) or not date_begin)
+        and ((date_end and date_end >= day) or not date_end)
+    ]
+
+
+def old_neighbours(days, day):
+    dates = [display(d) for d in sorted(days)]
+    i = dates.index(display(day))
+
+    return (
+        dates[i - 1] if i > 0 else None,
+        dates[i + 1] if i < len(dates) - 1 else None,
+    )
+
+
+def test_channel_dates(paths):
+    for channel, days in CHANNELS.items():
+        assert paths.channel_dates(NETWORK, channel) == sorted(map(display, days), reverse=True)
+
+
+def test_index_and_date_obj(paths):
+    logs = paths.channel_logs(NETWORK, '#moffle')
+    day = DATES[0] - timedelta(days=3)
+
+    while day <= DATES[-1] + timedelta(days=3):
+        i = logs.index(display(day))
+
+        if day in DATES:
+            assert i == DATES.index(day)
+            assert logs.dates[i] == display(day)
+            assert logs.date_obj(i) == day
+        else:
+            assert i is None
+
+        day += timedelta(days=1)
+
+
+@pytest.mark.parametrize(
+    "date_begin, date_end",
+    [
+        (None, None),
+        (None, date(2016, 1, 1)),
+        (date(2016, 1, 1), None),
+        (date(2016, 1, 1), date(2016, 3, 1)),
+        (date(2016, 1, 2), date(2016, 2, 28)),
+        (date(2015, 12, 29), date(2015, 12, 30)),
+        (date(2016, 3, 1), date(2016, 3, 1)),
+        (date(2016, 3, 1), date(2016, 1, 1)),
+        (date(2010, 1, 1), date(2011, 1, 1)),
+        (date(2020, 1, 1), None),
+    ],
+)
+def test_between(paths, date_begin, date_end):
+    logs = paths.channel_logs(NETWORK, '#moffle')
+
+    assert [logs.date_obj(i) for i in logs.between(date_begin, date_end)] == old_between(DATES, date_begin, date_end)
+
+
+def test_channels_dates(paths):
+    found = paths.channels_dates(NETWORK, ['#moffle', '#other', '#missing'])
+
+    assert sorted((logs.channel, logs.dates) for logs in found) == sorted(
+        (channel, [display(day) for day in sorted(days)])
+        for channel, days in CHANNELS.items()
+    )
+
+
+def test_log_neighbours_and_text(paths):
+    for channel, days in CHANNELS.items():
+        for day in days:
+            result = paths.log(NETWORK, channel, display(day))
+
+            assert (result.before, result.after) == old_neighbours(days, day)
+            assert list(result.log) == [(1, '[00:00:00] <nick> {} {}\n'.format(channel, display(day)))]
+
+
+def test_log_missing_day(paths):
+    with pytest.raises(exceptions.NoResultsException):
+        paths.log(NETWORK, '#moffle', '20160102')
+
+
+def test_stamp_changes_with_the_file(paths):
+    logs = paths.channel_logs(NETWORK, '#moffle')
+    i = len(logs) - 1
+
+    path, packed, mtime_ns, size = logs.stamp(i)
+
+    assert path == logs.path(i)
+    assert packed is None
+    assert size == os.path.getsize(path)
+
+    with open(path, 'a') as f:
+        f.write('[00:00:01] <nick> more\n')
+    os.utime(path, ns=(mtime_ns + 10 ** 9, mtime_ns + 10 ** 9))
+
+    assert logs.stamp(i) != (path, packed, mtime_ns, size)
+
+
+NAMES = [
+    '#moffle', '#moffle-dev', '#Python', '#python-ja', '#py', 'NickServ',
+    '&local', '#日本語', '#日本', '#a.b', '#x_y', '#$weird?',
+]
+
+
+def old_matching(names, channel):
+    return {name for name in names if channel.lower() in name.lower()}
+
+
+def old_maybe_channel(names, channel):
+    """_maybe_channel as it was, scanning every name: the exception it
+    raised, with its args, or None.
+    """
+    maybe_channels = old_matching(names, channel)
+
+    if len(maybe_channels) > 1:
+        exact = [maybe_channel for maybe_channel in maybe_channels if maybe_channel == channel]
+        if len(exact) != 1:
+            return exceptions.MultipleResultsException, ()
+    elif len(maybe_channels) == 1:
+        canonical_channel = list(maybe_channels)[0]
+
+        if channel != canonical_channel:
+            return exceptions.CanonicalNameException, (util.Scope.CHANNEL, canonical_channel)
+    else:
+        return exceptions.NoResultsException, ()
+
+    return None
+
+
+def needles(names, count=500, seed=0):
+    """Every name, in other cases, and random pieces of names and of
+    names run together.
+    """
+    rng = random.Random(seed)
+    found = ['', 'nope', '#', 'moffle\n#py', 'e#p', '-', '日']
+
+    for name in names:
+        found.extend((name, name.upper(), name.lower(), name.swapcase()))
+
+    joined = '\n'.join(names) + ''.join(names)
+
+    for _ in range(count):
+        start = rng.randrange(len(joined))
+        piece = joined[start:start + rng.randint(1, 6)]
+        found.append(piece.upper() if rng.random() < 0.3 else piece)
+
+    return found
+
+
+def test_channel_index_matching():
+    index = log_path.ChannelIndex(NAMES + NAMES[:3])
+
+    assert index.names == sorted(set(NAMES))
+
+    for needle in needles(NAMES):
+        assert index.matching(needle) == old_matching(NAMES, needle), needle
+
+
+def test_channel_index_empty():
+    index = log_path.ChannelIndex([])
+
+    assert index.matching('#moffle') == set()
+    assert '#moffle' not in index
+
+
+def test_channel_index_contains():
+    index = log_path.ChannelIndex(NAMES)
+
+    for name in NAMES:
+        assert name in index
+        assert name.upper() not in index or name.upper() in NAMES
+
+
+def test_maybe_channel(tmp_path, monkeypatch):
+    for layout in sorted(LAYOUTS):
+        base = tmp_path / layout
+        monkeypatch.setattr(config, 'LOG_BASE', str(base))
+        write_tree(str(base), layout, {name: DATES[:1] for name in NAMES})
+
+        paths = getattr(log_path, layout)(PermissiveAccessControl())
+        index = paths._channel_index(NETWORK)
+
+        assert index.names == sorted(NAMES)
+
+        for needle in needles(NAMES, count=100):
+            try:
+                paths._maybe_channel(NETWORK, needle, index)
+                raised = None
+            except (
+                exceptions.NoResultsException,
+                exceptions.MultipleResultsException,
+                exceptions.CanonicalNameException,
+            ) as ex:
+                raised = type(ex), ex.args
+
+            assert raised == old_maybe_channel(NAMES, needle), (layout, needle)
@@ -0,0 +1,81 @@
+from datetime import date
+
+import pytest
+
+import looseboy
+
+# A Wednesday.
+TODAY = date(2016, 3, 9)
+LATEST = '20160301'
+
+
+@pytest.fixture
+def parser():
+    return looseboy.LooseDateParser()
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        # Literals
+        ('today', '20160309'),
+        ('Today', '20160309'),
+        ('yesterday', '20160308'),
+        ('latest', LATEST),
+
+        # Weekdays, this one or the last
+        ('wednesday', '20160309'),
+        ('monday', '20160307'),
+        ('Thursday', '20160303'),
+        ('sunday', '20160306'),
+
+        # Full dates
+        ('20160102', '20160102'),
+        ('2016-01-02', '20160102'),
+        ('2016/1/2', '20160102'),
+        ('160102', '20160102'),
+        ('990102', '19990102'),
+
+        # Day first when it can't be a month
+        ('2016-13-02', '20160213'),
+        ('2016-02-13', '20160213'),
+
+        # Short forms, in the last year
+        ('01-02', '20160102'),
+        ('3.9', '20160309'),
+        ('03-10', '20150310'),
+        ('12/25', '20151225'),
+        ('25/12', '20151225'),
+
+        ('nope', None),
+        ('', None),
+    ],
+)
+def test_parse(parser, text, expected):
+    assert parser.parse(text, LATEST, TODAY) == expected
+
+
+def test_latest_does_not_leak(parser):
+    for latest in ('20160301', '20150101', '20160301', None):
+        assert parser.parse('latest', latest, TODAY) == latest
+
+    # Nothing else depends on it.
+    assert parser.parse('01-02', '20150101', TODAY) == parser.parse('01-02', '20160301', TODAY)
+
+
+def test_today_does_not_leak(parser):
+    assert parser.parse('today', LATEST, TODAY) == '20160309'
+    assert parser.parse('today', LATEST, date(2017, 1, 1)) == '20170101'
+    assert parser.parse('today', LATEST, TODAY) == '20160309'
+
+    # The year a short form falls in moves with today.
+    assert parser.parse('12/25', LATEST, TODAY) == '20151225'
+    assert parser.parse('12/25', LATEST, date(2016, 12, 31)) == '20161225'
+
+
+def test_parsers_share_nothing():
+    first, second = looseboy.LooseDateParser(), looseboy.LooseDateParser()
+
+    assert first.parse('latest', '20160101', TODAY) == '20160101'
+    assert second.parse('latest', '20170101', TODAY) == '20170101'
+    assert first.parse('latest', '20160101', TODAY) == '20160101'
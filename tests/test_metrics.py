@@ -0,0 +1,24 @@
+import fastcache
+
+import metrics
+
+
+@fastcache.clru_cache(maxsize=16)
+def double(x):
+    return 2 * x
+
+
+def test_caches_counted_from_the_fork():
+    double.cache_clear()
+
+    # Warming up, before the fork.
+    double(1)
+    double(1)
+
+    store = metrics.Store([], [('double', double)], 1)
+
+    double(1)
+    double(2)
+    store.refresh_caches(force=True)
+
+    assert store.total(('cache', 'double'), 2) == [1, 1]
@@ -0,0 +1,166 @@
+import os
+
+import pytest
+
+import config
+import grep
+import log_path
+import pack
+from acl import PermissiveAccessControl
+
+DAYS = [
+    ('20161001', b'[10:00:00] <alice> hello\n[10:00:05] * bob waves\n'),
+    ('20161002', b''),
+    ('20161003', b'[09:30:00] *** Joins: carol (c@example.com)\n[23:59:59] <carol> see old.pack:7:thing\n[23:59:59] no newline'),
+]
+
+
+@pytest.fixture
+def pack_path(tmp_path):
+    return str(tmp_path / 'default_#chan_201610.pack')
+
+
+def grep_lines(path):
+    """Every line of the pack as grep -n -H prints it."""
+    with open(path, 'rb') as f:
+        return [
+            '{}:{}:{}'.format(path, line_no, line.decode('utf-8').rstrip('\n'))
+            for line_no, line in enumerate(f, start=1)
+        ]
+
+
+@pytest.mark.parametrize("columns", [False, True])
+def test_round_trip(pack_path, columns):
+    pack.write(pack_path, '#chan', DAYS, columns=columns)
+
+    header = pack.read_header(pack_path)
+
+    assert header.channel == '#chan'
+    assert pack.dates(pack_path) == [date for date, _ in DAYS]
+    assert not os.path.exists(pack_path + pack.TEMP_SUFFIX)
+    assert not os.path.exists(pack_path + pack.HEADER_SUFFIX + pack.TEMP_SUFFIX)
+
+    for date, raw in DAYS:
+        text = raw.decode('utf-8')
+        # Days are kept newline-terminated.
+        if text and not text.endswith('\n'):
+            text += '\n'
+
+        assert ''.join(pack.read_day(pack_path, date)) == text
+
+    # Nothing but log lines in the pack itself.
+    with open(pack_path, 'rb') as f:
+        assert not f.read().startswith(pack.MAGIC)
+
+    if columns:
+        (times, types, nicks), nick_table = pack.read_columns(pack_path, '20161003')
+
+        assert list(times) == [9 * 3600 + 30 * 60, 86399, 86399]
+        assert [pack.LINE_TYPES[t] if t != pack.NONE_TYPE else None for t in types] == ['join', 'normal', None]
+        assert [nick_table[n] if n != pack.NONE_ID else None for n in nicks] == ['carol', 'carol', None]
+    else:
+        assert pack.read_columns(pack_path, '20161003') is None
+
+
+def test_locate(pack_path):
+    pack.write(pack_path, '#chan', DAYS)
+
+    assert [pack.locate(pack_path, line_no) for line_no in range(1, 7)] == [
+        ('20161001', 1),
+        ('20161001', 2),
+        ('20161003', 1),
+        ('20161003', 2),
+        ('20161003', 3),
+        None,
+    ]
+
+
+def test_interrupted_rewrite(pack_path, monkeypatch):
+    """Days merged in, and the pack read between its two renames."""
+    pack.write(pack_path, '#chan', DAYS[:1])
+    assert pack.dates(pack_path) == ['20161001']
+
+    rename = os.rename
+    seen = []
+
+    def interrupted(src, dst):
+        rename(src, dst)
+
+        if dst == pack_path:
+            seen.append(pack.dates(pack_path))
+            seen.append(pack.read_day(pack_path, '20161003'))
+
+    monkeypatch.setattr(os, 'rename', interrupted)
+    pack.write(pack_path, '#chan', DAYS)
+
+    assert seen == [[date for date, _ in DAYS], pack.read_day(pack_path, '20161003')]
+    assert pack.dates(pack_path) == [date for date, _ in DAYS]
+
+
+def test_crash_before_header_moves_in(pack_path, monkeypatch):
+    pack.write(pack_path, '#chan', DAYS[:1])
+    rename = os.rename
+
+    def crash(src, dst):
+        if dst == pack_path + pack.HEADER_SUFFIX:
+            raise OSError("Crashed")
+        rename(src, dst)
+
+    monkeypatch.setattr(os, 'rename', crash)
+
+    with pytest.raises(OSError):
+        pack.write(pack_path, '#chan', DAYS)
+
+    assert pack.dates(pack_path) == [date for date, _ in DAYS]
+    assert pack.locate(pack_path, 3) == ('20161003', 1)
+
+
+def test_unreadable_pack_is_left_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LOG_BASE', str(tmp_path))
+    channel_base = tmp_path / 'net' / log_path.LOG_INTERMEDIATE_BASE
+    channel_base.mkdir(parents=True)
+
+    good = str(channel_base / 'default_#chan_201610.pack')
+    pack.write(good, '#chan', DAYS)
+    (channel_base / 'default_#chan_201611.pack').write_bytes(b'[00:00:00] <mallory> no header\n')
+
+    logs = log_path.LogPath(PermissiveAccessControl())._list_catalog(str(channel_base))['#chan']
+
+    assert list(logs.packed) == [date for date, _ in DAYS]
+
+
+def test_mismatched_header_is_refused(pack_path):
+    pack.write(pack_path, '#chan', DAYS)
+
+    with open(pack_path, 'ab') as f:
+        f.write(b'[00:00:00] <mallory> extra\n')
+
+    with pytest.raises(ValueError):
+        pack.read_header(pack_path)
+
+
+def test_grep_lines_map_to_days(pack_path):
+    pack.write(pack_path, '#chan', DAYS)
+    lines = grep_lines(pack_path)
+
+    line = grep._process_pack_line(grep.PACK_LINE_REGEX.match(lines[3]))
+
+    # Not fooled by the pack name quoted in the message.
+    assert line == grep.Line('#chan', '20161003', ':', '2', '[23:59:59] <carol> see old.pack:7:thing')
+
+
+def test_grep_hits_split_by_day(pack_path):
+    pack.write(pack_path, '#chan', DAYS)
+    lines = grep_lines(pack_path)
+
+    # A hit on line 3 with context either side, spilling into the day before.
+    group = '\n'.join([
+        lines[1].replace(':2:', '-2-', 1),
+        lines[2],
+        lines[3].replace(':4:', '-4-', 1),
+    ])
+
+    hit, = grep._process_hit(group)
+
+    assert (hit.channel, hit.date, hit.begin) == ('#chan', '20161003', '1')
+    assert [(line.line_marker, line.line_no) for line in hit.lines] == [(':', '1'), ('-', '2')]
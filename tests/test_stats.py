@@ -0,0 +1,148 @@
+from datetime import date
+from datetime import timedelta
+import os
+
+import pytest
+
+import archive
+import config
+import log_path
+import packer
+import stats
+from acl import PermissiveAccessControl
+
+NETWORK = 'net'
+CHANNEL = '#chan'
+
+# Steps a day's log is written in, one splitting a line and one ending
+# part of the way through the next.
+STEPS = [
+    '[00:01:00] <alice> hello\n[00:02:00] *** Joins: bob (bob@example.com)\n',
+    '[01:00:00] <bob> hi\n[01:30:00] * bob waves\n[02:00:00] <alice> how are',
+    ' you?\n[02:00:05] <carol> fine\n',
+    '[03:00:00] *** Quits: bob (bye)\n[23:59:59] <alice> unfinish',
+]
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LOG_BASE', str(tmp_path / 'logs'))
+    monkeypatch.setattr(config, 'STATS_DIR', str(tmp_path / 'stats'))
+
+    return log_path.LogPath(PermissiveAccessControl())
+
+
+def log_file(day):
+    return os.path.join(
+        config.LOG_BASE, NETWORK, log_path.LOG_INTERMEDIATE_BASE,
+        'default_{}_{:%Y%m%d}.log'.format(CHANNEL, day),
+    )
+
+
+def append(day, text):
+    path = log_file(day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'a') as f:
+        f.write(text)
+
+
+def full_count(text):
+    """The stats of ``text`` counted in one go."""
+    tally = stats.Tally()
+    tally.add_text(text.encode('utf-8'))
+
+    return tally.stats()
+
+
+def whole_lines(text):
+    return text[:text.rfind('\n') + 1]
+
+
+def channel_logs(paths):
+    # Straight from the directory, not the listing cached on its mtime:
+    # files come and go here faster than that ticks.
+    return paths._list_catalog(os.path.dirname(log_file(date.today())))[CHANNEL]
+
+
+def test_open_day_counted_in_steps(paths):
+    today = date.today()
+    day = '{:%Y%m%d}'.format(today)
+    written = ''
+
+    for step in STEPS:
+        append(today, step)
+        written += step
+
+        counted = stats.update(channel_logs(paths), NETWORK, backfill=False)
+
+        assert counted.days[day] == full_count(whole_lines(written))
+        assert day not in counted.final
+
+    # And again from what was saved.
+    assert stats.load(NETWORK, CHANNEL).days[day] == full_count(whole_lines(written))
+
+
+def test_half_written_line_is_no_change(paths):
+    today = date.today()
+    append(today, STEPS[0])
+    counted = stats.update(channel_logs(paths), NETWORK, backfill=False)
+    saved = os.stat(stats.store_path(NETWORK, CHANNEL, stats.OPEN_SUFFIX))
+
+    append(today, '[05:00:00] <alice> still typ')
+
+    assert stats.update(channel_logs(paths), NETWORK, backfill=False).days == counted.days
+    assert os.stat(stats.store_path(NETWORK, CHANNEL, stats.OPEN_SUFFIX)).st_mtime_ns == saved.st_mtime_ns
+
+
+def test_day_closing_counts_the_rest(paths, monkeypatch):
+    today = date.today()
+    day = '{:%Y%m%d}'.format(today)
+    text = ''.join(STEPS)
+
+    append(today, text)
+    stats.update(channel_logs(paths), NETWORK, backfill=False)
+
+    class Tomorrow(date):
+        @classmethod
+        def today(cls):
+            return today + timedelta(days=1)
+
+    monkeypatch.setattr(stats, 'date', Tomorrow)
+    counted = stats.update(channel_logs(paths), NETWORK, backfill=False)
+
+    assert counted.days[day] == full_count(text)
+    assert day in counted.final
+    assert day not in counted.open_nicks
+
+
+def without_size(day_stats):
+    # Packs keep days newline-terminated.
+    return day_stats._replace(size=None)
+
+
+def test_closed_day_counted_alike_however_kept(paths):
+    day = date.today().replace(day=1) - timedelta(days=40)
+    display = '{:%Y%m%d}'.format(day)
+    text = ''.join(STEPS)
+
+    append(day, text)
+    plain = stats._count(channel_logs(paths), 0, None, (), True).stats()
+
+    archive.compress(log_file(day))
+    logs = channel_logs(paths)
+    compressed = stats._count(logs, 0, None, (), True).stats()
+
+    assert archive.is_compressed(logs.path(0))
+    assert plain == compressed == full_count(text)
+
+    for columns in (False, True):
+        for path in os.listdir(os.path.dirname(log_file(day))):
+            os.unlink(os.path.join(os.path.dirname(log_file(day)), path))
+
+        append(day, text)
+        packer.pack_channel(paths, NETWORK, CHANNEL, columns)
+        logs = channel_logs(paths)
+
+        assert logs.packed[0] == display
+        assert without_size(stats._count(logs, 0, None, (), True).stats()) == without_size(plain)
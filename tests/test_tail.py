@@ -0,0 +1,200 @@
+from datetime import date
+from datetime import timedelta
+import os
+import threading
+
+import pytest
+
+import config
+import tail
+
+TAIL_LINES = 5
+
+# Idle polls before giving up on an event that should have come.
+PATIENCE = 200
+
+
+@pytest.fixture(autouse=True)
+def polling(monkeypatch):
+    monkeypatch.setattr(tail, 'INotify', None)
+    monkeypatch.setattr(config, 'TAIL_POLL_INTERVAL', 0.01)
+    monkeypatch.setattr(config, 'TAIL_KEEPALIVE', 0.02)
+    monkeypatch.setattr(config, 'TAIL_LINES', TAIL_LINES)
+
+
+@pytest.fixture
+def log(tmp_path):
+    return str(tmp_path / 'default_#chan_today.log')
+
+
+def display(day):
+    return day.strftime('%Y%m%d')
+
+
+TODAY = display(date.today())
+
+
+def append(path, text):
+    with open(path, 'a') as f:
+        f.write(text)
+
+
+def lines(start, stop):
+    return ''.join('[00:00:{:02d}] <nick> line {}\n'.format(i % 60, i) for i in range(start, stop))
+
+
+def next_event(events):
+    """The next event that isn't a keepalive."""
+    for _ in range(PATIENCE):
+        event = next(events)
+
+        if not event.startswith(': keepalive'):
+            return event
+
+    raise AssertionError("Nothing came")
+
+
+def ids(event):
+    return [line[len('id: '):] for line in event.split('\n') if line.startswith('id: ')]
+
+
+def line_ids(day, start, stop):
+    return ['{}:{}'.format(day, line_no) for line_no in range(start, stop)]
+
+
+def followers(path):
+    return [thread for thread in threading.enumerate() if thread.name == 'tail {}'.format(path)]
+
+
+def stopped(path):
+    """Whether every follower of ``path`` stops soon."""
+    for thread in followers(path):
+        thread.join(1)
+
+    return not followers(path)
+
+
+def test_last_lines_then_new_ones(log):
+    append(log, lines(1, 9))
+    events = tail.stream(log, TODAY)
+
+    assert ids(next_event(events)) == line_ids(TODAY, 4, 9)
+
+    append(log, lines(9, 11))
+
+    assert ids(next_event(events)) == line_ids(TODAY, 9, 11)
+
+    events.close()
+
+
+def test_partial_line_held_back(log):
+    append(log, lines(1, 3) + '[00:00:03] <nick> half a li')
+    events = tail.stream(log, TODAY)
+
+    assert ids(next_event(events)) == line_ids(TODAY, 1, 3)
+
+    append(log, 'ne\n')
+    event = next_event(events)
+
+    assert ids(event) == line_ids(TODAY, 3, 4)
+    assert 'half a line' in event
+
+    events.close()
+
+
+@pytest.mark.parametrize(
+    "last_event_id, start",
+    [
+        (None, 6),
+        ('{}:7'.format(TODAY), 8),
+        ('{}:2'.format(TODAY), 6),
+        ('{}:0'.format(TODAY), 6),
+        # Another day's, or not one of ours.
+        ('20000101:7', 6),
+        ('{}:seven'.format(TODAY), 6),
+        ('nonsense', 6),
+    ],
+)
+def test_resume(log, last_event_id, start):
+    """Last-Event-ID and ?after= both end up here."""
+    append(log, lines(1, 11))
+    events = tail.stream(log, TODAY, last_event_id)
+
+    assert ids(next_event(events)) == line_ids(TODAY, start, 11)
+
+    events.close()
+
+
+def test_resume_past_the_end(log):
+    """Only what comes next, once the follower has read what's there."""
+    append(log, lines(1, 11))
+    events = tail.stream(log, TODAY, '{}:99'.format(TODAY))
+
+    later = threading.Timer(0.2, append, (log, lines(11, 12)))
+    later.start()
+
+    assert ids(next_event(events)) == line_ids(TODAY, 11, 12)
+
+    later.join()
+    events.close()
+
+
+def test_truncation_closes(log):
+    append(log, lines(1, 4))
+    events = tail.stream(log, TODAY)
+    next_event(events)
+
+    with open(log, 'w') as f:
+        f.write(lines(1, 2))
+
+    assert next_event(events) == 'event: closed\ndata: {}\n\n'.format(TODAY)
+    assert stopped(log)
+
+
+def test_removal_closes(log):
+    append(log, lines(1, 4))
+    events = tail.stream(log, TODAY)
+    next_event(events)
+
+    os.unlink(log)
+
+    assert next_event(events) == 'event: closed\ndata: {}\n\n'.format(TODAY)
+
+
+def test_rollover_closes(log):
+    """Once yesterday's log stops changing, today's has taken over."""
+    yesterday = display(date.today() - timedelta(days=1))
+    append(log, lines(1, 4))
+    events = tail.stream(log, yesterday)
+
+    assert ids(next_event(events)) == line_ids(yesterday, 1, 4)
+    assert next_event(events) == 'event: closed\ndata: {}\n\n'.format(yesterday)
+
+
+def test_watchers_share_a_follower(log):
+    append(log, lines(1, 4))
+    first = tail.stream(log, TODAY)
+    second = tail.stream(log, TODAY)
+
+    assert ids(next_event(first)) == ids(next_event(second)) == line_ids(TODAY, 1, 4)
+    assert len(followers(log)) == 1
+    assert tail._followers[log].watchers == 2
+
+    append(log, lines(4, 5))
+
+    assert ids(next_event(first)) == ids(next_event(second)) == line_ids(TODAY, 4, 5)
+
+    first.close()
+    assert tail._followers[log].watchers == 1
+
+    second.close()
+    assert log not in tail._followers
+    assert stopped(log)
+
+    # A new watcher starts afresh.
+    third = tail.stream(log, TODAY)
+
+    assert ids(next_event(third)) == line_ids(TODAY, 1, 5)
+    assert len(followers(log)) == 1
+
+    third.close()
@@ -1,4 +1,6 @@
 from time import asctime
+import errno
+import os
 
 CONTEXT_PROCESSORS = []
 
@@ -7,6 +9,19 @@ TEMPLATE_FILTERS = []
 def log(message):
     print('{}  {}'.format(asctime(), message))
 
+def private_dir(path):
+    """Make directory ``path`` for our own use, or check that the one there
+    is ours: owned by us and writable by no one else, who could otherwise
+    plant files in it for us to trust. Raises PermissionError if not.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.stat(path)
+
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise PermissionError(errno.EPERM, "Not a private directory", path)
+
+    return path
+
 def delay_context_processor(f):
     CONTEXT_PROCESSORS.append(f)
     return f
@@ -21,9 +36,9 @@ def delay_template_filter(filter_name):
         return f
     return inner
 
-def register_template_filters(app):
+def register_template_filters(app, wrap=None):
     for filter_name, tf in TEMPLATE_FILTERS:
-        app.template_filter(filter_name)(tf)
+        app.template_filter(filter_name)(wrap(tf) if wrap else tf)
 
 class Scope:
     ROOT = "root"